@@ -0,0 +1 @@
+# 全站共用模組 (Google API 連線池、資料存取層)
@@ -0,0 +1,55 @@
+import inspect
+import threading
+import streamlit as st
+
+# ==========================================
+# 依工作表範圍精準清除快取 (取代全域 st.cache_data.clear())
+# ==========================================
+# 每個讀取試算表的 @st.cache_data 函式以 @depends_on 宣告它讀了哪些工作表，
+# 寫入後呼叫 invalidate(SHEET_ID, 工作表名稱)，只清除讀取該工作表的快取，
+# 其餘 (Drive 佐證圖片、冷媒係數表、其他模組資料) 一律保留。
+#
+#   @depends_on(SHEET_ID, "油料填報紀錄")     # 只依賴指定工作表
+#   @st.cache_data(ttl=600)
+#   def load_xxx(): ...
+#
+#   @depends_on(SHEET_ID)                   # 不指定工作表 = 依賴整份試算表
+#
+# 註冊表為全站共用，A 頁面寫入可同步清除 B 頁面讀取同一工作表的快取。
+
+@st.cache_resource(show_spinner=False)
+def _registry():
+    return {}, threading.Lock()
+
+def _func_key(cached_func):
+    raw = inspect.unwrap(cached_func)
+    code = getattr(raw, "__code__", None)
+    filename = code.co_filename if code else getattr(raw, "__module__", "")
+    return f"{filename}:{getattr(raw, '__qualname__', repr(raw))}"
+
+def depends_on(sheet_id, *worksheet_titles):
+    deps = frozenset((sheet_id, t) for t in worksheet_titles) if worksheet_titles else frozenset([(sheet_id, None)])
+
+    def decorator(cached_func):
+        registry, lock = _registry()
+        # 頁面每次重跑都會重新定義函式，以「檔案 + 函式名稱」為鍵覆蓋，不會無限增長
+        with lock: registry[_func_key(cached_func)] = (cached_func, deps)
+        return cached_func
+    return decorator
+
+def invalidate(sheet_id, *worksheet_titles, exclude=None):
+    """清除讀取指定工作表 (未指定則為整份試算表) 的快取，回傳清除的函式數量；exclude (單一或 tuple) 可保留已寫穿更新的快取"""
+    registry, lock = _registry()
+    with lock: entries = list(registry.values())
+    keep = exclude if isinstance(exclude, tuple) else (exclude,)
+
+    cleared = 0
+    for cached_func, deps in entries:
+        if any(cached_func is k for k in keep if k is not None): continue
+        if worksheet_titles:
+            hit = (sheet_id, None) in deps or any((sheet_id, t) in deps for t in worksheet_titles)
+        else:
+            hit = any(dep_sheet == sheet_id for dep_sheet, _ in deps)
+        if hit:
+            cached_func.clear(); cleared += 1
+    return cleared
@@ -0,0 +1,134 @@
+import io
+import os
+import time
+import uuid
+import sqlite3
+import hashlib
+import tempfile
+import threading
+import streamlit as st
+from googleapiclient.http import MediaIoBaseDownload
+from core.gsheets import get_drive_service
+
+# ==========================================
+# Drive 佐證檔案磁碟快取 (內容定址，全站共用)
+# ==========================================
+# 填報預覽、資料檢視、Word 匯出、鋼瓶回報都透過 get_drive_file() 取得佐證檔案，重啟或 st.cache_data.clear() 後仍保留：
+#   - 檔案內容以 md5Checksum 命名存放 (內容定址)，不同檔案 ID 內容相同只存一份
+#   - 索引記錄 檔案 ID → md5Checksum / modifiedTime / 檔名 / 類型；取用前向 Drive 查詢中繼資料比對，
+#     檔案被覆蓋 (md5 或修改時間改變) 即重新下載；VALIDATE_TTL 秒內已比對過的不再重複查詢
+#   - 總量超過 DRIVE_CACHE_MAX_MB 時依最後取用時間淘汰 (LRU)
+# Google 原生文件沒有 md5Checksum，改以「檔案 ID + 修改時間」的雜湊作為內容鍵。
+# [防護機制] 快取目錄權限為 0700 (佐證含個資，共用主機的其他帳號不可讀寫)；命中時重新核對 md5，內容不符視為未命中重新下載。
+
+DRIVE_CACHE_DIR = os.environ.get("NCYU_DRIVE_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "ncyu_drive_cache")
+DRIVE_CACHE_MAX_MB = int(os.environ.get("NCYU_DRIVE_CACHE_MB", "512"))
+VALIDATE_TTL = 600   # 中繼資料比對間隔 (秒)
+EVICT_TO = 0.9       # 超過上限時淘汰至上限的 90%，避免每次寫入都觸發淘汰
+META_FIELDS = "id, name, mimeType, md5Checksum, modifiedTime"
+
+@st.cache_resource(show_spinner=False)
+def _store():
+    for path in (DRIVE_CACHE_DIR, os.path.join(DRIVE_CACHE_DIR, "blobs")):
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        os.chmod(path, 0o700)  # 目錄已存在時 makedirs 不會套用 mode
+    conn = sqlite3.connect(os.path.join(DRIVE_CACHE_DIR, "index.sqlite3"), check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS files (file_id TEXT PRIMARY KEY, blob TEXT, name TEXT, mime TEXT, md5 TEXT, modified TEXT, checked_at REAL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS blobs (blob TEXT PRIMARY KEY, size INTEGER, accessed_at REAL)")
+    conn.commit()
+    return conn, threading.RLock(), {"hits": 0, "misses": 0, "validations": 0, "evictions": 0}
+
+def download_drive_bytes(drive_srv, file_id):
+    """直接下載 Drive 檔案內容 (bytes，不經快取)；失敗時拋出例外"""
+    fh = io.BytesIO()
+    downloader = MediaIoBaseDownload(fh, drive_srv.files().get_media(fileId=file_id))
+    done = False
+    while not done: _, done = downloader.next_chunk()
+    return fh.getvalue()
+
+def _blob_key(file_id, meta):
+    return meta.get("md5Checksum") or hashlib.md5(f"{file_id}:{meta.get('modifiedTime', '')}".encode("utf-8")).hexdigest()
+
+def _blob_path(blob):
+    return os.path.join(DRIVE_CACHE_DIR, "blobs", blob)
+
+def get_drive_meta(file_id, drive_srv=None):
+    """取得檔案中繼資料 (name / mimeType / md5Checksum / modifiedTime)；VALIDATE_TTL 內沿用索引"""
+    conn, lock, stats = _store()
+    with lock: row = conn.execute("SELECT name, mime, md5, modified, checked_at, blob FROM files WHERE file_id = ?", (file_id,)).fetchone()
+    cached = {"id": file_id, "name": row[0], "mimeType": row[1], "md5Checksum": row[2], "modifiedTime": row[3]} if row else None
+    if row and time.time() - row[4] < VALIDATE_TTL: return cached
+    try:
+        meta = (drive_srv or get_drive_service()).files().get(fileId=file_id, fields=META_FIELDS).execute()
+    except Exception:
+        # [防護機制] Drive 暫時無法連線時沿用已快取的版本
+        if cached: return cached
+        raise
+    with lock:
+        stats["validations"] += 1
+        if row and _blob_key(file_id, meta) == row[5]:
+            conn.execute("UPDATE files SET name = ?, mime = ?, checked_at = ? WHERE file_id = ?", (meta.get("name"), meta.get("mimeType"), time.time(), file_id))
+        elif row:
+            conn.execute("DELETE FROM files WHERE file_id = ?", (file_id,))  # 檔案已被覆蓋，舊內容留待 LRU 淘汰
+        conn.commit()
+    return meta
+
+def get_drive_file(file_id, drive_srv=None):
+    """取得 (檔案內容 bytes, 中繼資料)；快取未命中才下載。失敗時拋出例外"""
+    conn, lock, stats = _store()
+    meta = get_drive_meta(file_id, drive_srv)
+    blob = _blob_key(file_id, meta)
+    try:
+        with open(_blob_path(blob), "rb") as f: data = f.read()
+    except OSError: data = None
+    if data is not None and meta.get("md5Checksum") and hashlib.md5(data).hexdigest() != meta["md5Checksum"]:
+        # 快取檔內容毀損或遭竄改：刪除後重新下載
+        try: os.remove(_blob_path(blob))
+        except OSError: pass
+        data = None
+
+    now = time.time()
+    if data is not None:
+        with lock:
+            stats["hits"] += 1
+            conn.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)", (blob, len(data), now))
+            conn.execute("INSERT OR IGNORE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", (file_id, blob, meta.get("name"), meta.get("mimeType"), meta.get("md5Checksum"), meta.get("modifiedTime"), now))
+            conn.commit()
+        return data, meta
+
+    data = download_drive_bytes(drive_srv or get_drive_service(), file_id)
+    with lock: stats["misses"] += 1
+    # 下載途中檔案被覆蓋 (內容與中繼資料不符) 時不寫入快取
+    if meta.get("md5Checksum") and hashlib.md5(data).hexdigest() != meta["md5Checksum"]: return data, meta
+
+    tmp = f"{_blob_path(blob)}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "wb") as f: f.write(data)
+    os.replace(tmp, _blob_path(blob))
+    with lock:
+        conn.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)", (blob, len(data), now))
+        conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", (file_id, blob, meta.get("name"), meta.get("mimeType"), meta.get("md5Checksum"), meta.get("modifiedTime"), now))
+        conn.commit()
+        _evict(conn, stats)
+    return data, meta
+
+def _evict(conn, stats):
+    limit = DRIVE_CACHE_MAX_MB * 1024 * 1024
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+    if total <= limit: return
+    for blob, size in conn.execute("SELECT blob, size FROM blobs ORDER BY accessed_at").fetchall():
+        if total <= limit * EVICT_TO: break
+        try: os.remove(_blob_path(blob))
+        except FileNotFoundError: pass
+        conn.execute("DELETE FROM blobs WHERE blob = ?", (blob,))
+        conn.execute("DELETE FROM files WHERE blob = ?", (blob,))
+        total -= size
+        stats["evictions"] += 1
+    conn.commit()
+
+def drive_cache_stats():
+    """回傳快取檔案數、總位元組數與命中 / 未命中 / 比對 / 淘汰次數"""
+    conn, lock, stats = _store()
+    with lock:
+        count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {"files": count, "bytes": size, "max_bytes": DRIVE_CACHE_MAX_MB * 1024 * 1024, **stats}
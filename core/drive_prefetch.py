@@ -0,0 +1,70 @@
+import time
+import random
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# ==========================================
+# 佐證檔案並行預先下載 (Drive Prefetch)
+# ==========================================
+# Word 匯出原本逐檔下載、下載完才排版，耗時 = 檔案數 × 單檔延遲。改為：
+#   1. 先收集整份匯出用到的 Drive 檔案 ID (依文件順序、去重)
+#   2. 以有上限的執行緒池並行下載，每個檔案各自重試 (指數退避)
+#   3. 排版時依序 get(fid) 取用結果；只預先下載前方 PREFETCH_AHEAD 個檔案，記憶體不隨檔案數增長
+# 工作執行緒只負責下載位元組；PDF 轉圖 (PyMuPDF 不保證執行緒安全) 由取用端在主執行緒進行。
+# 下載使用 core.gsheets 建立的 Drive 服務 (每個請求獨立 Http，可跨執行緒使用) 並經過 core.drive_cache 磁碟快取，
+# 流量仍受 core.rate_limit 控管，優先序沿用呼叫端 (contextvars 複製到工作執行緒)。
+#
+#   with DrivePrefetch(file_ids, lambda fid: get_drive_file(fid, drive_srv)[0]) as prefetch:   # 離開 (含例外) 時關閉執行緒池
+#       for fid in file_ids: data = prefetch.get(fid, None)   # 重試用盡：有給預設值則回傳預設值，否則拋出原例外
+
+PREFETCH_WORKERS = 6     # 同時下載數 (Drive 令牌桶瞬間可用量 50，保留給其他 session)
+PREFETCH_AHEAD = 24      # 尚未取用的預先下載上限 (原始檔單檔可能數 MB)
+PREFETCH_RETRIES = 3
+
+_MISSING = object()
+
+def _fetch_with_retry(fetch, file_id, retries):
+    for attempt in range(retries + 1):
+        try: return fetch(file_id)
+        except Exception:
+            if attempt >= retries: raise
+            # [防護機制] 指數退避加隨機抖動，避免同批失敗的檔案同時重試
+            time.sleep(min(2 ** attempt, 8) + random.random())
+
+class DrivePrefetch:
+    def __init__(self, file_ids, fetch, workers=PREFETCH_WORKERS, ahead=PREFETCH_AHEAD, retries=PREFETCH_RETRIES):
+        self.ids = list(dict.fromkeys(f for f in file_ids if f))
+        self.pos = {fid: i for i, fid in enumerate(self.ids)}
+        self.fetch, self.ahead, self.retries = fetch, ahead, retries
+        self.pool = ThreadPoolExecutor(max_workers=max(1, min(workers, len(self.ids))), thread_name_prefix="drive-prefetch") if self.ids else None
+        self.futures = {}
+        self.submitted = 0
+        self._fill(ahead)
+
+    def __repr__(self):
+        return f"DrivePrefetch({self.submitted}/{len(self.ids)})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _fill(self, upto):
+        while self.submitted < min(upto, len(self.ids)):
+            fid = self.ids[self.submitted]
+            self.futures[fid] = self.pool.submit(contextvars.copy_context().run, _fetch_with_retry, self.fetch, fid, self.retries)
+            self.submitted += 1
+
+    def get(self, file_id, default=_MISSING):
+        """取得 file_id 的下載結果 (等待下載完成)，並往後補滿預先下載；每個結果只保留到被取用為止"""
+        if file_id in self.pos: self._fill(self.pos[file_id] + 1 + self.ahead)
+        future = self.futures.pop(file_id, None)
+        try: return future.result() if future else _fetch_with_retry(self.fetch, file_id, self.retries)
+        except Exception:
+            if default is _MISSING: raise
+            return default
+
+    def close(self):
+        self.futures.clear()
+        if self.pool: self.pool.shutdown(wait=False, cancel_futures=True)
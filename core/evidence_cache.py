@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+import streamlit as st
+from core.drive_cache import get_drive_file
+
+# ==========================================
+# 佐證檔案記憶體快取 (依位元組上限淘汰)
+# ==========================================
+# 原本以 @st.cache_data(max_entries=100) 快取「原始檔 + 整批 PIL 圖片」，上限只算筆數不算大小，
+# 翻閱數個月單據即可佔用數 GB 導致主機 OOM。改為全站共用一個依位元組計算的 LRU：
+#   - raw   ：原始檔案位元組 (下載按鈕、PDF 轉圖來源)，未命中時由 core.drive_cache 磁碟快取讀取
+#   - page  ：PDF 單頁預覽 (PNG 壓縮位元組，core.pdf_preview)
+#   - info  ：頁數、方向等小型資訊
+# 分層存放、各自計算大小；總量超過 EVIDENCE_CACHE_MB 時淘汰最久未使用者，單筆超過上限的 1/4 不快取。
+# 快取內只放壓縮過的位元組，不存解碼後的 PIL 圖片。evidence_cache_caption() 顯示目前用量。
+
+EVIDENCE_CACHE_MB = int(os.environ.get("NCYU_EVIDENCE_CACHE_MB", "512"))
+EVIDENCE_TTL = 86400
+
+class ByteBudgetCache:
+    def __init__(self, budget_bytes, ttl=EVIDENCE_TTL):
+        self.budget, self.ttl = budget_bytes, ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # key -> (value, size, stored_at)
+        self.total = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def __repr__(self):
+        return f"ByteBudgetCache({self.total}/{self.budget} bytes, {len(self.entries)} entries)"
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.time() - entry[2] > self.ttl:
+                if entry is not None: self._drop(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        with self.lock:
+            if key in self.entries: self._drop(key)
+            if size > self.budget // 4: return value
+            self.entries[key] = (value, size, time.time())
+            self.total += size
+            while self.total > self.budget and self.entries:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+        return value
+
+    def _drop(self, key):
+        self.total -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total = 0
+
+    def stats(self):
+        with self.lock:
+            tiers = {}
+            for key, (_, size, _) in self.entries.items():
+                count, used = tiers.get(key[0], (0, 0))
+                tiers[key[0]] = (count + 1, used + size)
+            return {"bytes": self.total, "budget": self.budget, "entries": len(self.entries), "tiers": tiers,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+@st.cache_resource(show_spinner=False)
+def evidence_cache():
+    return ByteBudgetCache(EVIDENCE_CACHE_MB * 1024 * 1024)
+
+def cached_evidence(key, build, size_of=None):
+    """key[0] 為分層名稱 ("raw" / "page" / "info")；未命中時呼叫 build() 並依 size_of(值) 計入用量"""
+    cache = evidence_cache()
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.put(key, value, size_of(value) if size_of else sys.getsizeof(value))
+    return value
+
+def evidence_file(file_id):
+    """取得 (原始檔案位元組, 中繼資料)；失敗時拋出例外"""
+    return cached_evidence(("raw", file_id), lambda: get_drive_file(file_id), lambda v: len(v[0]) + 512)
+
+def evidence_cache_caption():
+    s = evidence_cache().stats()
+    mb = lambda n: f"{n / 1024 / 1024:.0f} MB"
+    detail = "、".join(f"{tier} {count} 筆 {mb(used)}" for tier, (count, used) in sorted(s["tiers"].items()))
+    st.caption(f"🖼️ 佐證快取用量 {mb(s['bytes'])} / {mb(s['budget'])}" + (f" ({detail})" if detail else ""))
@@ -0,0 +1,644 @@
+import os
+import re
+import json
+import hashlib
+import time
+import random
+import smtplib
+import threading
+import itertools
+from datetime import datetime, timezone
+import streamlit as st
+import gspread
+from gspread.utils import a1_range_to_grid_range, rowcol_to_a1, numericise_all
+from core.rate_limit import acquire, report_throttled
+
+# ==========================================
+# 離線替身後端 (Fake Backend)：Sheets / Drive / SMTP
+# ==========================================
+# 設定環境變數 NCYU_BACKEND=fake 後，core.gsheets 與 core.mailer 改為回傳本模組的替身物件，
+# 頁面程式碼不需修改即可在無網路、無 Google 憑證的機器上執行與量測：
+#   - 試算表：每個工作表為一個二維字串表 (API 與 gspread Client / Spreadsheet / Worksheet 相容)
+#   - Drive ：檔案為 blob (files().get / get_media / create，可搭配 MediaIoBaseDownload / Upload)
+#   - SMTP  ：寄出的信件存入 outbox
+# NCYU_FAKE_DIR 指定目錄時資料存於磁碟 (sheets/*.json、drive/*、outbox/*.eml)，未指定則只存在記憶體。
+#
+# 每次「API 呼叫」都經過 core.rate_limit 的令牌桶，並可注入延遲與 429，讓效能調整可在本機重現：
+#   NCYU_FAKE_LATENCY_MS="sheets_read=120,sheets_write=250,drive=80"  (或單一數字套用全部)
+#   NCYU_FAKE_JITTER_MS=30     NCYU_FAKE_429_RATE=0.05 (或依桶指定)     NCYU_FAKE_SEED=42
+# 亦可於程式中 get_fake_backend().configure(latency_ms=..., error_rate=...)；stats() 回傳各桶呼叫與 429 次數。
+
+API_KINDS = ("sheets_read", "sheets_write", "drive", "smtp")
+SPREADSHEET_MIME = "application/vnd.google-apps.spreadsheet"
+
+def _per_kind(spec, default=0.0):
+    """'sheets_read=120,drive=80' 或 '100' → {kind: 值}"""
+    out = {k: default for k in API_KINDS}
+    spec = str(spec or "").strip()
+    if not spec: return out
+    if "=" not in spec: return {k: float(spec) for k in API_KINDS}
+    for part in spec.split(","):
+        k, _, v = part.partition("=")
+        if k.strip() in out: out[k.strip()] = float(v)
+    return out
+
+def _now_iso():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+def _cell_text(v):
+    if v is None: return ""
+    if isinstance(v, bool): return "TRUE" if v else "FALSE"
+    if isinstance(v, float) and v.is_integer(): return str(int(v))
+    return str(v)
+
+def _entered_text(cell):
+    ev = (cell or {}).get("userEnteredValue") or {}
+    for key in ("stringValue", "numberValue", "boolValue", "formulaValue"):
+        if key in ev: return _cell_text(ev[key])
+    return ""
+
+def _split_range(range_name):
+    """"'工作表'!A1:B2" → ('工作表', 'A1:B2')；無 ! 時視為整張工作表名稱"""
+    name = str(range_name)
+    title, sep, a1 = name.rpartition("!") if "!" in name else (name, "", "")
+    title = title.strip()
+    if len(title) >= 2 and title[0] == title[-1] == "'": title = title[1:-1].replace("''", "'")
+    return title, (a1 or None)
+
+# --- 錯誤回應 (與真實 API 的例外型別一致，既有的重試機制可直接辨識) ---
+class _JsonResponse:
+    def __init__(self, code, message):
+        self.status_code = code
+        self.payload = {"error": {"code": code, "message": message, "status": "RESOURCE_EXHAUSTED" if code == 429 else "NOT_FOUND"}}
+        self.text = json.dumps(self.payload)
+
+    def json(self):
+        return self.payload
+
+class _HttpResponse(dict):
+    def __init__(self, status, headers=None):
+        super().__init__(headers or {})
+        self["status"] = str(status)
+        self.status = status
+        self.reason = {200: "OK", 206: "Partial Content", 404: "Not Found", 429: "Too Many Requests"}.get(status, "")
+
+def _sheets_error(code, message):
+    return gspread.exceptions.APIError(_JsonResponse(code, message))
+
+def _smtp_error(code, message):
+    return smtplib.SMTPResponseException(421, message)
+
+def _http_error(code, message):
+    from googleapiclient.errors import HttpError
+    return HttpError(_HttpResponse(code), json.dumps(_JsonResponse(code, message).payload).encode("utf-8"))
+
+class FakeBackend:
+    def __init__(self, root=None, latency_ms=None, jitter_ms=0.0, error_rate=None, seed=None):
+        self.root = root
+        self.lock = threading.RLock()
+        self.books = {}
+        self.files = {}
+        self.outbox = []
+        self.ids = itertools.count(1)
+        self.rng = random.Random(seed)
+        self.counts = {k: {"calls": 0, "throttled": 0, "latency_total": 0.0} for k in API_KINDS}
+        self.latency, self.jitter, self.error_rate = _per_kind(None), 0.0, _per_kind(None)
+        self.configure(latency_ms=latency_ms, jitter_ms=jitter_ms, error_rate=error_rate)
+        if root:
+            for sub in ("sheets", "drive", "outbox"): os.makedirs(os.path.join(root, sub), exist_ok=True)
+
+    def configure(self, latency_ms=None, jitter_ms=None, error_rate=None):
+        """latency_ms / error_rate 可為單一數值或 {桶名稱: 值}"""
+        with self.lock:
+            if latency_ms is not None:
+                self.latency = dict(_per_kind(None), **latency_ms) if isinstance(latency_ms, dict) else _per_kind(latency_ms)
+            if jitter_ms is not None: self.jitter = float(jitter_ms)
+            if error_rate is not None:
+                self.error_rate = dict(_per_kind(None), **error_rate) if isinstance(error_rate, dict) else _per_kind(error_rate)
+
+    def api(self, kind, make_error):
+        """模擬一次 API 往返：令牌桶排隊 → 延遲 → 依機率回應 429"""
+        if kind in ("sheets_read", "sheets_write", "drive"): acquire(kind)
+        with self.lock:
+            delay = max(0.0, self.latency[kind] + self.rng.uniform(-self.jitter, self.jitter)) / 1000.0
+            throttled = self.rng.random() < self.error_rate[kind]
+            self.counts[kind]["calls"] += 1
+            self.counts[kind]["latency_total"] += delay
+            if throttled: self.counts[kind]["throttled"] += 1
+        if delay: time.sleep(delay)
+        if throttled:
+            if kind in ("sheets_read", "sheets_write", "drive"): report_throttled(kind)
+            raise make_error(429, "Quota exceeded (fake backend)")
+
+    def stats(self):
+        with self.lock: return {k: dict(v) for k, v in self.counts.items()}
+
+    def new_id(self, prefix):
+        return f"{prefix}{next(self.ids):06d}{self.rng.getrandbits(40):010x}"
+
+    # --- 試算表儲存 ---
+    def _book_path(self, sheet_id):
+        return os.path.join(self.root, "sheets", f"{sheet_id}.json")
+
+    def book(self, sheet_id, create=True):
+        with self.lock:
+            if sheet_id not in self.books:
+                path = self._book_path(sheet_id) if self.root else None
+                if path and os.path.exists(path):
+                    with open(path, encoding="utf-8") as f: self.books[sheet_id] = json.load(f)
+                elif create:
+                    self.books[sheet_id] = {"id": sheet_id, "title": sheet_id, "version": 1, "modified": _now_iso(),
+                                            "sheets": [{"id": 0, "title": "Sheet1", "rows": 1000, "cols": 26, "values": []}]}
+                else:
+                    return None
+            return self.books[sheet_id]
+
+    def touch(self, sheet_id):
+        """試算表異動：遞增版本號 (供 spreadsheet_version 比對) 並寫回磁碟"""
+        with self.lock:
+            book = self.books[sheet_id]
+            book["version"] += 1
+            book["modified"] = _now_iso()
+            if self.root:
+                tmp = self._book_path(sheet_id) + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f: json.dump(book, f, ensure_ascii=False)
+                os.replace(tmp, self._book_path(sheet_id))
+
+    def seed_spreadsheet(self, sheet_id, tables, title=None):
+        """建立 / 覆寫測試資料：tables = {工作表名稱: [[標題...], [列...], ...]}"""
+        with self.lock:
+            sheets = [{"id": i, "title": t, "rows": max(1000, len(v)), "cols": max([26] + [len(r) for r in v]),
+                       "values": [[_cell_text(c) for c in r] for r in v]} for i, (t, v) in enumerate(tables.items())]
+            self.books[sheet_id] = {"id": sheet_id, "title": title or sheet_id, "version": 0, "modified": _now_iso(), "sheets": sheets}
+            self.touch(sheet_id)
+
+    # --- Drive 儲存 ---
+    def file_meta(self, file_id):
+        with self.lock:
+            if file_id in self.files: return self.files[file_id]
+            if self.root:
+                path = os.path.join(self.root, "drive", f"{file_id}.json")
+                if os.path.exists(path):
+                    with open(path, encoding="utf-8") as f: self.files[file_id] = json.load(f)
+                    return self.files[file_id]
+            book = self.book(file_id, create=False)
+            if book is not None:
+                return {"id": file_id, "name": book["title"], "mimeType": SPREADSHEET_MIME, "version": str(book["version"]), "modifiedTime": book["modified"]}
+            return None
+
+    def file_bytes(self, file_id):
+        meta = self.file_meta(file_id)
+        if meta is None: return None
+        if meta["mimeType"] == SPREADSHEET_MIME: return b""
+        if self.root:
+            with open(os.path.join(self.root, "drive", f"{file_id}.bin"), "rb") as f: return f.read()
+        return meta.get("_data", b"")
+
+    def seed_file(self, data, name, mime_type="application/octet-stream", file_id=None, parents=None):
+        with self.lock:
+            file_id = file_id or self.new_id("fake")
+            meta = {"id": file_id, "name": name, "mimeType": mime_type, "parents": list(parents or []), "size": str(len(data)), "md5Checksum": hashlib.md5(data).hexdigest(),
+                    "version": "1", "modifiedTime": _now_iso(), "webViewLink": f"https://drive.google.com/file/d/{file_id}/view?usp=drivesdk"}
+            if self.root:
+                with open(os.path.join(self.root, "drive", f"{file_id}.bin"), "wb") as f: f.write(data)
+                with open(os.path.join(self.root, "drive", f"{file_id}.json"), "w", encoding="utf-8") as f: json.dump(meta, f, ensure_ascii=False)
+            else:
+                meta["_data"] = bytes(data)
+            self.files[file_id] = meta
+            return meta
+
+    # --- SMTP outbox ---
+    def deliver(self, msg):
+        with self.lock:
+            self.outbox.append(msg)
+            if self.root:
+                name = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{len(self.outbox):05d}.eml"
+                with open(os.path.join(self.root, "outbox", name), "wb") as f: f.write(msg.as_bytes())
+
+    # --- 對外物件 ---
+    def gspread_client(self):
+        return FakeClient(self)
+
+    def drive_service(self):
+        return FakeDriveService(self)
+
+    def sheets_service(self):
+        return FakeSheetsService(self)
+
+    def smtp(self, host=None, port=None):
+        return FakeSMTP(self)
+
+# ==========================================
+# gspread 相容層
+# ==========================================
+class FakeClient:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def open_by_key(self, key):
+        self.backend.api("sheets_read", _sheets_error)
+        return FakeSpreadsheet(self.backend, key)
+
+class FakeSpreadsheet:
+    def __init__(self, backend, sheet_id):
+        self.backend = backend
+        self.id = sheet_id
+        backend.book(sheet_id)
+
+    @property
+    def title(self):
+        return self.backend.book(self.id)["title"]
+
+    def _sheet_dicts(self):
+        return self.backend.book(self.id)["sheets"]
+
+    def _find(self, title):
+        for s in self._sheet_dicts():
+            if s["title"] == title: return s
+        raise gspread.exceptions.WorksheetNotFound(title)
+
+    def worksheets(self):
+        self.backend.api("sheets_read", _sheets_error)
+        return [FakeWorksheet(self, s["id"]) for s in self._sheet_dicts()]
+
+    def worksheet(self, title):
+        self.backend.api("sheets_read", _sheets_error)
+        return FakeWorksheet(self, self._find(title)["id"])
+
+    @property
+    def sheet1(self):
+        return FakeWorksheet(self, self._sheet_dicts()[0]["id"])
+
+    def get_worksheet_by_id(self, gid):
+        for s in self._sheet_dicts():
+            if s["id"] == int(gid): return FakeWorksheet(self, s["id"])
+        raise gspread.exceptions.WorksheetNotFound(gid)
+
+    def add_worksheet(self, title, rows, cols, index=None):
+        self.backend.api("sheets_write", _sheets_error)
+        with self.backend.lock:
+            sheets = self._sheet_dicts()
+            if any(s["title"] == title for s in sheets): raise _sheets_error(400, f'A sheet with the name "{title}" already exists.')
+            gid = max([s["id"] for s in sheets] + [0]) + 1
+            sheets.insert(len(sheets) if index is None else index, {"id": gid, "title": title, "rows": int(rows), "cols": int(cols), "values": []})
+            self.backend.touch(self.id)
+        return FakeWorksheet(self, gid)
+
+    def values_batch_get(self, ranges, params=None):
+        self.backend.api("sheets_read", _sheets_error)
+        out = []
+        for r in ranges:
+            title, a1 = _split_range(r)
+            ws = FakeWorksheet(self, self._find(title)["id"])
+            out.append({"range": r, "majorDimension": "ROWS", "values": ws._read(a1)})
+        return {"spreadsheetId": self.id, "valueRanges": out}
+
+    def batch_update(self, body):
+        """支援 updateCells / deleteDimension / appendCells (core.sheet_writer 產生的請求)；整批原子套用"""
+        self.backend.api("sheets_write", _sheets_error)
+        with self.backend.lock:
+            book = self.backend.book(self.id)
+            snapshot = json.dumps(book["sheets"])
+            try:
+                for req in body.get("requests", []):
+                    self._apply(req)
+            except Exception:
+                book["sheets"] = json.loads(snapshot)
+                raise
+            self.backend.touch(self.id)
+        return {"spreadsheetId": self.id, "replies": [{} for _ in body.get("requests", [])]}
+
+    def _sheet_by_gid(self, gid):
+        for s in self._sheet_dicts():
+            if s["id"] == gid: return s
+        raise _sheets_error(400, f"No grid with id: {gid}")
+
+    def _apply(self, req):
+        if "updateCells" in req:
+            spec = req["updateCells"]
+            sheet = self._sheet_by_gid(spec["start"]["sheetId"])
+            r0, c0 = spec["start"].get("rowIndex", 0), spec["start"].get("columnIndex", 0)
+            for i, row in enumerate(spec.get("rows", [])):
+                _write_row(sheet, r0 + i, c0, [_entered_text(c) for c in row.get("values", [])])
+        elif "deleteDimension" in req:
+            rng = req["deleteDimension"]["range"]
+            sheet = self._sheet_by_gid(rng["sheetId"])
+            if rng.get("dimension", "ROWS") != "ROWS": raise _sheets_error(400, "fake backend: only ROWS deleteDimension is supported")
+            del sheet["values"][rng["startIndex"]:rng["endIndex"]]
+        elif "appendCells" in req:
+            spec = req["appendCells"]
+            sheet = self._sheet_by_gid(spec["sheetId"])
+            start = _used_rows(sheet)
+            for i, row in enumerate(spec.get("rows", [])):
+                _write_row(sheet, start + i, 0, [_entered_text(c) for c in row.get("values", [])])
+        else:
+            raise _sheets_error(400, f"fake backend: unsupported request {list(req)}")
+
+def _used_rows(sheet):
+    values = sheet["values"]
+    n = len(values)
+    while n and not any(str(v) for v in values[n - 1]): n -= 1
+    return n
+
+def _write_row(sheet, r, c0, texts):
+    values = sheet["values"]
+    while len(values) <= r: values.append([])
+    row = values[r]
+    if len(row) < c0 + len(texts): row.extend([""] * (c0 + len(texts) - len(row)))
+    row[c0:c0 + len(texts)] = texts
+    sheet["rows"] = max(sheet["rows"], len(values))
+    sheet["cols"] = max(sheet["cols"], len(row))
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, gid):
+        self.spreadsheet = spreadsheet
+        self.backend = spreadsheet.backend
+        self.id = gid
+
+    def __repr__(self):
+        return f"<FakeWorksheet {self.title!r} id:{self.id}>"
+
+    @property
+    def _sheet(self):
+        return self.spreadsheet._sheet_by_gid(self.id)
+
+    @property
+    def title(self):
+        return self._sheet["title"]
+
+    @property
+    def row_count(self):
+        return self._sheet["rows"]
+
+    @property
+    def col_count(self):
+        return self._sheet["cols"]
+
+    def _read(self, a1=None):
+        """與 API 相同：去除尾端空白列與每列尾端空白儲存格"""
+        with self.backend.lock:
+            values = [list(r) for r in self._sheet["values"]]
+        if a1:
+            g = a1_range_to_grid_range(a1)
+            r0, r1 = g.get("startRowIndex", 0), g.get("endRowIndex", len(values))
+            c0, c1 = g.get("startColumnIndex", 0), g.get("endColumnIndex", None)
+            values = [row[c0:c1] for row in values[r0:r1]]
+        values = [row[:max([i + 1 for i, v in enumerate(row) if str(v) != ""] + [0])] for row in values]
+        while values and not values[-1]: values.pop()
+        return values
+
+    def get(self, range_name=None, **kwargs):
+        self.backend.api("sheets_read", _sheets_error)
+        return self._read(range_name)
+
+    def get_all_values(self, **kwargs):
+        self.backend.api("sheets_read", _sheets_error)
+        values = self._read()
+        width = max([len(r) for r in values] + [0])
+        return [r + [""] * (width - len(r)) for r in values]
+
+    get_values = get_all_values
+
+    def get_all_records(self, head=1, default_blank="", **kwargs):
+        values = self.get_all_values()
+        if len(values) < head: return []
+        keys = values[head - 1]
+        return [dict(zip(keys, [default_blank if v == "" else v for v in numericise_all(row)])) for row in values[head:]]
+
+    def row_values(self, row, **kwargs):
+        self.backend.api("sheets_read", _sheets_error)
+        values = self._read(f"{row}:{row}")
+        return values[0] if values else []
+
+    def col_values(self, col, **kwargs):
+        self.backend.api("sheets_read", _sheets_error)
+        values = self._read()
+        return [(r[col - 1] if len(r) >= col else "") for r in values]
+
+    def append_rows(self, values, value_input_option="RAW", **kwargs):
+        self.backend.api("sheets_write", _sheets_error)
+        with self.backend.lock:
+            sheet = self._sheet
+            start = _used_rows(sheet)
+            for i, row in enumerate(values): _write_row(sheet, start + i, 0, [_cell_text(v) for v in row])
+            self.backend.touch(self.spreadsheet.id)
+        width = max([len(r) for r in values] + [1])
+        updated = f"'{self.title}'!A{start + 1}:{rowcol_to_a1(start + len(values), width)}"
+        return {"spreadsheetId": self.spreadsheet.id, "tableRange": f"'{self.title}'!A1:{rowcol_to_a1(max(start, 1), width)}",
+                "updates": {"spreadsheetId": self.spreadsheet.id, "updatedRange": updated, "updatedRows": len(values),
+                            "updatedColumns": width, "updatedCells": sum(len(r) for r in values)}}
+
+    def append_row(self, values, value_input_option="RAW", **kwargs):
+        return self.append_rows([values], value_input_option=value_input_option, **kwargs)
+
+    def _update(self, range_name, values):
+        g = a1_range_to_grid_range(range_name) if range_name else {}
+        r0, c0 = g.get("startRowIndex", 0), g.get("startColumnIndex", 0)
+        if values and not isinstance(values[0], (list, tuple)): values = [values]
+        for i, row in enumerate(values or []): _write_row(self._sheet, r0 + i, c0, [_cell_text(v) for v in row])
+
+    def update(self, values=None, range_name=None, **kwargs):
+        # 相容 gspread 5.x 的參數順序 update(range_name, values)
+        if isinstance(values, str) and not isinstance(range_name, str): values, range_name = range_name, values
+        self.backend.api("sheets_write", _sheets_error)
+        with self.backend.lock:
+            self._update(range_name, values)
+            self.backend.touch(self.spreadsheet.id)
+        return {"spreadsheetId": self.spreadsheet.id, "updatedRange": f"'{self.title}'!{range_name or 'A1'}"}
+
+    def batch_update(self, data, **kwargs):
+        self.backend.api("sheets_write", _sheets_error)
+        with self.backend.lock:
+            for item in data: self._update(item["range"], item["values"])
+            self.backend.touch(self.spreadsheet.id)
+        return {"spreadsheetId": self.spreadsheet.id, "totalUpdatedRanges": len(data)}
+
+    def delete_rows(self, start_index, end_index=None):
+        self.backend.api("sheets_write", _sheets_error)
+        with self.backend.lock:
+            del self._sheet["values"][start_index - 1:(end_index or start_index)]
+            self.backend.touch(self.spreadsheet.id)
+
+    def clear(self):
+        self.backend.api("sheets_write", _sheets_error)
+        with self.backend.lock:
+            self._sheet["values"] = []
+            self.backend.touch(self.spreadsheet.id)
+
+# ==========================================
+# googleapiclient 相容層 (Drive v3 / Sheets v4 values)
+# ==========================================
+class _Call:
+    """仿 HttpRequest：execute() 時才算一次 API 呼叫"""
+    def __init__(self, backend, kind, fn):
+        self.backend, self.kind, self.fn = backend, kind, fn
+
+    def execute(self, num_retries=0):
+        self.backend.api(self.kind, _http_error)
+        return self.fn()
+
+class _MediaHttp:
+    """供 MediaIoBaseDownload 使用：依 Range 標頭分段回傳檔案內容"""
+    def __init__(self, backend, file_id):
+        self.backend, self.file_id = backend, file_id
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        try: self.backend.api("drive", _http_error)
+        except Exception: return _HttpResponse(429), b'{"error": {"code": 429}}'
+        data = self.backend.file_bytes(self.file_id)
+        if data is None: return _HttpResponse(404), b'{"error": {"code": 404}}'
+        m = re.match(r"bytes=(\d+)-(\d+)", str((headers or {}).get("range", "")))
+        if not m: return _HttpResponse(200, {"content-length": str(len(data))}), data
+        start, end = int(m.group(1)), min(int(m.group(2)), len(data) - 1)
+        return _HttpResponse(206, {"content-range": f"bytes {start}-{end}/{len(data)}"}), data[start:end + 1]
+
+class _MediaRequest(_Call):
+    def __init__(self, backend, file_id):
+        super().__init__(backend, "drive", lambda: self._bytes())
+        self.file_id = file_id
+        self.uri = f"https://www.googleapis.com/drive/v3/files/{file_id}?alt=media"
+        self.http = _MediaHttp(backend, file_id)
+        self.headers = {}
+        self.method = "GET"
+
+    def _bytes(self):
+        data = self.backend.file_bytes(self.file_id)
+        if data is None: raise _http_error(404, f"File not found: {self.file_id}.")
+        return data
+
+def _pick_fields(meta, fields):
+    public = {k: v for k, v in meta.items() if not k.startswith("_")}
+    if not fields: return {k: public[k] for k in ("id", "name", "mimeType") if k in public}
+    wanted = [f.strip() for f in re.sub(r"files\((.*)\)", r"\1", fields).split(",")]
+    return {k: public[k] for k in wanted if k in public}
+
+class _FakeFiles:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, fileId, fields=None, **kwargs):
+        def run():
+            meta = self.backend.file_meta(fileId)
+            if meta is None: raise _http_error(404, f"File not found: {fileId}.")
+            return _pick_fields(meta, fields)
+        return _Call(self.backend, "drive", run)
+
+    def get_media(self, fileId, **kwargs):
+        return _MediaRequest(self.backend, fileId)
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        def run():
+            data = media_body.getbytes(0, media_body.size()) if media_body is not None else b""
+            mime = (media_body.mimetype() if media_body is not None else None) or (body or {}).get("mimeType", "application/octet-stream")
+            meta = self.backend.seed_file(data, (body or {}).get("name", "untitled"), mime, parents=(body or {}).get("parents"))
+            return _pick_fields(meta, fields or "id")
+        return _Call(self.backend, "drive", run)
+
+    def list(self, q=None, fields=None, **kwargs):
+        def run():
+            with self.backend.lock: metas = list(self.backend.files.values())
+            m = re.search(r"'([^']+)' in parents", q or "")
+            if m: metas = [x for x in metas if m.group(1) in x.get("parents", [])]
+            return {"files": [_pick_fields(x, fields or "id,name,mimeType") for x in metas]}
+        return _Call(self.backend, "drive", run)
+
+    def delete(self, fileId, **kwargs):
+        def run():
+            with self.backend.lock: self.backend.files.pop(fileId, None)
+            return ""
+        return _Call(self.backend, "drive", run)
+
+class FakeDriveService:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def files(self):
+        return _FakeFiles(self.backend)
+
+class _FakeValues:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def _ws(self, spreadsheetId, range):
+        title, a1 = _split_range(range)
+        ss = FakeSpreadsheet(self.backend, spreadsheetId)
+        return FakeWorksheet(ss, ss._find(title)["id"]), a1
+
+    def get(self, spreadsheetId, range, **kwargs):
+        def run():
+            ws, a1 = self._ws(spreadsheetId, range)
+            return {"range": range, "majorDimension": "ROWS", "values": ws._read(a1)}
+        return _Call(self.backend, "sheets_read", run)
+
+    def update(self, spreadsheetId, range, body, valueInputOption="RAW", **kwargs):
+        def run():
+            ws, a1 = self._ws(spreadsheetId, range)
+            with self.backend.lock:
+                ws._update(a1, body.get("values", []))
+                self.backend.touch(spreadsheetId)
+            return {"spreadsheetId": spreadsheetId, "updatedRange": range}
+        return _Call(self.backend, "sheets_write", run)
+
+    def append(self, spreadsheetId, range, body, valueInputOption="RAW", **kwargs):
+        def run():
+            ws, _ = self._ws(spreadsheetId, range)
+            with self.backend.lock:
+                sheet = ws._sheet
+                start = _used_rows(sheet)
+                rows = body.get("values", [])
+                for i, row in enumerate(rows): _write_row(sheet, start + i, 0, [_cell_text(v) for v in row])
+                self.backend.touch(spreadsheetId)
+            width = max([len(r) for r in rows] + [1])
+            return {"spreadsheetId": spreadsheetId, "updates": {"updatedRange": f"'{ws.title}'!A{start + 1}:{rowcol_to_a1(start + len(rows), width)}", "updatedRows": len(rows)}}
+        return _Call(self.backend, "sheets_write", run)
+
+class _FakeSpreadsheets:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def values(self):
+        return _FakeValues(self.backend)
+
+class FakeSheetsService:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def spreadsheets(self):
+        return _FakeSpreadsheets(self.backend)
+
+# ==========================================
+# smtplib.SMTP 相容層
+# ==========================================
+class FakeSMTP:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.quit()
+
+    def starttls(self, *args, **kwargs):
+        return (220, b"ready")
+
+    def login(self, user, password):
+        self.backend.api("smtp", _smtp_error)
+        return (235, b"accepted")
+
+    def send_message(self, msg, *args, **kwargs):
+        self.backend.deliver(msg)
+        return {}
+
+    def quit(self):
+        return (221, b"bye")
+
+@st.cache_resource(show_spinner=False)
+def get_fake_backend():
+    return FakeBackend(
+        root=os.environ.get("NCYU_FAKE_DIR") or None,
+        latency_ms=os.environ.get("NCYU_FAKE_LATENCY_MS"),
+        jitter_ms=os.environ.get("NCYU_FAKE_JITTER_MS") or 0,
+        error_rate=os.environ.get("NCYU_FAKE_429_RATE"),
+        seed=int(os.environ["NCYU_FAKE_SEED"]) if os.environ.get("NCYU_FAKE_SEED") else None,
+    )
@@ -0,0 +1,37 @@
+from collections import namedtuple
+import pandas as pd
+from core.gsheets import open_spreadsheet
+from core.cache_scope import depends_on
+from core.swr import swr_cache
+
+# ==========================================
+# 氣體鋼瓶三表共用載入 (庫存 / 年度使用紀錄 / 發送紀錄與金鑰)
+# ==========================================
+# 一次 values.batchGet 取回三張工作表，整理為型別一致的 DataFrame，
+# 管理後台 (8) 與回報頁 (9) 共用同一份快取；任一表寫入後 invalidate() 即一併更新。
+
+GAS_SHEET_ID = "1Hw4rXo4ww7O9YXTwoUJeWioO5ZzM_bivRcLLpOl26DY"
+GAS_TABLES = ("氣體鋼瓶資料庫", "氣體鋼瓶年度使用紀錄", "發送紀錄與金鑰")
+
+GasSheets = namedtuple("GasSheets", ["inv", "pur", "trk"])
+
+# 數值欄位：其餘欄位一律保留為字串 (門牌、分機等不會被誤轉為數字)
+INT_COLS = ["鋼瓶數量"]
+FLOAT_COLS = ["年度氣體鋼瓶購買量(公斤)"]
+
+def _to_frame(values):
+    if not values: return pd.DataFrame()
+    header = [str(h).strip() for h in values[0]]
+    width = len(header)
+    df = pd.DataFrame([list(r[:width]) + [""] * (width - len(r)) for r in values[1:]], columns=header)
+    for c in INT_COLS:
+        if c in df.columns: df[c] = pd.to_numeric(df[c], errors='coerce').fillna(0).astype(int)
+    for c in FLOAT_COLS:
+        if c in df.columns: df[c] = pd.to_numeric(df[c], errors='coerce').fillna(0.0)
+    return df
+
+@depends_on(GAS_SHEET_ID, *GAS_TABLES)
+@swr_cache(ttl=60, watch=GAS_SHEET_ID)
+def load_gas_sheets():
+    res = open_spreadsheet(GAS_SHEET_ID).values_batch_get([f"'{t}'" for t in GAS_TABLES])
+    return GasSheets(*[_to_frame(vr.get('values', [])) for vr in res.get('valueRanges', [])])
@@ -0,0 +1,90 @@
+import os
+import streamlit as st
+import gspread
+import httplib2
+import google_auth_httplib2
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
+from core.rate_limit import limit_requests_session, limit_httplib2
+
+# ==========================================
+# 全站共用 Google API 連線池
+# ==========================================
+# 所有頁面共用同一組 OAuth 憑證 / gspread Client / Drive & Sheets Service，
+# 並以 SHEET_ID 為單位快取 Spreadsheet 與 Worksheet 物件，
+# 避免每次點擊都重新換發 Token、重新 open_by_key 與建立 Service。
+#
+# 設定環境變數 NCYU_BACKEND=fake 時改用 core.fake_backend 的離線替身 (不需網路與憑證，可注入延遲與 429)。
+
+SCOPES = ["https://www.googleapis.com/auth/drive", "https://www.googleapis.com/auth/spreadsheets"]
+TOKEN_URI = "https://oauth2.googleapis.com/token"
+USE_FAKE_BACKEND = os.environ.get("NCYU_BACKEND", "google").strip().lower() == "fake"
+
+@st.cache_resource(show_spinner=False)
+def get_credentials():
+    oauth = st.secrets["gcp_oauth"]
+    return Credentials(token=None, refresh_token=oauth["refresh_token"], token_uri=TOKEN_URI, client_id=oauth["client_id"], client_secret=oauth["client_secret"], scopes=SCOPES)
+
+@st.cache_resource(show_spinner=False)
+def get_gspread_client():
+    if USE_FAKE_BACKEND:
+        from core.fake_backend import get_fake_backend
+        return get_fake_backend().gspread_client()
+    gc = gspread.authorize(get_credentials())
+    # 所有 gspread 請求經過全站共用的流量控制
+    limit_requests_session(getattr(gc, "http_client", gc).session)
+    return gc
+
+def _build_service(service_name, version):
+    if USE_FAKE_BACKEND:
+        from core.fake_backend import get_fake_backend
+        return get_fake_backend().drive_service() if service_name == 'drive' else get_fake_backend().sheets_service()
+    creds = get_credentials()
+
+    # [防護機制] httplib2 非執行緒安全：每個請求各自建立 Http，但共用同一組已換發的 Token
+    def _request_builder(http, *args, **kwargs):
+        return HttpRequest(limit_httplib2(google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http())), *args, **kwargs)
+
+    authed_http = limit_httplib2(google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http()))
+    return build(service_name, version, http=authed_http, requestBuilder=_request_builder, cache_discovery=False)
+
+@st.cache_resource(show_spinner=False)
+def get_drive_service():
+    return _build_service('drive', 'v3')
+
+@st.cache_resource(show_spinner=False)
+def get_sheets_service():
+    return _build_service('sheets', 'v4')
+
+@st.cache_resource(show_spinner=False)
+def open_spreadsheet(sheet_id):
+    return get_gspread_client().open_by_key(sheet_id)
+
+@st.cache_resource(show_spinner=False)
+def get_worksheet(sheet_id, title):
+    # 找不到工作表時會拋出 WorksheetNotFound，例外不會被快取，建立後即可正常取得
+    return open_spreadsheet(sheet_id).worksheet(title)
+
+def get_worksheet_or_none(sheet_id, *titles):
+    """依序嘗試多個工作表名稱 (相容新舊命名)，全部不存在時回傳 None"""
+    for title in titles:
+        try: return get_worksheet(sheet_id, title)
+        except gspread.exceptions.WorksheetNotFound: continue
+    return None
+
+@st.cache_resource(show_spinner=False)
+def ensure_worksheet(sheet_id, titles, header, rows=1000):
+    """每個行程只執行一次：工作表不存在則以 titles[0] 建立；第 1 列為空時補上標題列 (只讀取一列，不下載整張表)"""
+    ws = get_worksheet_or_none(sheet_id, *titles)
+    if ws is None:
+        ws = open_spreadsheet(sheet_id).add_worksheet(title=titles[0], rows=str(rows), cols=str(len(header)))
+    if not any(str(v).strip() for v in ws.row_values(1)):
+        # 直接寫入 A1：append_row 會接在最後一筆資料之後，第 1 列空白但下方有資料時標題列會被寫到表尾
+        ws.update([list(header)], "A1")
+    return ws
+
+def spreadsheet_version(sheet_id):
+    """Drive 檔案版本號：試算表任一儲存格異動都會遞增，可用來判斷快照是否需要重新下載 (單次輕量 metadata 請求)"""
+    meta = get_drive_service().files().get(fileId=sheet_id, fields="version,modifiedTime", supportsAllDrives=True).execute()
+    return meta.get("version") or meta.get("modifiedTime")
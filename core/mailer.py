@@ -0,0 +1,13 @@
+import smtplib
+from core.gsheets import USE_FAKE_BACKEND
+
+# ==========================================
+# SMTP 連線 (可替換為離線 outbox)
+# ==========================================
+# 頁面以 open_smtp() 取代 smtplib.SMTP()；NCYU_BACKEND=fake 時信件只寫入 core.fake_backend 的 outbox，不會真的寄出。
+
+def open_smtp(server, port):
+    if USE_FAKE_BACKEND:
+        from core.fake_backend import get_fake_backend
+        return get_fake_backend().smtp(server, port)
+    return smtplib.SMTP(server, port)
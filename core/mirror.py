@@ -0,0 +1,215 @@
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import tempfile
+import threading
+import pandas as pd
+import streamlit as st
+from gspread.utils import rowcol_to_a1
+from core.cache_scope import depends_on
+from core.swr import submit_background, probe_version
+
+# ==========================================
+# 本機 SQLite 鏡像 (Local Mirror)
+# ==========================================
+# Google Sheets 仍是唯一正式資料來源；鏡像只是讀取用的本機副本：
+#   - sync_mirror()   ：增量同步。先比對試算表版本號，有異動才只讀取表尾新增列 (核對錨點列，不符則整表重建)
+#   - mirror_append() ：前台 append_rows 成功後直接寫入鏡像 (寫穿)，不必等下一次同步
+#   - 管理端修改 / 刪除呼叫 invalidate() 時，鏡像標記為需整表重建
+#   - query_mirror()  ：儀表板與匯出以 SQL 條件 (年度、單位、設備) 查詢，走索引，不再整表載入後逐列篩選
+# 每張工作表對應一個資料表：_row 為試算表列號，_year 為依日期欄位產生的年度 (已建索引)。
+# 目前只有燃油後台 (3) 的年度查詢使用鏡像；冷媒 (4)、電力 (7)、鋼瓶 (8) 仍讀取整表快照
+# (編輯器依列位置比對、按日攤算需全部資料、鋼瓶三表與回報頁共用同一次 batchGet)，年度索引查詢省不到讀取量。
+# [防護機制] 鏡像含填報人姓名與分機：預設目錄權限 0700、資料庫檔 0600，共用主機的其他帳號不可讀取。
+
+MIRROR_PATH = os.environ.get("NCYU_MIRROR_PATH") or os.path.join(tempfile.gettempdir(), "ncyu_carbon_mirror", "mirror.sqlite3")
+SYNC_INTERVAL = 60  # 兩次同步檢查的最短間隔 (秒)
+
+FUEL_SHEET_ID = "1gqDU21YJeBoBOd8rMYzwwZ45offXWPGEODKTF6B8k-Y"
+
+# year_of：用來產生 _year 的日期欄位；indexes：常用篩選欄位 (工作表中不存在的欄位會自動略過)
+FUEL_RECORD_SPEC = {"year_of": "加油日期", "indexes": ["填報單位", "設備名稱備註"]}
+MIRROR_SPECS = {
+    (FUEL_SHEET_ID, "油料填報紀錄"): FUEL_RECORD_SPEC,
+    (FUEL_SHEET_ID, "填報紀錄"): FUEL_RECORD_SPEC,  # 舊版工作表名稱
+}
+
+def q(name):
+    """SQL 欄位名稱加上雙引號 (中文與特殊字元欄位)"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+class MirrorTable:
+    def __init__(self, sheet_id, title):
+        self.sheet_id, self.title = sheet_id, title
+        self.table = "t_" + hashlib.md5(f"{sheet_id}:{title}".encode("utf-8")).hexdigest()[:16]
+        self.lock = threading.Lock()
+        self.header = []
+        self.columns = []
+        self.row_count = 0
+        self.signature = None
+        self.synced_at = None
+        self.dirty = False
+        self.syncing = False
+
+    def __repr__(self):
+        return f"MirrorTable({self.sheet_id}:{self.title})"
+
+    def clear(self):
+        # 管理端異動 (修改 / 刪除) 無法以表尾增量偵測，下次同步整表重建
+        self.dirty = True
+
+    def status(self):
+        return self.synced_at, self.syncing
+
+@st.cache_resource(show_spinner=False)
+def _engine():
+    mirror_dir = os.path.dirname(MIRROR_PATH)
+    if mirror_dir:
+        os.makedirs(mirror_dir, mode=0o700, exist_ok=True)
+        if not os.environ.get("NCYU_MIRROR_PATH"): os.chmod(mirror_dir, 0o700)  # 自訂路徑不更動其所在目錄的權限
+    os.close(os.open(MIRROR_PATH, os.O_CREAT | os.O_RDWR, 0o600))
+    os.chmod(MIRROR_PATH, 0o600)  # SQLite 建立的 -wal / -shm 檔沿用資料庫檔的權限
+    conn = sqlite3.connect(MIRROR_PATH, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS _mirror_meta (tbl TEXT PRIMARY KEY, sheet_id TEXT, title TEXT, header TEXT, row_count INTEGER, signature TEXT, synced_at REAL)")
+    conn.commit()
+    return conn, threading.RLock(), {}
+
+def _sql_columns(header):
+    cols, seen = [], set()
+    for i, h in enumerate(header):
+        name = str(h).strip() or f"_col{i + 1}"
+        while name in seen or name in ("_row", "_year"): name = f"{name}_{i + 1}"
+        seen.add(name); cols.append(name)
+    return cols
+
+def get_mirror_table(sheet_id, title):
+    conn, db_lock, registry = _engine()
+    with db_lock:
+        if (sheet_id, title) in registry: return registry[(sheet_id, title)]
+        mt = MirrorTable(sheet_id, title)
+        # 行程重啟後沿用磁碟上的鏡像，只需比對版本號即可決定是否同步
+        meta = conn.execute("SELECT header, row_count, signature, synced_at FROM _mirror_meta WHERE tbl = ?", (mt.table,)).fetchone()
+        if meta:
+            mt.header = json.loads(meta[0]); mt.columns = _sql_columns(mt.header)
+            mt.row_count, mt.signature, mt.synced_at = meta[1], meta[2], meta[3]
+        depends_on(sheet_id, title)(mt)
+        registry[(sheet_id, title)] = mt
+        return mt
+
+def _pad(row, width):
+    row = [str(v) for v in row]
+    return row + [""] * (width - len(row)) if len(row) < width else row[:width]
+
+def _save_meta(conn, mt):
+    conn.execute("INSERT OR REPLACE INTO _mirror_meta VALUES (?, ?, ?, ?, ?, ?, ?)", (mt.table, mt.sheet_id, mt.title, json.dumps(mt.header, ensure_ascii=False), mt.row_count, mt.signature, mt.synced_at))
+
+def _insert_rows(conn, mt, start_row, rows):
+    width = len(mt.columns)
+    placeholders = ", ".join(["?"] * (width + 1))
+    conn.executemany(f"INSERT OR REPLACE INTO {mt.table} (_row, {', '.join(q(c) for c in mt.columns)}) VALUES ({placeholders})",
+                     [[start_row + i] + _pad(r, width) for i, r in enumerate(rows)])
+
+def _rebuild(mt, values, signature):
+    spec = MIRROR_SPECS.get((mt.sheet_id, mt.title), {})
+    header = [str(h).strip() for h in values[0]] if values else []
+    columns = _sql_columns(header)
+    col_defs = ", ".join(f"{q(c)} TEXT" for c in columns)
+    year_of = spec.get("year_of")
+    if year_of in columns:
+        col_defs += f", _year INTEGER GENERATED ALWAYS AS (CASE WHEN {q(year_of)} GLOB '[12][0-9][0-9][0-9]*' THEN CAST(substr({q(year_of)}, 1, 4) AS INTEGER) END) VIRTUAL"
+
+    conn, db_lock, _ = _engine()
+    with db_lock:
+        conn.execute(f"DROP TABLE IF EXISTS {mt.table}")
+        conn.execute(f"CREATE TABLE {mt.table} (_row INTEGER PRIMARY KEY{', ' + col_defs if col_defs else ''})")
+        if year_of in columns: conn.execute(f"CREATE INDEX {mt.table}_year ON {mt.table} (_year)")
+        for i, c in enumerate(c for c in spec.get("indexes", []) if c in columns):
+            conn.execute(f"CREATE INDEX {mt.table}_i{i} ON {mt.table} ({q(c)})")
+        mt.header, mt.columns = header, columns
+        if values[1:]: _insert_rows(conn, mt, 2, values[1:])
+        mt.row_count, mt.signature, mt.synced_at, mt.dirty = len(values[1:]), signature, time.time(), False
+        _save_meta(conn, mt)
+        conn.commit()
+
+def _sync(mt, worksheet):
+    signature = probe_version(mt.sheet_id)
+    if not mt.dirty and mt.synced_at and signature is not None and signature == mt.signature:
+        mt.synced_at = time.time()
+        return
+    if mt.dirty or not mt.columns or mt.row_count == 0:
+        _rebuild(mt, worksheet.get_all_values(), signature)
+        return
+
+    # 增量：從已知的最後一列讀到表尾，第一列作為錨點核對
+    width = len(mt.columns)
+    last_row = mt.row_count + 1
+    last_col = rowcol_to_a1(1, width).rstrip("0123456789")
+    tail = [_pad(r, width) for r in worksheet.get(f"A{last_row}:{last_col}")]
+    conn, db_lock, _ = _engine()
+    with db_lock:
+        anchor = conn.execute(f"SELECT {', '.join(q(c) for c in mt.columns)} FROM {mt.table} WHERE _row = ?", (last_row,)).fetchone()
+    if not tail or anchor is None or tail[0] != list(anchor):
+        _rebuild(mt, worksheet.get_all_values(), signature)
+        return
+    with db_lock:
+        if tail[1:]: _insert_rows(conn, mt, last_row + 1, tail[1:])
+        mt.row_count += len(tail) - 1
+        mt.signature, mt.synced_at = signature, time.time()
+        _save_meta(conn, mt)
+        conn.commit()
+
+def _background_sync(mt, worksheet):
+    try:
+        with mt.lock: _sync(mt, worksheet)
+    finally:
+        mt.syncing = False
+
+def sync_mirror(worksheet, max_age=SYNC_INTERVAL):
+    """確保鏡像可查詢：尚無鏡像或需整表重建時同步執行，其餘情況由背景執行緒增量同步"""
+    mt = get_mirror_table(worksheet.spreadsheet.id, worksheet.title)
+    if mt.synced_at and not mt.dirty:
+        if time.time() - mt.synced_at >= max_age and not mt.syncing:
+            mt.syncing = True
+            submit_background(_background_sync, mt, worksheet)
+        return mt
+    with mt.lock:
+        if not mt.synced_at or mt.dirty: _sync(mt, worksheet)
+    return mt
+
+def mirror_append(worksheet, rows):
+    """append_rows 成功後呼叫：將新列寫入鏡像；回傳已寫入的鏡像表 (尚未建立或待重建時略過，回傳 None)"""
+    conn, db_lock, registry = _engine()
+    mt = registry.get((worksheet.spreadsheet.id, worksheet.title))
+    if mt is None or not rows: return None
+    with mt.lock:
+        if mt.dirty or not mt.synced_at or not mt.columns: return None
+        with db_lock:
+            _insert_rows(conn, mt, mt.row_count + 2, rows)
+            mt.row_count += len(rows)
+            _save_meta(conn, mt)
+            conn.commit()
+    return mt
+
+def query_mirror(sheet_id, title, where="", params=(), order_by="_row", with_row=False):
+    """以 SQL 條件查詢鏡像，回傳欄位名稱與試算表相同的 DataFrame (皆為字串)
+
+    query_mirror(SHEET_ID, "油料填報紀錄", "_year = ? AND " + q("填報單位") + " = ?", (2025, "總務處事務組"))
+    """
+    mt = get_mirror_table(sheet_id, title)
+    if not mt.columns: return pd.DataFrame()
+    select = ", ".join(f"{q(c)}" for c in mt.columns)
+    if with_row: select = "_row AS _row_index, " + select
+    sql = f"SELECT {select} FROM {mt.table}" + (f" WHERE {where}" if where else "") + (f" ORDER BY {order_by}" if order_by else "")
+    conn, db_lock, _ = _engine()
+    with db_lock: return pd.read_sql_query(sql, conn, params=list(params))
+
+def mirror_years(sheet_id, title):
+    mt = get_mirror_table(sheet_id, title)
+    conn, db_lock, _ = _engine()
+    with db_lock:
+        try: rows = conn.execute(f"SELECT DISTINCT _year FROM {mt.table} WHERE _year > 0 ORDER BY _year DESC").fetchall()
+        except sqlite3.OperationalError: return []
+    return [r[0] for r in rows]
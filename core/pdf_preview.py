@@ -0,0 +1,107 @@
+import io
+import re
+from typing import NamedTuple
+import streamlit as st
+from PIL import Image, ImageOps, features
+from core.evidence_cache import cached_evidence, evidence_file
+
+# [PDF 截圖套件防護] 未安裝 PyMuPDF 時由頁面端 (HAS_FITZ) 改為僅提供下載
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+HAS_FITZ = fitz is not None
+
+# ==========================================
+# 佐證預覽：PDF 逐頁轉圖 + 縮圖層 (Page-on-demand / Thumbnail)
+# ==========================================
+# 原本下載 PDF 後立即以 2 倍解析度轉出每一頁的 PIL 圖片並整批放入 st.cache_data，
+# 圖片則以原始解析度傳給瀏覽器 (畫面上只是半欄寬)。改為：
+#   - pdf_pages()      ：只讀取頁數與版面方向 (不轉圖)，回傳各頁的 PdfPage 代號；圖片以 ImageFile 代號表示
+#   - show_preview()   ：畫廊顯示縮圖 (長邊 THUMB_EDGE px，WebP，不支援時 JPEG)，每個檔案 / 頁面只產生一次，
+#                        快取於 core.evidence_cache 的 thumb 分層；開啟「🔍 原尺寸」才轉出 / 讀取完整解析度
+#   - visible_pages()  ：多頁 PDF 預設只顯示前 PREVIEW_PAGES 頁，開啟「顯示全部」才轉出其餘頁面
+#   - unique_drive_links()：畫廊連結依 Drive 檔案 ID 去重 (切換鈕 key 含檔案 ID 與頁碼，同一檔案出現兩次會造成 key 重複)
+# 原始檔案位元組由 core.evidence_cache (記憶體) / core.drive_cache (磁碟) 提供，下載按鈕仍為原檔。
+
+THUMB_EDGE = 800
+THUMB_QUALITY = 80
+THUMB_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+FULL_ZOOM = 2         # 原尺寸檢視：與原本 fitz.Matrix(2, 2) 相同
+PREVIEW_PAGES = 2
+
+class PdfPage(NamedTuple):
+    file_id: str
+    page: int
+    count: int
+
+class ImageFile(NamedTuple):
+    file_id: str
+
+def _page_layout(file_bytes):
+    with fitz.open("pdf", file_bytes) as doc:
+        rect = doc.load_page(0).rect if len(doc) else None
+        return len(doc), bool(rect is not None and rect.width > rect.height)
+
+def pdf_pages(file_id, file_bytes):
+    """回傳 (各頁 PdfPage 代號, 第一頁是否為橫式)；只解析頁面尺寸，不轉圖"""
+    count, is_landscape = cached_evidence(("info", file_id), lambda: _page_layout(file_bytes), lambda v: 128)
+    return [PdfPage(file_id, i, count) for i in range(count)], is_landscape
+
+def _encode_thumb(img):
+    img = ImageOps.exif_transpose(img)  # 手機照片依 EXIF 轉正
+    img.thumbnail((THUMB_EDGE, THUMB_EDGE))
+    if img.mode not in ("RGB", "L"): img = img.convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format=THUMB_FORMAT, quality=THUMB_QUALITY)
+    return buf.getvalue()
+
+def render_pdf_page(file_id, page, zoom=FULL_ZOOM):
+    def render():
+        with fitz.open("pdf", evidence_file(file_id)[0]) as doc:
+            return doc.load_page(page).get_pixmap(matrix=fitz.Matrix(zoom, zoom)).tobytes("png")
+    return cached_evidence(("page", file_id, page, zoom), render, len)
+
+def thumbnail(img):
+    """縮圖位元組 (WebP / JPEG)；PdfPage 直接以縮圖解析度轉出，不先轉完整解析度"""
+    def build():
+        if isinstance(img, PdfPage):
+            with fitz.open("pdf", evidence_file(img.file_id)[0]) as doc:
+                page = doc.load_page(img.page)
+                zoom = THUMB_EDGE / max(page.rect.width, page.rect.height)
+                pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            return _encode_thumb(Image.frombytes("RGB", (pix.width, pix.height), pix.samples))
+        return _encode_thumb(Image.open(io.BytesIO(evidence_file(img.file_id)[0])))
+    return cached_evidence(("thumb",) + tuple(img), build, len)
+
+def full_image(img):
+    """原尺寸：PDF 以 FULL_ZOOM 轉圖，圖片為原始檔案"""
+    if isinstance(img, PdfPage): return render_pdf_page(img.file_id, img.page)
+    return evidence_file(img.file_id)[0]
+
+def preview_image(img):
+    """st.image 用：PdfPage / ImageFile 回傳縮圖，其他圖片原樣回傳"""
+    return thumbnail(img) if isinstance(img, (PdfPage, ImageFile)) else img
+
+def show_preview(container, img, caption, key):
+    """於 container (st 或欄位) 顯示縮圖；開啟「🔍 原尺寸」後才載入完整解析度 (可再以全螢幕檢視)"""
+    try: container.image(preview_image(img), use_container_width=True, caption=caption)
+    except Exception: container.image(full_image(img), use_container_width=True, caption=caption)  # 縮圖失敗 (罕見格式) 改顯示原檔
+    if isinstance(img, (PdfPage, ImageFile)) and container.toggle("🔍 原尺寸", key=f"zoom_{key}_{'_'.join(map(str, img))}"):
+        container.image(full_image(img), use_container_width=True)
+
+def unique_drive_links(links):
+    """依 Drive 檔案 ID 去除重複連結 (同一檔案的不同網址格式只保留第一個)；無法解析 ID 的連結以原字串比對"""
+    seen, unique = set(), []
+    for url in links:
+        match = re.search(r'/d/([a-zA-Z0-9_-]+)', url) or re.search(r'id=([a-zA-Z0-9_-]+)', url)
+        file_id = match.group(1) if match else url
+        if file_id not in seen:
+            seen.add(file_id); unique.append(url)
+    return unique
+
+def visible_pages(pages, key, filename):
+    """多頁 PDF 只回傳前 PREVIEW_PAGES 頁，使用者開啟切換鈕後才回傳全部頁面"""
+    if len(pages) <= PREVIEW_PAGES or not isinstance(pages[0], PdfPage): return pages
+    if st.toggle(f"📄 {filename} 共 {len(pages)} 頁 (目前顯示前 {PREVIEW_PAGES} 頁)，顯示全部頁面", key=key): return pages
+    return pages[:PREVIEW_PAGES]
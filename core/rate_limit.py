@@ -0,0 +1,164 @@
+import time
+import heapq
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+import streamlit as st
+
+# ==========================================
+# 全站共用 Google API 流量控制 (Token Bucket)
+# ==========================================
+# 所有頁面的 Sheets 讀取 / Sheets 寫入 / Drive 呼叫都經過同一組令牌桶 (由 core.gsheets 在連線層掛載)：
+#   - 配額用完時在行程內短暫排隊，而不是各 session 同時撞上 429 後一起退避、一起重試
+#   - 排隊依優先序放行：填報送出 (SUBMIT) > 一般操作 (NORMAL) > 儀表板 / 背景更新 (BACKGROUND)
+#   - 收到 429 時整個桶暫停一段時間，所有 session 一同讓出配額
+# limiter_stats() 回傳各桶的計數 (取得令牌數、排隊數、逾時未取得令牌仍送出數、429 次數、等待時間)；limiter_caption() 於管理頁面顯示。
+
+PRIORITY_SUBMIT, PRIORITY_NORMAL, PRIORITY_BACKGROUND = 0, 1, 2
+
+# (每分鐘配額, 瞬間可用量)：Sheets 每位使用者讀 / 寫各 60 次 / 分鐘；Drive 配額寬鬆，保守取 600
+BUCKET_SPECS = {"sheets_read": (60, 10), "sheets_write": (60, 10), "drive": (600, 50)}
+MAX_WAIT_SECONDS = 20          # [防護機制] 排隊上限：超過即直接送出，交由既有的重試機制處理
+THROTTLE_PAUSE_SECONDS = 5     # [防護機制] 收到 429 後整桶暫停秒數
+
+_priority = contextvars.ContextVar("api_priority", default=PRIORITY_NORMAL)
+
+@contextmanager
+def api_priority(level):
+    """with api_priority(PRIORITY_SUBMIT): 區塊內的 API 呼叫以指定優先序排隊"""
+    token = _priority.set(level)
+    try: yield
+    finally: _priority.reset(token)
+
+def with_priority(level):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with api_priority(level): return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class TokenBucket:
+    def __init__(self, name, per_minute, burst):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.cond = threading.Condition()
+        self.waiters = []
+        self.seq = itertools.count()
+        self.stats = {"acquired": 0, "queued": 0, "timeouts": 0, "throttled": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+    def _refill(self, now):
+        start = max(self.updated, self.paused_until)
+        if now > start: self.tokens = min(self.capacity, self.tokens + (now - start) * self.rate)
+        self.updated = max(now, self.updated)
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        start = time.monotonic()
+        entry = (priority, next(self.seq))
+        timed_out = False
+        with self.cond:
+            heapq.heappush(self.waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self.waiters[0] == entry and self.tokens >= 1:
+                        self.tokens -= 1
+                        break
+                    waited = now - start
+                    if waited >= MAX_WAIT_SECONDS:
+                        timed_out = True
+                        break
+                    need = max((1 - self.tokens) / self.rate, self.paused_until - now, 0.05)
+                    self.cond.wait(min(need, MAX_WAIT_SECONDS - waited))
+            finally:
+                self.waiters.remove(entry)
+                heapq.heapify(self.waiters)
+                self.cond.notify_all()
+
+            waited = time.monotonic() - start
+            self.stats["timeouts" if timed_out else "acquired"] += 1
+            if waited > 0.01: self.stats["queued"] += 1
+            self.stats["wait_total"] += waited
+            self.stats["wait_max"] = max(self.stats["wait_max"], waited)
+        return waited
+
+    def throttle(self):
+        with self.cond:
+            self.tokens = 0.0
+            self.paused_until = time.monotonic() + THROTTLE_PAUSE_SECONDS
+            self.stats["throttled"] += 1
+            self.cond.notify_all()
+
+@st.cache_resource(show_spinner=False)
+def _buckets():
+    return {name: TokenBucket(name, per_minute, burst) for name, (per_minute, burst) in BUCKET_SPECS.items()}
+
+def classify(method, url):
+    """依網址與方法判斷屬於哪一個配額桶；非 Sheets / Drive 的請求 (例如換發 Token) 不受限"""
+    url = str(url)
+    if "sheets.googleapis.com" in url:
+        return "sheets_read" if str(method).upper() == "GET" else "sheets_write"
+    if "googleapis.com/drive" in url or "googleapis.com/upload/drive" in url:
+        return "drive"
+    return None
+
+def acquire(kind):
+    return _buckets()[kind].acquire(_priority.get())
+
+def report_throttled(kind):
+    _buckets()[kind].throttle()
+
+def limiter_stats():
+    out = {}
+    for name, bucket in _buckets().items():
+        with bucket.cond:
+            out[name] = dict(bucket.stats, tokens=round(bucket.tokens, 2), waiting=len(bucket.waiters))
+    return out
+
+def limiter_caption():
+    """於頁面顯示各配額桶的排隊 / 逾時 / 429 統計 (行程啟動以來)"""
+    parts = []
+    for name, s in limiter_stats().items():
+        total = s["acquired"] + s["timeouts"]
+        if not total: continue
+        avg = s["wait_total"] / total
+        parts.append(f"{name} {total} 次 (排隊 {s['queued']}、逾時 {s['timeouts']}、429 {s['throttled']}，平均等待 {avg:.1f}s)")
+    if parts: st.caption("🚦 API 流量控制：" + "；".join(parts))
+
+# --- 連線層掛載 ---
+def limit_requests_session(session):
+    """gspread 使用的 requests Session"""
+    if getattr(session, "_rate_limited", False): return session
+    original = session.request
+
+    def request(method, url, *args, **kwargs):
+        kind = classify(method, url)
+        if kind: acquire(kind)
+        resp = original(method, url, *args, **kwargs)
+        if kind and resp.status_code == 429: report_throttled(kind)
+        return resp
+
+    session.request = request
+    session._rate_limited = True
+    return session
+
+def limit_httplib2(http):
+    """googleapiclient 使用的 AuthorizedHttp"""
+    original = http.request
+
+    def request(uri, method="GET", *args, **kwargs):
+        kind = classify(method, uri)
+        if kind: acquire(kind)
+        resp, content = original(uri, method, *args, **kwargs)
+        if kind and getattr(resp, "status", None) == 429: report_throttled(kind)
+        return resp, content
+
+    http.request = request
+    return http
@@ -0,0 +1,117 @@
+import time
+import threading
+import pandas as pd
+import streamlit as st
+from core.cache_scope import depends_on, invalidate
+from core.swr import submit_background, probe_version, REFRESH_AHEAD
+from core.mirror import mirror_append
+from core.tail_sync import tail_snapshot
+from core.schemas import restore_categories
+
+# ==========================================
+# 填報紀錄寫穿式快取 (Write-through Record Cache)
+# ==========================================
+# 以工作表為單位，在行程內保存一份已整理好的紀錄 DataFrame：
+#   - read_records()  ：快取不存在才同步呼叫 fetch 讀取雲端，並套用 prepare 產生衍生欄位；
+#                       接近逾時則先回傳現有資料，由背景執行緒重新讀取 (stale-while-revalidate)；
+#                       背景讀取前先比對試算表版本號，未異動則只延長效期
+#   - append_records()：append_rows 成功後，直接把剛寫入的列整理後接到快取尾端並遞增版本號，
+#                       填報人送出後畫面立即看到自己的資料，不必再讀一次 Google Sheet
+# 快取已透過 core.cache_scope 註冊，管理端修改 / 刪除呼叫 invalidate() 時會一併清除。
+# append_records() 同時寫穿本機 SQLite 鏡像 (core.mirror)，供儀表板查詢。
+
+class RecordCache:
+    def __init__(self, sheet_id, title):
+        self.sheet_id, self.title = sheet_id, title
+        self.lock = threading.Lock()
+        self.header = None
+        self.df = None
+        self.prepare = None
+        self.as_text = True
+        self.version = 0
+        self.loaded_at = 0.0
+        self.refreshing = False
+        self.signature = None
+
+    def __repr__(self):
+        return f"RecordCache({self.sheet_id}:{self.title})"
+
+    def clear(self):
+        with self.lock:
+            self.df = None
+            self.version += 1
+
+    def status(self):
+        return (self.loaded_at if self.df is not None else None), self.refreshing
+
+@st.cache_resource(show_spinner=False)
+def _cache_registry():
+    return {}, threading.Lock()
+
+def get_record_cache(sheet_id, title):
+    registry, lock = _cache_registry()
+    with lock:
+        if (sheet_id, title) not in registry:
+            cache = RecordCache(sheet_id, title)
+            depends_on(sheet_id, title)(cache)
+            registry[(sheet_id, title)] = cache
+        return registry[(sheet_id, title)]
+
+def _worksheet_key(worksheet):
+    return worksheet.spreadsheet.id, worksheet.title
+
+def _store(cache, raw, prepare, as_text, signature=None):
+    cache.header = list(raw.columns)
+    cache.prepare, cache.as_text = prepare, as_text
+    cache.df = prepare(raw) if prepare else raw
+    cache.loaded_at = time.time()
+    cache.signature = signature
+    cache.version += 1
+
+def _background_reload(cache, worksheet, fetch, prepare, as_text):
+    try:
+        with cache.lock: start_version, known = cache.version, cache.signature
+        signature = probe_version(cache.sheet_id)
+        if signature is not None and signature == known:
+            with cache.lock: cache.loaded_at = time.time()
+            return
+        raw = fetch(worksheet)
+        with cache.lock:
+            # 重新讀取期間若有寫穿併入或被清除，捨棄本次結果，下次呼叫再更新
+            if cache.version == start_version and cache.df is not None: _store(cache, raw, prepare, as_text, signature)
+    finally:
+        cache.refreshing = False
+
+def read_records(worksheet, fetch, prepare=None, ttl=None, as_text=True):
+    """取得紀錄 DataFrame (副本)。fetch(worksheet) 回傳原始 DataFrame，prepare(df) 產生衍生欄位"""
+    cache = get_record_cache(*_worksheet_key(worksheet))
+    with cache.lock:
+        if cache.df is None:
+            signature = probe_version(cache.sheet_id)
+            _store(cache, fetch(worksheet), prepare, as_text, signature)
+        elif ttl is not None and time.time() - cache.loaded_at > ttl * REFRESH_AHEAD and not cache.refreshing:
+            cache.refreshing = True
+            submit_background(_background_reload, cache, worksheet, fetch, prepare, as_text)
+        return cache.df.copy()
+
+def append_records(worksheet, rows):
+    """append_rows 成功後呼叫：將新列併入快取，並清除其他讀取同一工作表的快取"""
+    sheet_id, title = _worksheet_key(worksheet)
+    cache = get_record_cache(sheet_id, title)
+    merged = False
+    with cache.lock:
+        if cache.df is not None and cache.header and rows:
+            width = len(cache.header)
+            padded = [list(r)[:width] + [""] * (width - len(r)) for r in rows]
+            if cache.as_text: padded = [[str(v) for v in r] for r in padded]
+            chunk = pd.DataFrame(padded, columns=cache.header)
+            if cache.prepare: chunk = cache.prepare(chunk)
+            cache.df = restore_categories(pd.concat([cache.df, chunk], ignore_index=True), cache.df)
+            cache.version += 1
+            merged = True
+
+    mirrored = mirror_append(worksheet, rows)
+
+    # 其他頁面的快取仍需清除 (下次讀取走增量同步)，自己的快取與鏡像已是最新則保留；表尾快照只是多了新增列，不需全量重載
+    invalidate(sheet_id, title, exclude=(cache if merged else None, mirrored, tail_snapshot(sheet_id, title)))
+    return merged
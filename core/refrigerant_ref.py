@@ -0,0 +1,50 @@
+from collections import namedtuple
+import pandas as pd
+from core.gsheets import open_spreadsheet
+from core.cache_scope import depends_on
+from core.swr import swr_cache
+
+# ==========================================
+# 冷媒參考資料 (單位 / 建築物 / 設備類型 / 冷媒係數)
+# ==========================================
+# 四張參考表以一次 values.batchGet 讀取，並以向量化 pandas 整理，
+# 填報頁 (2) 與後台 (4) 共用同一份快取，不再各自逐表 get_all_records()。
+
+REF_SHEET_ID = "1p7GsW-nrjerXhnn3pNgZzu_CdIh1Yxsm-fLJDqQ6MqA"
+REF_TABLES = ("單位資訊", "建築物清單", "設備類型", "冷媒係數表")
+
+RefrigerantRefData = namedtuple("RefrigerantRefData", ["unit_dict", "build_dict", "e_types", "r_types", "gwp_map"])
+
+def _to_frame(values):
+    if not values: return pd.DataFrame()
+    header, rows = values[0], values[1:]
+    width = len(header)
+    return pd.DataFrame([list(r[:width]) + [""] * (width - len(r)) for r in rows], columns=header)
+
+def _group_unique(df):
+    """前兩欄 → {第 1 欄: [第 2 欄 (不重複，依出現順序)]}"""
+    if df.shape[1] < 2: return {}
+    pairs = pd.DataFrame({"k": df.iloc[:, 0].astype(str).str.strip(), "v": df.iloc[:, 1].astype(str).str.strip()})
+    pairs = pairs[(pairs["k"] != "") & (pairs["v"] != "")].drop_duplicates()
+    return pairs.groupby("k", sort=False)["v"].agg(list).to_dict()
+
+def _parse_coef(df):
+    if df.shape[1] < 3: return [], {}
+    names = df.iloc[:, 1].astype(str).str.strip().str.replace('\u3000', ' ').str.replace('\xa0', ' ')
+    gwp = pd.to_numeric(df.iloc[:, 2].astype(str).str.replace(',', ''), errors='coerce').fillna(0.0).astype(float)
+    valid = names != ""
+    return names[valid].tolist(), dict(zip(names[valid], gwp[valid]))
+
+@depends_on(REF_SHEET_ID, *REF_TABLES)
+@swr_cache(ttl=3600, watch=REF_SHEET_ID)
+def load_reference_data():
+    res = open_spreadsheet(REF_SHEET_ID).values_batch_get([f"'{t}'" for t in REF_TABLES])
+    df_units, df_build, df_types, df_coef = [_to_frame(vr.get('values', [])) for vr in res.get('valueRanges', [])]
+
+    e_types = df_types.iloc[:, 0].dropna().unique().tolist() if not df_types.empty else []
+    r_types, gwp_map = _parse_coef(df_coef)
+    if '其他' not in r_types:
+        r_types.append('其他')
+        gwp_map['其他'] = 0.0
+
+    return RefrigerantRefData(_group_unique(df_units), _group_unique(df_build), e_types, list(dict.fromkeys(r_types)), gwp_map)
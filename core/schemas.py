@@ -0,0 +1,50 @@
+import pandas as pd
+
+# ==========================================
+# 各工作表欄位型別表 (Schema)
+# ==========================================
+# 在快取內 (載入時) 一次完成型別轉換，頁面重跑不再各自 pd.to_numeric / pd.to_datetime：
+#   - category：單位、油品、設備類別、校區等重複值多的欄位，快取記憶體與每次複製的成本大幅下降
+#   - float：{目標欄位: (來源欄位, 無法解析時的預設值)}；int：數值欄位轉為整數 (無法解析者補 0)
+#   - date：{原欄位: 衍生欄位}，原字串欄位保留 (顯示與寫回用)，另產生 datetime 欄位
+#   - 其餘欄位一律為字串
+# 注意：category 欄位 groupby 時請加 observed=True；fillna 不可填入類別以外的新值 (需先 astype(object))。
+
+FUEL_EQUIPMENT = {
+    "category": ["填報單位", "原燃物料名稱", "設備所屬單位/部門", "統計類別"],
+    "float": {"設備數量_num": ("設備數量", 1)},
+}
+
+FUEL_RECORDS = {
+    "category": ["填報單位", "原燃物料名稱"],
+    "float": {"加油量": ("加油量", 0)},
+    "date": {"加油日期": "日期格式"},
+}
+
+POWER_DAILY = {
+    "category": ["校區", "用電地址"],
+    "int": ["統計年度", "統計月份"],
+}
+
+def apply_schema(df, schema, text=True):
+    """依 schema 轉換型別並回傳 df (就地修改)；text=False 時未列入 schema 的欄位維持原型別"""
+    typed = set(schema.get("category", [])) | set(schema.get("float", {})) | set(schema.get("int", []))
+    if text:
+        # 取代整表 astype(str)：get_all_records 會把數字字串轉為數值，未列入 schema 的欄位一律還原為字串
+        for c in df.columns:
+            if c not in typed: df[c] = df[c].astype(str)
+    for target, (source, default) in schema.get("float", {}).items():
+        df[target] = pd.to_numeric(df[source], errors='coerce').fillna(default).astype(float) if source in df.columns else float(default)
+    for c in schema.get("int", []):
+        if c in df.columns: df[c] = pd.to_numeric(df[c], errors='coerce').fillna(0).astype(int)
+    for source, target in schema.get("date", {}).items():
+        if source in df.columns: df[target] = pd.to_datetime(df[source], errors='coerce')
+    for c in schema.get("category", []):
+        if c in df.columns: df[c] = df[c].astype(str).astype("category")
+    return df
+
+def restore_categories(df, like):
+    """concat 後類別不一致會退化為字串欄位：依 like 的型別重新轉回 category (寫穿併入新列時使用)"""
+    for c in like.select_dtypes("category").columns:
+        if c in df.columns and df[c].dtype != "category": df[c] = df[c].astype(str).astype("category")
+    return df
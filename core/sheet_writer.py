@@ -0,0 +1,152 @@
+import numbers
+import numpy as np
+import pandas as pd
+from gspread.utils import rowcol_to_a1
+
+# ==========================================
+# 差異寫入 (Diff Writer)：只送出有變動的儲存格 / 列
+# ==========================================
+# 取代「ws.clear() + ws.update(全部資料)」：
+#   - 寫入量與異動筆數成正比，不再隨歷史資料量增長
+#   - 不會出現工作表被清空的空窗期，前台同時送出的資料不會遺失
+# 所有異動組成一次 spreadsheets.batchUpdate，依序為：
+#   1. updateCells   (以刪除前的列位置更新儲存格)
+#   2. deleteDimension (由下往上刪，避免列位置位移)
+#   3. appendCells   (新增列接在表尾)
+# 整批為原子操作，任一請求失敗則全部不生效。
+
+def _cell_data(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)): return {"userEnteredValue": {"stringValue": ""}}
+    if isinstance(value, (bool, np.bool_)): return {"userEnteredValue": {"boolValue": bool(value)}}
+    if isinstance(value, numbers.Number): return {"userEnteredValue": {"numberValue": value.item() if hasattr(value, "item") else value}}
+    return {"userEnteredValue": {"stringValue": str(value)}}
+
+def update_cell_request(sheet_gid, row_number, col_number, value):
+    """row_number / col_number 皆為 1-based (與試算表一致)"""
+    return {"updateCells": {
+        "rows": [{"values": [_cell_data(value)]}],
+        "fields": "userEnteredValue",
+        "start": {"sheetId": sheet_gid, "rowIndex": row_number - 1, "columnIndex": col_number - 1},
+    }}
+
+def update_row_request(sheet_gid, row_number, values, start_col=1):
+    return {"updateCells": {
+        "rows": [{"values": [_cell_data(v) for v in values]}],
+        "fields": "userEnteredValue",
+        "start": {"sheetId": sheet_gid, "rowIndex": row_number - 1, "columnIndex": start_col - 1},
+    }}
+
+def delete_rows_requests(sheet_gid, row_numbers):
+    """將欲刪除的列 (1-based) 合併為連續區段，由下往上產生 deleteDimension"""
+    rows = sorted(set(int(r) for r in row_numbers), reverse=True)
+    requests, i = [], 0
+    while i < len(rows):
+        end = rows[i]; start = end
+        while i + 1 < len(rows) and rows[i + 1] == start - 1:
+            i += 1; start = rows[i]
+        requests.append({"deleteDimension": {"range": {"sheetId": sheet_gid, "dimension": "ROWS", "startIndex": start - 1, "endIndex": end}}})
+        i += 1
+    return requests
+
+def append_rows_request(sheet_gid, rows):
+    return {"appendCells": {
+        "sheetId": sheet_gid,
+        "rows": [{"values": [_cell_data(v) for v in row]} for row in rows],
+        "fields": "userEnteredValue",
+    }}
+
+def build_diff_requests(sheet_gid, updates=(), deletes=(), appends=()):
+    """updates: [(列, 欄, 值)]；deletes: [列]；appends: [[值...]] → 依安全順序組成請求清單"""
+    requests = [update_cell_request(sheet_gid, r, c, v) for r, c, v in updates]
+    requests += delete_rows_requests(sheet_gid, deletes)
+    if appends: requests.append(append_rows_request(sheet_gid, list(appends)))
+    return requests
+
+def apply_requests(worksheet, requests):
+    """一次 spreadsheets.batchUpdate 送出；無異動時不呼叫 API，回傳送出的請求數"""
+    if not requests: return 0
+    worksheet.spreadsheet.batch_update({"requests": requests})
+    return len(requests)
+
+def stale_rows(worksheet, expected, columns):
+    """以快照列號刪改前核對：expected 為 {列號: 快照中該列在 columns (1-based 欄號) 的值}
+
+    一次 batchGet 重新讀取這些列，回傳內容已不符的列號 (他人增刪列造成位移)；位置對應的寫入不是冪等的，不符時應放棄整批。
+    """
+    rows = sorted(expected)
+    if not rows: return []
+    lo, hi = min(columns), max(columns)
+    live = worksheet.batch_get([f"{rowcol_to_a1(r, lo)}:{rowcol_to_a1(r, hi)}" for r in rows])
+    bad = []
+    for r, vr in zip(rows, live):
+        values = (list(vr[0]) if vr else []) + [""] * (hi - lo + 1)
+        if [_norm(values[c - lo]) for c in columns] != [_norm(v) for v in expected[r]]: bad.append(r)
+    return bad
+
+def diff_positional_frames(base_df, edited_df, columns, row_of=lambda label: int(label) + 2):
+    """比對 data_editor 編輯前後的 DataFrame (以原 index 對應試算表列位置)
+
+    回傳 (updates, deletes, appends)；兩邊需先轉為相同的寫入格式 (例如皆 astype(str))。
+    row_of 將 index 轉為試算表列號，預設 index 0 對應第 2 列 (第 1 列為標題)。
+    """
+    base = base_df.reindex(columns=columns)
+    edited = edited_df.reindex(columns=columns)
+
+    kept = edited.index.intersection(base.index)
+    updates = []
+    if len(kept):
+        b, e = base.loc[kept], edited.loc[kept]
+        changed = (b != e) & ~(b.isna() & e.isna())
+        for r_pos, c_pos in zip(*changed.values.nonzero()):
+            updates.append((row_of(kept[r_pos]), int(c_pos) + 1, e.iat[r_pos, c_pos]))
+
+    deletes = [row_of(i) for i in base.index.difference(edited.index)]
+    new_mask = ~edited.index.isin(base.index) | pd.isna(edited.index)
+    appends = edited[new_mask].values.tolist()
+    return updates, deletes, appends
+
+# ==========================================
+# 以鍵值比對的差異寫入 (適用排序會變動、非 data_editor 位置對應的資料)
+# ==========================================
+def _norm(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)): return ""
+    if isinstance(value, (float, np.floating)) and float(value).is_integer(): return str(int(value))
+    return str(value).strip()
+
+def _row_keys(df, key_cols):
+    keys = df[key_cols].apply(lambda col: col.map(_norm)).agg("|".join, axis=1)
+    # 同鍵值重複出現時依出現順序編號，逐筆配對
+    return keys + "#" + keys.groupby(keys).cumcount().astype(str)
+
+def diff_keyed_frames(base_df, target_df, key_cols, header, ignore_cols=(), row_of=lambda label: int(label) + 2):
+    """base_df：範圍內已載入的資料 (index 對應試算表列位置)；target_df：該範圍應有的新內容
+
+    回傳 (updates, deletes, appends)。ignore_cols 不參與異動判斷，但該列有異動時會一併寫入 (例如填報時間)。
+    """
+    base_keys = dict(zip(_row_keys(base_df, key_cols), base_df.index)) if not base_df.empty else {}
+    target_keys = dict(zip(_row_keys(target_df, key_cols), range(len(target_df)))) if not target_df.empty else {}
+    cols = [(i + 1, c) for i, c in enumerate(header) if c in target_df.columns]
+
+    updates, appends = [], []
+    for key, t_pos in target_keys.items():
+        t_row = target_df.iloc[t_pos]
+        if key not in base_keys:
+            appends.append([t_row[c] if c in target_df.columns else "" for c in header])
+            continue
+        label = base_keys[key]
+        changed = [(n, c) for n, c in cols if c not in ignore_cols and _norm(base_df.at[label, c] if c in base_df.columns else "") != _norm(t_row[c])]
+        if changed:
+            changed += [(n, c) for n, c in cols if c in ignore_cols]
+            updates += [(row_of(label), n, t_row[c]) for n, c in changed]
+
+    deletes = [row_of(label) for key, label in base_keys.items() if key not in target_keys]
+    return updates, deletes, appends
+
+def sync_rows_by_key(worksheet, base_df, target_df, key_cols, scope_mask=None, ignore_cols=()):
+    """將 scope_mask 範圍內的資料同步為 target_df，僅送出新增 / 修改 / 刪除的差異 (一次 batchUpdate)"""
+    header = [str(h).strip() for h in worksheet.row_values(1)]
+    base = base_df.rename(columns=lambda c: str(c).strip())
+    if scope_mask is not None: base = base[scope_mask.values]
+    updates, deletes, appends = diff_keyed_frames(base, target_df, key_cols, header, ignore_cols)
+    apply_requests(worksheet, build_diff_requests(worksheet.id, updates, deletes, appends))
+    return len(updates), len(deletes), len(appends)
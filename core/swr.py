@@ -0,0 +1,154 @@
+import copy
+import time
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+import streamlit as st
+from core.rate_limit import api_priority, PRIORITY_BACKGROUND
+from core.gsheets import spreadsheet_version
+
+# ==========================================
+# 過期仍可用 + 背景更新 (Stale-while-revalidate)
+# ==========================================
+# 取代 @st.cache_data(ttl=...) 的硬性到期：
+#   - 快照年齡 < ttl × REFRESH_AHEAD：直接回傳快照
+#   - 超過 ttl × REFRESH_AHEAD (含已過期)：立即回傳上一份快照，同時交由背景執行緒重新載入
+#   - 尚無快照 (首次載入、寫入後 invalidate)：才同步載入，同一鍵值同時只會有一個載入，其餘 session 等待同一份結果
+#   - 快照年齡超過 ttl × MAX_STALE_FACTOR (背景更新持續失敗)：改為同步載入，失敗時拋出例外，不再無限期沿用舊快照
+# 背景更新失敗時保留舊快照，下次呼叫再試；freshness_caption() 於頁面顯示資料更新時間與更新失敗提示。
+# 載入函式會在背景執行緒執行：不可呼叫 st.* (錯誤請直接拋出，由頁面顯示)，也不可回傳錯誤時的替代空表。
+#
+# 指定 watch=SHEET_ID 時，背景更新前先查詢試算表的 Drive 版本號 (一次輕量 metadata 請求)：
+# 版本未變即只延長快照效期，不重新下載整張工作表 —— 夜間與假日幾乎都是這種情況，TTL 因此可以設短。
+#
+#   @depends_on(SHEET_ID, "工作表")
+#   @swr_cache(ttl=600, watch=SHEET_ID)
+#   def load_xxx(): ...
+#
+# 與 st.cache_data 相同，底線開頭的參數 (例如 _gc) 不列入快取鍵值。
+
+REFRESH_AHEAD = 0.8
+MAX_STALE_FACTOR = 5
+REFRESH_WORKERS = 2
+
+class _Entry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = None
+        self.loaded_at = None
+        self.refreshing = False
+        self.error = None
+        self.signature = None
+        self.args = ((), {})
+
+@st.cache_resource(show_spinner=False)
+def _swr_registry():
+    return {}, threading.Lock()
+
+@st.cache_resource(show_spinner=False)
+def _refresh_pool():
+    return ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix="swr-refresh")
+
+def _func_key(func):
+    raw = inspect.unwrap(func)
+    code = getattr(raw, "__code__", None)
+    return f"{code.co_filename if code else raw.__module__}:{raw.__qualname__}"
+
+def _entries_of(func_key):
+    registry, lock = _swr_registry()
+    with lock: return registry.setdefault(func_key, {})
+
+def submit_background(fn, *args):
+    """以背景優先序在共用執行緒池執行 (供其他快取層使用同一套背景更新)"""
+    def run():
+        with api_priority(PRIORITY_BACKGROUND): return fn(*args)
+    return _refresh_pool().submit(run)
+
+def probe_version(sheet_id):
+    """取得試算表版本號；查詢失敗回傳 None (視為有異動，照常重新載入)"""
+    if not sheet_id: return None
+    try: return spreadsheet_version(sheet_id)
+    except Exception: return None
+
+def _refresh(func, entry, watch):
+    args, kwargs = entry.args
+    try:
+        with api_priority(PRIORITY_BACKGROUND):
+            signature = probe_version(watch)
+            if signature is not None and signature == entry.signature:
+                # 試算表未異動：延長快照效期即可
+                with entry.lock: entry.loaded_at = time.time()
+                return
+            value = func(*args, **kwargs)
+        with entry.lock:
+            entry.value, entry.loaded_at, entry.error, entry.signature = value, time.time(), None, signature
+    except Exception as e:
+        with entry.lock: entry.error = e
+    finally:
+        with entry.lock: entry.refreshing = False
+
+def swr_cache(ttl, spinner=None, watch=None):
+    def decorator(func):
+        sig = inspect.signature(func)
+        func_key = _func_key(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arg_key = repr([(k, v) for k, v in bound.arguments.items() if not k.startswith("_")])
+            entries = _entries_of(func_key)
+            registry, reg_lock = _swr_registry()
+            with reg_lock: entry = entries.setdefault(arg_key, _Entry())
+
+            with entry.lock:
+                entry.args = (args, kwargs)
+                age = time.time() - entry.loaded_at if entry.loaded_at is not None else None
+                if age is not None and age <= ttl * MAX_STALE_FACTOR:
+                    if age > ttl * REFRESH_AHEAD and not entry.refreshing:
+                        entry.refreshing = True
+                        _refresh_pool().submit(_refresh, func, entry, watch)
+                    return copy.deepcopy(entry.value)
+
+                # 尚無快照 / 快照過舊：同步載入 (持有 entry.lock，同時到達的 session 等待同一次載入)
+                signature = probe_version(watch)
+                if spinner:
+                    with st.spinner(spinner): value = func(*args, **kwargs)
+                else:
+                    value = func(*args, **kwargs)
+                entry.value, entry.loaded_at, entry.error, entry.signature = value, time.time(), None, signature
+                return copy.deepcopy(value)
+
+        def clear():
+            registry, reg_lock = _swr_registry()
+            with reg_lock: registry[func_key] = {}
+
+        def status():
+            """回傳 (最舊快照的載入時間, 是否背景更新中, 最近一次背景更新的錯誤)"""
+            entries = list(_entries_of(func_key).values())
+            loaded = [e.loaded_at for e in entries if e.loaded_at is not None]
+            error = next((e.error for e in entries if e.error is not None), None)
+            return (min(loaded) if loaded else None), any(e.refreshing for e in entries), error
+
+        wrapper.clear = clear
+        wrapper.status = status
+        return wrapper
+    return decorator
+
+def freshness_caption(*cached_funcs):
+    """於頁面顯示資料快照時間 (取最舊者)，取代載入中轉圈圈"""
+    stamps, refreshing, failed = [], False, False
+    for f in cached_funcs:
+        # status() 第三個值 (背景更新錯誤) 為選用，其他快取層只回傳前兩個值
+        loaded_at, busy, *rest = f.status()
+        if loaded_at is not None: stamps.append(loaded_at)
+        refreshing = refreshing or busy
+        failed = failed or bool(rest and rest[0] is not None)
+    if not stamps: return
+    oldest = min(stamps)
+    age_min = int((time.time() - oldest) // 60)
+    tw_time = datetime.fromtimestamp(oldest, timezone(timedelta(hours=8))).strftime("%m/%d %H:%M")
+    note = " · ⚠️ 背景更新失敗，顯示上一份資料" if failed else (" · 🔄 背景更新中" if refreshing else "")
+    st.caption(f"🕒 資料更新於 {tw_time} ({'剛剛' if age_min < 1 else f'{age_min} 分鐘前'}){note}")
@@ -0,0 +1,89 @@
+import re
+import time
+import threading
+import streamlit as st
+from gspread.utils import rowcol_to_a1
+from core.cache_scope import depends_on
+from core.swr import probe_version
+
+# ==========================================
+# 只增不減工作表的增量同步 (Tail Sync)
+# ==========================================
+# 填報紀錄類工作表平時只會由前台 append_rows 往下長，
+# 因此記住上次看到的列數，下次只讀取「最後一列 ~ 表尾」的區段：
+#   1. 第一列用來核對錨點：若與快取的最後一列不同，代表中間有刪除或異動 → 全量重載
+#   2. 其餘列即為新增資料，直接接在快取後方
+# 讀取前先比對試算表版本號：未變則直接沿用快取；版本已變但表尾沒有新增列 (異動發生在表尾以上) → 全量重載。
+# 管理端修改 / 刪除後須呼叫 invalidate_tail()；快照已透過 core.cache_scope 註冊，invalidate() (例如「刷新數據」) 也會標記全量重載。
+
+FULL_RESYNC_SECONDS = 86400  # [防護機制] 每日至少全量校正一次，涵蓋直接在試算表介面的手動修改
+
+class _TailSnapshot:
+    def __init__(self, key):
+        self.key = key
+        self.lock = threading.Lock()
+        self.values = []
+        self.dirty = True
+        self.full_loaded_at = 0.0
+        self.signature = None
+
+    def __repr__(self):
+        return f"TailSnapshot({self.key[0]}:{self.key[1]})"
+
+    def clear(self):
+        self.dirty = True
+
+@st.cache_resource(show_spinner=False)
+def _snapshot_registry():
+    return {}, threading.Lock()
+
+def _get_snapshot(key):
+    registry, reg_lock = _snapshot_registry()
+    with reg_lock:
+        if key not in registry:
+            registry[key] = _TailSnapshot(key)
+            depends_on(*key)(registry[key])
+        return registry[key]
+
+def _pad(row, width):
+    return row + [""] * (width - len(row)) if len(row) < width else row[:width]
+
+def _full_reload(worksheet, snap, signature):
+    snap.values = worksheet.get_all_values()
+    snap.dirty = False
+    snap.full_loaded_at = time.time()
+    snap.signature = signature
+
+def sync_worksheet_tail(worksheet):
+    """回傳工作表全部值 (含標題列)，快取命中時僅讀取新增的尾端列"""
+    snap = _get_snapshot((worksheet.spreadsheet.id, worksheet.title))
+    with snap.lock:
+        signature = probe_version(worksheet.spreadsheet.id)  # 查詢失敗為 None：照常讀取表尾
+        expired = time.time() - snap.full_loaded_at > FULL_RESYNC_SECONDS
+        if snap.dirty or expired or len(snap.values) < 2:
+            _full_reload(worksheet, snap, signature)
+        elif signature is not None and signature == snap.signature:
+            pass  # 試算表未異動
+        else:
+            width = len(snap.values[0])
+            last_row = len(snap.values)
+            last_col = re.sub(r'\d+', '', rowcol_to_a1(1, width))
+            tail = worksheet.get(f"A{last_row}:{last_col}")
+            tail = [_pad(list(r), width) for r in tail]
+
+            if not tail or tail[0] != _pad(snap.values[-1], width):
+                _full_reload(worksheet, snap, signature)
+            elif len(tail) == 1 and signature is not None:
+                _full_reload(worksheet, snap, signature)  # 版本已變但沒有新增列：異動在表尾以上
+            else:
+                snap.values = snap.values + tail[1:]
+                snap.signature = signature
+        return list(snap.values)
+
+def tail_snapshot(spreadsheet_id, title):
+    """取得表尾快照物件 (供前台 append 後 invalidate(exclude=...) 保留：新增列由下次表尾讀取接上)"""
+    return _get_snapshot((spreadsheet_id, title))
+
+def invalidate_tail(spreadsheet_id, title):
+    """管理端修改或刪除資料後呼叫，下次同步時強制全量重載"""
+    _get_snapshot((spreadsheet_id, title)).dirty = True
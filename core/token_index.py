@@ -0,0 +1,117 @@
+import re
+import time
+import threading
+import streamlit as st
+from core.cache_scope import depends_on, invalidate
+
+# ==========================================
+# 專屬連結金鑰索引 (Token Index)
+# ==========================================
+# 以「token → (試算表列號, 紀錄)」建立雜湊索引，常駐於行程內：
+#   - lookup_token()   ：索引不存在 / 逾時才讀取整張金鑰表重建，其餘皆為 O(1) 查詢
+#   - register_tokens()：後台寄送通知 append_rows 後，依 API 回傳的寫入範圍直接把新金鑰加入索引
+#   - patch_token()    ：填報完成更新回覆狀態後，同步修改索引中的紀錄
+#   - verify_token_row()：以列號寫入前，核對剛讀取的該列金鑰；列已被刪除 / 重排時重建索引取得正確列號
+# 索引已透過 core.cache_scope 註冊，其他寫入金鑰表的動作呼叫 invalidate() 時會一併清除。
+
+INDEX_TTL = 3600
+MISS_RELOAD_SECONDS = 60  # [防護機制] 查無金鑰時，距上次重建超過 60 秒才重讀一次 (涵蓋直接在試算表手動新增的金鑰)
+
+class TokenIndex:
+    def __init__(self, sheet_id, title, token_col):
+        self.sheet_id, self.title, self.token_col = sheet_id, title, token_col
+        self.lock = threading.Lock()
+        self.header = []
+        self.entries = None
+        self.loaded_at = 0.0
+
+    def __repr__(self):
+        return f"TokenIndex({self.sheet_id}:{self.title})"
+
+    def clear(self):
+        with self.lock: self.entries = None
+
+    def _put(self, row_idx, row):
+        row = list(row)
+        record = dict(zip(self.header, row + [""] * (len(self.header) - len(row))))
+        token = str(record.get(self.token_col, "")).strip()
+        # 與原本線性搜尋一致：同一金鑰重複出現時以第一筆為準
+        if token: self.entries.setdefault(token, (row_idx, record))
+
+    def _rebuild(self, worksheet):
+        values = worksheet.get_all_values()
+        self.header = [str(h).strip() for h in values[0]] if values else []
+        self.entries = {}
+        for i, row in enumerate(values[1:]): self._put(i + 2, row)
+        self.loaded_at = time.time()
+
+@st.cache_resource(show_spinner=False)
+def _index_registry():
+    return {}, threading.Lock()
+
+def get_token_index(sheet_id, title, token_col="專屬金鑰(Token)"):
+    registry, lock = _index_registry()
+    with lock:
+        if (sheet_id, title) not in registry:
+            index = TokenIndex(sheet_id, title, token_col)
+            depends_on(sheet_id, title)(index)
+            registry[(sheet_id, title)] = index
+        return registry[(sheet_id, title)]
+
+def _index_of(worksheet):
+    return get_token_index(worksheet.spreadsheet.id, worksheet.title)
+
+def lookup_token(worksheet, token):
+    """回傳 (紀錄 dict 副本, 試算表列號)；查無則回傳 (None, None)"""
+    index = _index_of(worksheet)
+    token = str(token).strip()
+    with index.lock:
+        if index.entries is None or time.time() - index.loaded_at > INDEX_TTL:
+            index._rebuild(worksheet)
+        elif token not in index.entries and time.time() - index.loaded_at > MISS_RELOAD_SECONDS:
+            index._rebuild(worksheet)
+        hit = index.entries.get(token)
+    return (dict(hit[1]), hit[0]) if hit else (None, None)
+
+def verify_token_row(worksheet, token, row_idx, row_values):
+    """row_values 為寫入前剛讀取的第 row_idx 列；金鑰相符回傳 (row_idx, row_values)，
+    不符則重建索引後回傳 (正確列號, 該列內容)，查無金鑰回傳 (None, None)"""
+    index = _index_of(worksheet)
+    token = str(token).strip()
+    with index.lock:
+        col = index.header.index(index.token_col) if index.token_col in index.header else None
+        if col is not None and col < len(row_values) and str(row_values[col]).strip() == token: return row_idx, row_values
+        index._rebuild(worksheet)
+        hit = index.entries.get(token)
+        if not hit: return None, None
+        return hit[0], [str(hit[1].get(h, "")) for h in index.header]
+
+def _start_row(append_response):
+    updated_range = ((append_response or {}).get("updates") or {}).get("updatedRange", "")
+    match = re.search(r"![A-Z]+(\d+)", updated_range)
+    return int(match.group(1)) if match else None
+
+def register_tokens(worksheet, rows, append_response):
+    """append_rows 成功後呼叫：依回傳的 updatedRange 將新列加入索引，並清除其他讀取金鑰表的快取"""
+    index = _index_of(worksheet)
+    start = _start_row(append_response)
+    merged = False
+    with index.lock:
+        if index.entries is not None and start is not None:
+            for offset, row in enumerate(rows): index._put(start + offset, row)
+            merged = True
+    invalidate(index.sheet_id, index.title, exclude=index if merged else None)
+    return merged
+
+def patch_token(worksheet, token, values_by_col):
+    """寫回金鑰表後同步更新索引紀錄；values_by_col 為 {欄號 (1-based): 值}"""
+    index = _index_of(worksheet)
+    patched = False
+    with index.lock:
+        hit = index.entries.get(str(token).strip()) if index.entries is not None else None
+        if hit:
+            for col, value in values_by_col.items():
+                if 0 < col <= len(index.header): hit[1][index.header[col - 1]] = value
+            patched = True
+    invalidate(index.sheet_id, index.title, exclude=index if patched else None)
+    return patched
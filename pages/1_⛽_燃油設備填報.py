@@ -1,10 +1,7 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, date, timedelta
-import gspread
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
+from googleapiclient.http import MediaIoBaseUpload
 import streamlit_authenticator as stauth
 import plotly.express as px
 import plotly.graph_objects as go
@@ -15,13 +12,16 @@ import io
 import uuid
 from PIL import Image
 from functools import wraps
-
-# [PDF 截圖套件防護]
-try:
-    import fitz  # PyMuPDF
-    HAS_FITZ = True
-except ImportError:
-    HAS_FITZ = False
+from core.gsheets import get_drive_service, open_spreadsheet, get_worksheet_or_none, ensure_worksheet
+from core.tail_sync import sync_worksheet_tail
+from core.rate_limit import with_priority, PRIORITY_SUBMIT
+from core.swr import swr_cache, freshness_caption
+from core.cache_scope import depends_on, invalidate
+from core.record_cache import read_records, append_records, get_record_cache
+from core.schemas import apply_schema, FUEL_EQUIPMENT, FUEL_RECORDS
+from core.evidence_cache import evidence_file
+# [PDF 截圖套件防護] HAS_FITZ 由 core.pdf_preview 判斷 (未安裝 PyMuPDF 時 PDF 僅提供下載)
+from core.pdf_preview import pdf_pages, show_preview, visible_pages, unique_drive_links, ImageFile, HAS_FITZ
 
 # ==========================================
 # 0. 系統設定 (輕量前台版) & 共用防護機制
@@ -51,8 +51,9 @@ def with_retry(max_retries=5, base_delay=2.0, backoff_factor=2.0):
         return wrapper
     return decorator
 
-# [防護機制 1.1] 封裝重試 API 動作
+# [防護機制 1.1] 封裝重試 API 動作 (填報送出以最高優先序排隊)
 @with_retry(max_retries=5, base_delay=3.0)
+@with_priority(PRIORITY_SUBMIT)
 def append_rows_with_retry(worksheet, rows):
     worksheet.append_rows(rows)
 
@@ -61,10 +62,12 @@ def get_all_records_with_retry(worksheet):
     return worksheet.get_all_records()
 
 @with_retry(max_retries=3, base_delay=2.0)
-def get_all_values_with_retry(worksheet):
-    return worksheet.get_all_values()
+def sync_record_values_with_retry(worksheet):
+    # 填報紀錄只增不減：快取命中時僅讀取新增的尾端列，不再整表下載
+    return sync_worksheet_tail(worksheet)
 
 @with_retry(max_retries=3, base_delay=2.0)
+@with_priority(PRIORITY_SUBMIT)
 def upload_file_to_drive_with_retry(drive_svc, file_meta, file_obj, mime_type):
     file_obj.seek(0)
     media = MediaIoBaseUpload(file_obj, mimetype=mime_type, resumable=True)
@@ -290,54 +293,52 @@ FLEET_CARDS = {"總務處事務組-柴油": "TZI510508", "總務處事務組-汽
 DEVICE_ORDER = ["公務車輛(GV-1-)", "乘坐式割草機(GV-2-)", "乘坐式農用機具(GV-3-)", "鍋爐(GS-1-)", "發電機(GS-2-)", "肩背或手持式割草機、吹葉機(GS-3-)", "肩背或手持式農用機具(GS-4-)"]
 DEVICE_CODE_MAP = {"GV-1": "公務車輛(GV-1-)", "GV-2": "乘坐式割草機(GV-2-)", "GV-3": "乘坐式農用機具(GV-3-)", "GS-1": "鍋爐(GS-1-)", "GS-2": "發電機(GS-2-)", "GS-3": "肩背或手持式割草機、吹葉機(GS-3-)", "GS-4": "肩背或手持式農用機具(GS-4-)"}
 MORANDI_COLORS = { "公務車輛(GV-1-)": "#B0C4DE", "乘坐式割草機(GV-2-)": "#F5CBA7", "乘坐式農用機具(GV-3-)": "#D7BDE2", "鍋爐(GS-1-)": "#E6B0AA", "發電機(GS-2-)": "#A9CCE3", "肩背或手持式割草機、吹葉機(GS-3-)": "#A3E4D7", "肩背或手持式農用機具(GS-4-)": "#F9E79F" }
+RECORD_HEADER = ("填報時間", "填報單位", "填報人", "填報人分機", "設備名稱備註", "校內財產編號", "原燃物料名稱", "油卡編號", "加油日期", "加油量", "與其他設備共用加油單", "備註", "佐證資料")
 DASH_PALETTE = ['#B0C4DE', '#F5CBA7', '#A9CCE3', '#E6B0AA', '#D7BDE2', '#A3E4D7', '#F9E79F', '#95A5A6', '#85C1E9', '#D2B4DE', '#F1948A', '#76D7C4']
 
-@st.cache_resource
-def init_google_fuel():
-    oauth = st.secrets["gcp_oauth"]
-    creds = Credentials(token=None, refresh_token=oauth["refresh_token"], token_uri="https://oauth2.googleapis.com/token", client_id=oauth["client_id"], client_secret=oauth["client_secret"], scopes=["https://www.googleapis.com/auth/drive", "https://www.googleapis.com/auth/spreadsheets"])
-    gc = gspread.authorize(creds); drive = build('drive', 'v3', credentials=creds)
-    return gc, drive
-
 try:
-    gc, drive_service = init_google_fuel()
-    sh = gc.open_by_key(SHEET_ID)
-    try: ws_equip = sh.worksheet("設備清單") 
-    except: ws_equip = sh.sheet1 
-    try: ws_record = sh.worksheet("油料填報紀錄")
-    except:
-        try: ws_record = sh.worksheet("填報紀錄")
-        except: ws_record = sh.add_worksheet(title="油料填報紀錄", rows="1000", cols="13")
-            
-    if len(ws_record.get_all_values()) == 0: ws_record.append_row(["填報時間", "填報單位", "填報人", "填報人分機", "設備名稱備註", "校內財產編號", "原燃物料名稱", "油卡編號", "加油日期", "加油量", "與其他設備共用加油單", "備註", "佐證資料"])
+    drive_service = get_drive_service()
+    sh = open_spreadsheet(SHEET_ID)
+    ws_equip = get_worksheet_or_none(SHEET_ID, "設備清單") or sh.sheet1
+    # 建立工作表 / 補標題列每個行程只檢查一次，且只讀取第 1 列，不再每次重跑都下載整張紀錄表
+    ws_record = ensure_worksheet(SHEET_ID, ("油料填報紀錄", "填報紀錄"), RECORD_HEADER)
 except Exception as e: st.error(f"燃油資料庫連線失敗: {e}"); st.stop()
 
-@st.cache_data(ttl=86400)
-def load_fuel_data():
-    df_e = pd.DataFrame()
-    df_r = pd.DataFrame()
-    
-    try:
-        records = get_all_records_with_retry(ws_equip)
-        df_e = pd.DataFrame(records).astype(str)
-    except Exception as e:
-        st.error(f"載入設備清單發生錯誤: {e}")
+@depends_on(SHEET_ID, ws_equip.title)
+@swr_cache(ttl=3600, watch=SHEET_ID)  # 版本號未變只延長效期，TTL 可縮短
+def load_equipment_data():
+    # 讀取失敗直接拋出 (不快取空表)，錯誤訊息由呼叫端於頁面顯示
+    return prepare_equipment_frame(pd.DataFrame(get_all_records_with_retry(ws_equip)))
 
+def prepare_equipment_frame(df_e):
     if '設備編號' in df_e.columns: 
         df_e['統計類別'] = df_e['設備編號'].apply(lambda c: next((v for k, v in DEVICE_CODE_MAP.items() if str(c).startswith(k)), "其他/未分類"))
     else: 
         df_e['統計類別'] = "未設定I欄"
-    df_e['設備數量_num'] = pd.to_numeric(df_e.get('設備數量', 1), errors='coerce').fillna(1)
-    
+    # 型別於快取內一次轉換：單位 / 油品 / 類別為 category，設備數量_num 為數值，其餘欄位為字串
+    return apply_schema(df_e, FUEL_EQUIPMENT)
+
+def fetch_record_frame(worksheet):
+    data = sync_record_values_with_retry(worksheet)
+    if data and len(data) > 1: return pd.DataFrame(data[1:], columns=data[0])
+    elif data: return pd.DataFrame(columns=data[0])
+    return pd.DataFrame()
+
+def prepare_record_frame(df):
+    # 衍生欄位於快取內計算一次；寫穿新增的列也走同一套整理流程
+    return apply_schema(df, FUEL_RECORDS, text=False)
+
+def load_fuel_data():
+    try:
+        df_e = load_equipment_data()
+    except Exception as e:
+        st.error(f"載入設備清單發生錯誤: {e}")
+        df_e = prepare_equipment_frame(pd.DataFrame())
+    df_r = pd.DataFrame()
     try:
-        data = get_all_values_with_retry(ws_record)
-        if data and len(data) > 1:
-            df_r = pd.DataFrame(data[1:], columns=data[0])
-        elif data:
-            df_r = pd.DataFrame(columns=data[0])
+        df_r = read_records(ws_record, fetch_record_frame, prepare=prepare_record_frame, ttl=600)
     except Exception as e:
         st.error(f"載入填報紀錄發生錯誤: {e}")
-        
     return df_e, df_r
 
 df_equip, df_records = load_fuel_data()
@@ -347,8 +348,6 @@ available_years_dash = []
 available_years_details = []
 record_units = []
 if not df_records.empty:
-    df_records['加油量'] = pd.to_numeric(df_records['加油量'], errors='coerce').fillna(0)
-    df_records['日期格式'] = pd.to_datetime(df_records['加油日期'], errors='coerce')
     raw_years = sorted(df_records['日期格式'].dt.year.dropna().astype(int).unique(), reverse=True)
     
     available_years_dash = [y for y in raw_years if y >= 2025]
@@ -365,10 +364,8 @@ else:
 # ==========================================
 # [圖片智慧快取機制]
 # ==========================================
-@st.cache_data(ttl=86400, show_spinner=False, max_entries=100)
 def get_cached_file_from_drive(url):
     try:
-        _, d_svc = init_google_fuel()
         match = re.search(r'/d/([a-zA-Z0-9_-]+)', url)
         if not match:
             match = re.search(r'id=([a-zA-Z0-9_-]+)', url)
@@ -376,40 +373,20 @@ def get_cached_file_from_drive(url):
 
         file_id = match.group(1)
         
-        try:
-            meta = d_svc.files().get(fileId=file_id, fields="name").execute()
-            filename = meta.get('name', f'佐證資料_{file_id}')
-        except:
-            filename = f"佐證資料_{file_id}.pdf"
-            
+        # 原始檔案與 PDF 預覽分層存放於依位元組上限淘汰的 core.evidence_cache，不再快取解碼後的 PIL 圖片
+        file_bytes, meta = evidence_file(file_id)
+        filename = meta.get('name') or f'佐證資料_{file_id}'
         is_pdf = filename.lower().endswith('.pdf')
-
-        request = d_svc.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-        
-        fh.seek(0)
-        file_bytes = fh.read()
         
         try:
             if is_pdf and HAS_FITZ:
-                doc = fitz.open("pdf", file_bytes)
-                images = []
-                for page_num in range(len(doc)):
-                    page = doc.load_page(page_num)
-                    pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-                    img_data = pix.tobytes("png")
-                    img = Image.open(io.BytesIO(img_data))
-                    images.append(img)
-                is_landscape = images[0].width > images[0].height if images else False
+                # [效能優化] PDF 只解析頁數與方向，各頁於畫面顯示時才轉圖 (core.pdf_preview)
+                images, is_landscape = pdf_pages(file_id, file_bytes)
                 return images, is_landscape, file_bytes, filename, True
             else:
-                img = Image.open(io.BytesIO(file_bytes))
+                img = Image.open(io.BytesIO(file_bytes))  # 只讀取檔頭取得尺寸，畫面顯示縮圖 (core.pdf_preview)
                 is_landscape = img.width > img.height
-                return [img], is_landscape, file_bytes, filename, False
+                return [ImageFile(file_id)], is_landscape, file_bytes, filename, False
         except:
             return None, False, file_bytes, filename, is_pdf
             
@@ -426,7 +403,7 @@ def render_dashboard_fragment(df_records, df_equip, record_units, available_year
     col_r1, col_r2 = st.columns([4, 1])
     with col_r2:
         if st.button("🔄 刷新數據", use_container_width=True, key="refresh_all"): 
-            st.cache_data.clear()
+            invalidate(SHEET_ID)
             st.rerun()
     
     if not df_records.empty:
@@ -462,7 +439,7 @@ def render_dashboard_fragment(df_records, df_equip, record_units, available_year
                 st.subheader(f"📊 {query_year}年度 逐月油料統計", anchor=False)
                 filter_mode = st.radio("顯示類別", ["全部顯示", "只看汽油", "只看柴油"], horizontal=True)
                 df_final['月份'] = df_final['日期格式'].dt.month
-                df_final['油品類別'] = df_final['原燃物料名稱'].apply(lambda x: '汽油' if '汽油' in x else ('柴油' if '柴油' in x else '其他'))
+                df_final['油品類別'] = df_final['原燃物料名稱'].astype(str).apply(lambda x: '汽油' if '汽油' in x else ('柴油' if '柴油' in x else '其他'))
                 months = list(range(1, 13))
                 if filter_mode == "全部顯示": target_fuels = ['汽油', '柴油']
                 elif filter_mode == "只看汽油": target_fuels = ['汽油']
@@ -740,7 +717,7 @@ def render_details_fragment(df_records, record_units, available_years):
                                         for url in unique_links:
                                             images_list, is_landscape, file_bytes, filename, is_pdf = get_cached_file_from_drive(url)
                                             if images_list:
-                                                for i, img in enumerate(images_list):
+                                                for i, img in enumerate(visible_pages(images_list, f"pdf_all_vip_{url}", filename)):
                                                     page_suffix = f" (第 {i+1} 頁)" if is_pdf and len(images_list) > 1 else ""
                                                     images_data.append({ "url": url, "img": img, "is_landscape": is_landscape, "bytes": file_bytes, "filename": filename, "is_pdf": is_pdf, "page_suffix": page_suffix })
                                             else:
@@ -761,15 +738,15 @@ def render_details_fragment(df_records, record_units, available_years):
                                             else:
                                                 caption_text = f"📄 {item['filename']}{item['page_suffix']}"
                                                 if item['is_landscape']:
-                                                    st.image(item['img'], use_container_width=True, caption=caption_text)
+                                                    show_preview(st, item['img'], caption_text, "vip")
                                                     idx += 1
                                                 else:
                                                     c1, c2 = st.columns(2)
-                                                    c1.image(item['img'], use_container_width=True, caption=caption_text)
+                                                    show_preview(c1, item['img'], caption_text, "vip")
                                                     idx += 1
                                                     if idx < len(images_data) and images_data[idx]['img'] is not None and not images_data[idx]['is_landscape']:
                                                         next_item = images_data[idx]
-                                                        c2.image(next_item['img'], use_container_width=True, caption=f"📄 {next_item['filename']}{next_item['page_suffix']}")
+                                                        show_preview(c2, next_item['img'], f"📄 {next_item['filename']}{next_item['page_suffix']}", "vip")
                                                         idx += 1
                                             if idx < len(images_data):
                                                 st.markdown("<hr style='margin: 15px 0; border: 1px dashed #BDC3C7;'>", unsafe_allow_html=True)
@@ -829,7 +806,7 @@ def render_details_fragment(df_records, record_units, available_years):
                                             if links_str and str(links_str).strip() not in ["無", "-"]:
                                                 raw_links.extend([l.strip() for l in re.split(r'[\n,]', str(links_str)) if l.strip()])
                                                 
-                                        unique_links = list(dict.fromkeys(raw_links))
+                                        unique_links = unique_drive_links(raw_links)
                                         
                                         if not unique_links:
                                             st.info("📁 此設備本月無上傳佐證圖片，或已註明與其他單位/設備共用。")
@@ -839,7 +816,7 @@ def render_details_fragment(df_records, record_units, available_years):
                                                 for url in unique_links:
                                                     images_list, is_landscape, file_bytes, filename, is_pdf = get_cached_file_from_drive(url)
                                                     if images_list:
-                                                        for i, img in enumerate(images_list):
+                                                        for i, img in enumerate(visible_pages(images_list, f"pdf_all_{equip_name}_{url}", filename)):
                                                             page_suffix = f" (第 {i+1} 頁)" if is_pdf and len(images_list) > 1 else ""
                                                             images_data.append({ "url": url, "img": img, "is_landscape": is_landscape, "bytes": file_bytes, "filename": filename, "is_pdf": is_pdf, "page_suffix": page_suffix })
                                                     else:
@@ -860,15 +837,15 @@ def render_details_fragment(df_records, record_units, available_years):
                                                     else:
                                                         caption_text = f"📄 {item['filename']}{item['page_suffix']}"
                                                         if item['is_landscape']:
-                                                            st.image(item['img'], use_container_width=True, caption=caption_text)
+                                                            show_preview(st, item['img'], caption_text, equip_name)
                                                             idx += 1
                                                         else:
                                                             c1, c2 = st.columns(2)
-                                                            c1.image(item['img'], use_container_width=True, caption=caption_text)
+                                                            show_preview(c1, item['img'], caption_text, equip_name)
                                                             idx += 1
                                                             if idx < len(images_data) and images_data[idx]['img'] is not None and not images_data[idx]['is_landscape']:
                                                                 next_item = images_data[idx]
-                                                                c2.image(next_item['img'], use_container_width=True, caption=f"📄 {next_item['filename']}{next_item['page_suffix']}")
+                                                                show_preview(c2, next_item['img'], f"📄 {next_item['filename']}{next_item['page_suffix']}", equip_name)
                                                                 idx += 1
                                                     if idx < len(images_data):
                                                         st.markdown("<hr style='margin: 15px 0; border: 1px dashed #BDC3C7;'>", unsafe_allow_html=True)
@@ -892,6 +869,7 @@ def render_user_interface():
 
     # 縮小主標題下邊距，讓線上人數能緊貼其後
     st.markdown('<div style="font-size: 2.4rem; font-weight: 900; color: #2C3E50; margin-bottom: -10px;">⛽ 燃油設備填報專區</div>', unsafe_allow_html=True)
+    freshness_caption(load_equipment_data, get_record_cache(SHEET_ID, ws_record.title))
     
     # 🟢 線上人數與狀態邏輯 (比照 app.py 原始設計)
     online_count = len(active_users) if 'active_users' in globals() else 1
@@ -1084,11 +1062,11 @@ def render_user_interface():
                                         
                                         if rows_to_append: 
                                             append_rows_with_retry(ws_record, rows_to_append)
+                                            append_records(ws_record, rows_to_append)  # 寫穿快取：直接併入已載入的紀錄，不必重新下載
                                             st.success(f"✅ 批次申報成功！已寫入 {len(rows_to_append)} 筆紀錄。即將重置畫面...")
                                             st.balloons()
                                             time.sleep(2.5)  # 暫停 2.5 秒讓使用者看完氣球動畫
                                             st.session_state['reset_counter'] += 1
-                                            st.cache_data.clear()
                                             st.rerun()
                                         else: st.warning("系統錯誤：無法產生寫入資料。")
                                     except Exception as e: st.error(f"失敗: {e}")
@@ -1228,11 +1206,11 @@ def render_user_interface():
                                             for e in data_entries: rows.append([now_str, selected_dept, p_name, p_ext, selected_device, str(row.get('校內財產編號','-')), str(row.get('原燃物料名稱','-')), card_str, str(e['date']), e['vol'], shared_str, note_input, final_link])
                                             if rows: 
                                                 append_rows_with_retry(ws_record, rows)
+                                                append_records(ws_record, rows)  # 寫穿快取：直接併入已載入的紀錄，不必重新下載
                                                 st.success("✅ 申報成功！即將重置畫面...")
                                                 st.balloons()
                                                 time.sleep(2.5)  # 暫停 2.5 秒讓動畫完整呈現
                                                 st.session_state['reset_counter'] += 1
-                                                st.cache_data.clear()
                                                 st.rerun()
                                 elif report_mode == "無使用":
                                     if p_email and str(p_email).strip() != default_email:
@@ -1240,11 +1218,11 @@ def render_user_interface():
                                         
                                     rows = [[get_taiwan_time().strftime("%Y-%m-%d %H:%M:%S"), selected_dept, p_name, p_ext, selected_device, str(row.get('校內財產編號','-')), str(row.get('原燃物料名稱','-')), "-", str(data_entries[0]['date']), 0.0, "-", note_input, "無"]]
                                     append_rows_with_retry(ws_record, rows)
+                                    append_records(ws_record, rows)  # 寫穿快取：直接併入已載入的紀錄，不必重新下載
                                     st.success("✅ 申報成功！即將重置畫面...")
                                     st.balloons()
                                     time.sleep(2.5)  # 暫停 2.5 秒讓動畫完整呈現
                                     st.session_state['reset_counter'] += 1
-                                    st.cache_data.clear()
                                     st.rerun()
         else: st.warning("📭 目前資料庫尚無有效資料，請聯絡管理員。")
 
@@ -1,9 +1,6 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, date, timedelta
-import gspread
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseUpload
 import streamlit_authenticator as stauth
 import plotly.express as px
@@ -16,6 +13,12 @@ import io
 import uuid
 from PIL import Image
 import streamlit.components.v1 as components
+from core.gsheets import get_drive_service, ensure_worksheet
+from core.refrigerant_ref import load_reference_data
+from core.rate_limit import with_priority, PRIORITY_SUBMIT
+from core.cache_scope import invalidate
+from core.record_cache import read_records, append_records, get_record_cache
+from core.swr import freshness_caption
 
 # ==========================================
 # 0. 系統設定 & 共用防護機制
@@ -25,7 +28,8 @@ st.set_page_config(page_title="冷媒填報 - 嘉義大學", page_icon="❄️",
 def get_taiwan_time():
     return datetime.utcnow() + timedelta(hours=8)
 
-# [防護機制 1] 寫入重試機制
+# [防護機制 1] 寫入重試機制 (填報送出以最高優先序排隊)
+@with_priority(PRIORITY_SUBMIT)
 def safe_append_rows(worksheet, rows, max_retries=5):
     for attempt in range(max_retries):
         try:
@@ -181,21 +185,10 @@ except:
 REF_SHEET_ID = "1p7GsW-nrjerXhnn3pNgZzu_CdIh1Yxsm-fLJDqQ6MqA"
 REF_FOLDER_ID = "1o0S56OyStDjvC5tgBWiUNqNjrpXuCQMI"
 
-# [精準導入 2] 快取資源：確保資料庫連線物件不會因重跑而重複建立
-@st.cache_resource
-def init_google_ref():
-    oauth = st.secrets["gcp_oauth"]
-    creds = Credentials(token=None, refresh_token=oauth["refresh_token"], token_uri="https://oauth2.googleapis.com/token", client_id=oauth["client_id"], client_secret=oauth["client_secret"], scopes=["https://www.googleapis.com/auth/drive", "https://www.googleapis.com/auth/spreadsheets"])
-    gc = gspread.authorize(creds); drive = build('drive', 'v3', credentials=creds)
-    return gc, drive
-
+# [精準導入 2] 共用連線池：資料庫連線物件由 core.gsheets 全站共用，不會因重跑而重複建立
 try:
-    gc, drive_service = init_google_ref()
-    sh_ref = gc.open_by_key(REF_SHEET_ID)
-    try: ws_records = sh_ref.worksheet("冷媒填報紀錄")
-    except: 
-        ws_records = sh_ref.add_worksheet(title="冷媒填報紀錄", rows="1000", cols="15")
-        ws_records.append_row(["填報時間","填報人","填報人分機","校區","所屬單位","填報單位名稱","建築物名稱","辦公室編號","維修日期","設備類型","設備品牌型號","冷媒種類","冷媒填充量","備註","佐證資料"])
+    drive_service = get_drive_service()
+    ws_records = ensure_worksheet(REF_SHEET_ID, ("冷媒填報紀錄",), ("填報時間","填報人","填報人分機","校區","所屬單位","填報單位名稱","建築物名稱","辦公室編號","維修日期","設備類型","設備品牌型號","冷媒種類","冷媒填充量","備註","佐證資料"))
 except Exception as e:
     st.error(f"❌ 資料庫連線失敗: {e}")
     st.stop()
@@ -262,83 +255,38 @@ DATA_GWP = {
     '其他': 0.0
 }
 
-# [精準導入 2] 快取資料：為靜態資料讀取加上快取，避免重複讀取雲端表單
-@st.cache_data(ttl=86400)
+# [精準導入 2] 雲端參考表由 core.refrigerant_ref 一次 batchGet 讀取並快取 (與後台共用)
 def load_static_data(source='local'):
     if source == 'local':
         return DATA_UNITS, DATA_BUILDINGS, DATA_TYPES, list(DATA_GWP.keys()), DATA_GWP
     else:
         try:
-            ws_units = sh_ref.worksheet("單位資訊")
-            ws_buildings = sh_ref.worksheet("建築物清單")
-            ws_types = sh_ref.worksheet("設備類型")
-            ws_coef = sh_ref.worksheet("冷媒係數表")
-            
-            df_units = pd.DataFrame(ws_units.get_all_records()).astype(str)
-            df_build = pd.DataFrame(ws_buildings.get_all_records()).astype(str)
-            df_types = pd.DataFrame(ws_types.get_all_records()).astype(str)
-            df_coef = pd.DataFrame(ws_coef.get_all_records())
-            
-            unit_dict = {}
-            for _, row in df_units.iterrows():
-                d = str(row.iloc[0]).strip()
-                u = str(row.iloc[1]).strip()
-                if d and u:
-                    if d not in unit_dict: unit_dict[d] = []
-                    if u not in unit_dict[d]: unit_dict[d].append(u)
-            
-            build_dict = {}
-            for _, row in df_build.iterrows():
-                c = str(row.iloc[0]).strip()
-                b = str(row.iloc[1]).strip()
-                if c and b:
-                    if c not in build_dict: build_dict[c] = []
-                    if b not in build_dict[c]: build_dict[c].append(b)
-            
-            e_types = df_types.iloc[:, 0].dropna().unique().tolist() if not df_types.empty else []
-            
-            gwp_map = {}
-            r_types = []
-            if not df_coef.empty:
-                for _, row in df_coef.iterrows():
-                    r_name_full = str(row.iloc[1]).strip().replace('\u3000', ' ').replace('\xa0', ' ')
-                    try: gwp = float(str(row.iloc[2]).replace(',', ''))
-                    except: gwp = 0.0
-                    if r_name_full:
-                        r_types.append(r_name_full)
-                        gwp_map[r_name_full] = gwp
-            
-            if '其他' not in r_types:
-                r_types.append('其他')
-                gwp_map['其他'] = 0.0
-            
-            r_types_ordered = list(dict.fromkeys(r_types))
-            return unit_dict, build_dict, e_types, r_types_ordered, gwp_map
-            
+            return tuple(load_reference_data())
         except Exception as e:
             st.error(f"雲端更新失敗: {e}")
             return DATA_UNITS, DATA_BUILDINGS, DATA_TYPES, list(DATA_GWP.keys()), DATA_GWP
 
-# [精準導入 2] 快取機制: 延長至 86400 秒
-@st.cache_data(ttl=86400)
+REF_RECORD_COLUMNS = ["填報時間","填報人","填報人分機","校區","所屬單位","填報單位名稱","建築物名稱","辦公室編號","維修日期","設備類型","設備品牌型號","冷媒種類","冷媒填充量","備註","佐證資料"]
+
+def fetch_records_frame(worksheet):
+    data = worksheet.get_all_values()
+    if len(data) > 1: return pd.DataFrame(data[1:], columns=data[0])
+    return pd.DataFrame(columns=data[0] if data else REF_RECORD_COLUMNS)
+
+def normalize_record_headers(df):
+    col_mapping = {}
+    for h in df.columns:
+        clean_h = str(h).strip()
+        if "填充量" in clean_h or "重量" in clean_h: col_mapping[h] = "冷媒填充量"
+        elif "種類" in clean_h or "品項" in clean_h: col_mapping[h] = "冷媒種類"
+        elif "日期" in clean_h or "維修" in clean_h: col_mapping[h] = "維修日期"
+        else: col_mapping[h] = clean_h
+    return df.rename(columns=col_mapping)
+
+# [精準導入 2] 寫穿快取: ttl 600 秒，逾時先回傳現有資料並於背景比對版本號更新 (未異動只延長效期)；填報成功後直接併入新資料，不必重新讀取雲端
 def load_records_data():
     try:
-        data = ws_records.get_all_values()
-        if len(data) > 1:
-            raw_headers = data[0]
-            col_mapping = {}
-            for h in raw_headers:
-                clean_h = str(h).strip()
-                if "填充量" in clean_h or "重量" in clean_h: col_mapping[h] = "冷媒填充量"
-                elif "種類" in clean_h or "品項" in clean_h: col_mapping[h] = "冷媒種類"
-                elif "日期" in clean_h or "維修" in clean_h: col_mapping[h] = "維修日期"
-                else: col_mapping[h] = clean_h
-            
-            df = pd.DataFrame(data[1:], columns=raw_headers)
-            df.rename(columns=col_mapping, inplace=True)
-            return df
-        else:
-            return pd.DataFrame(columns=["填報時間","填報人","填報人分機","校區","所屬單位","填報單位名稱","建築物名稱","辦公室編號","維修日期","設備類型","設備品牌型號","冷媒種類","冷媒填充量","備註","佐證資料"])
+        return read_records(ws_records, fetch_records_frame, prepare=normalize_record_headers, ttl=600)
     except Exception as e:
         st.error(f"⚠️ 無法讀取資料: {e}")
         return pd.DataFrame()
@@ -429,13 +377,13 @@ def render_form_fragment(unit_dict, build_dict, e_types, r_types):
                 
                 # [防護機制 1] 使用排隊重試機制進行寫入
                 safe_append_rows(ws_records, [row_data])
+                append_records(ws_records, [row_data])
                 
                 st.success("✅ 冷媒填報成功！欄位已自動清空。")
                 st.balloons()
                 
                 st.session_state['form_id'] += 1
-                # [防護機制 3] 觸發更新
-                st.cache_data.clear()
+                # [防護機制 3] 寫穿快取已併入新資料，僅其他頁面讀取同工作表的快取會被清除
                 time.sleep(1)
                 st.rerun() # 送出成功後進行全域重跑以更新 Tab 2 的數據
                 
@@ -447,7 +395,7 @@ def render_dashboard_fragment(df_records, gwp_map):
     col_r1, col_r2 = st.columns([4, 1])
     with col_r2:
         if st.button("🔄 刷新數據", use_container_width=True, key="refresh_tab2"):
-            st.cache_data.clear()
+            invalidate(REF_SHEET_ID, "冷媒填報紀錄")
             st.rerun()
 
     if df_records.empty:
@@ -564,6 +512,7 @@ def render_dashboard_fragment(df_records, gwp_map):
 # ==========================================
 def render_user_interface():
     st.markdown('<div style="font-size: 2.4rem; font-weight: 900; color: #2C3E50; margin-bottom: 20px;">❄️ 冷媒填報專區</div>', unsafe_allow_html=True)
+    freshness_caption(get_record_cache(REF_SHEET_ID, "冷媒填報紀錄"))
     tabs = st.tabs(["📝 新增填報", "📋 申報動態查詢"])
 
     with tabs[0]:
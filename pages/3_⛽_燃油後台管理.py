@@ -1,10 +1,6 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, date, timedelta
-import gspread
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
 import streamlit_authenticator as stauth
 import plotly.express as px
 import plotly.graph_objects as go
@@ -13,6 +9,14 @@ import re
 import io
 import hashlib
 import uuid
+from core.gsheets import get_drive_service, open_spreadsheet, get_worksheet_or_none
+from core.mirror import sync_mirror, query_mirror, mirror_years, get_mirror_table
+from core.schemas import apply_schema, FUEL_EQUIPMENT, FUEL_RECORDS
+from core.rate_limit import with_priority, PRIORITY_BACKGROUND
+from core.swr import swr_cache, freshness_caption
+from core.cache_scope import depends_on
+from core.drive_prefetch import DrivePrefetch
+from core.drive_cache import get_drive_file
 
 try:
     from docx import Document
@@ -208,35 +212,45 @@ DEVICE_CODE_MAP = {"GV-1": "公務車輛(GV-1-)", "GV-2": "乘坐式割草機(GV
 MORANDI_COLORS = { "公務車輛(GV-1-)": "#B0C4DE", "乘坐式割草機(GV-2-)": "#F5CBA7", "乘坐式農用機具(GV-3-)": "#D7BDE2", "鍋爐(GS-1-)": "#E6B0AA", "發電機(GS-2-)": "#A9CCE3", "肩背或手持式割草機、吹葉機(GS-3-)": "#A3E4D7", "肩背或手持式農用機具(GS-4-)": "#F9E79F" }
 DASH_PALETTE = ['#B0C4DE', '#F5CBA7', '#A9CCE3', '#E6B0AA', '#D7BDE2', '#A3E4D7', '#F9E79F', '#95A5A6', '#85C1E9', '#D2B4DE', '#F1948A', '#76D7C4']
 
-@st.cache_resource
-def init_google_fuel():
-    oauth = st.secrets["gcp_oauth"]
-    creds = Credentials(token=None, refresh_token=oauth["refresh_token"], token_uri="https://oauth2.googleapis.com/token", client_id=oauth["client_id"], client_secret=oauth["client_secret"], scopes=["https://www.googleapis.com/auth/drive", "https://www.googleapis.com/auth/spreadsheets"])
-    gc = gspread.authorize(creds); drive = build('drive', 'v3', credentials=creds)
-    return gc, drive
-
 try:
-    _, drive_service = init_google_fuel()
+    drive_service = get_drive_service()
 except Exception as e: 
     st.error(f"連線失敗: {e}")
     st.stop()
 
-@st.cache_data(ttl=600)
+@depends_on(SHEET_ID)
+@swr_cache(ttl=300, watch=SHEET_ID)
+@with_priority(PRIORITY_BACKGROUND)  # 儀表板讀取讓位給填報送出
 def load_fuel_data():
-    gc_obj, _ = init_google_fuel()
-    sh = gc_obj.open_by_key(SHEET_ID)
-    try: ws_equip = sh.worksheet("設備清單") 
-    except: ws_equip = sh.sheet1 
-    try: ws_record = sh.worksheet("油料填報紀錄")
-    except: ws_record = sh.worksheet("填報紀錄")
-    
-    df_e = pd.DataFrame(ws_equip.get_all_records()).astype(str)
+    ws_equip = get_worksheet_or_none(SHEET_ID, "設備清單") or open_spreadsheet(SHEET_ID).sheet1
+    df_e = pd.DataFrame(ws_equip.get_all_records())
     if '設備編號' in df_e.columns: df_e['統計類別'] = df_e['設備編號'].apply(lambda c: next((v for k, v in DEVICE_CODE_MAP.items() if str(c).startswith(k)), "其他/未分類"))
-    df_e['設備數量_num'] = pd.to_numeric(df_e['設備數量'], errors='coerce').fillna(1)
-    
-    data = ws_record.get_all_values()
-    df_r = pd.DataFrame(data[1:], columns=data[0]) if len(data) > 1 else pd.DataFrame(columns=data[0])
-    return df_e, df_r
+    return apply_schema(df_e, FUEL_EQUIPMENT)
+
+# [精準導入] 填報紀錄改由本機 SQLite 鏡像查詢：依年度走索引，不再整表載入後逐列篩選
+def get_record_title():
+    ws_record = get_worksheet_or_none(SHEET_ID, "油料填報紀錄", "填報紀錄")
+    sync_mirror(ws_record)
+    return ws_record.title
+
+def fuel_year_frame(record_title, year, df_equip):
+    # [效能優化] 型別轉換與衍生欄位只在鏡像內容 (列數 / 版本號) 或設備清單快照改變時重算，切換分頁與篩選不再重跑
+    mt = get_mirror_table(SHEET_ID, record_title)
+    return _fuel_year_frame(record_title, int(year), mt.row_count, mt.signature, load_fuel_data.status()[0], df_equip)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _fuel_year_frame(record_title, year, row_count, signature, equip_loaded_at, _df_equip):
+    df_equip = _df_equip
+    df = query_mirror(SHEET_ID, record_title, "_year = ?", (year,))
+    if df.empty: return df
+    apply_schema(df, FUEL_RECORDS, text=False)
+    df['年份'] = df['日期格式'].dt.year.fillna(0).astype(int)
+    df['月份'] = df['日期格式'].dt.month.fillna(0).astype(int)
+    df['油品大類'] = df['原燃物料名稱'].astype(str).apply(lambda x: '汽油' if '汽油' in str(x) else ('柴油' if '柴油' in str(x) else '其他'))
+    if not df_equip.empty:
+        device_map = pd.Series(df_equip['統計類別'].values, index=df_equip['設備名稱備註']).to_dict()
+        df['統計類別'] = df['設備名稱備註'].map(device_map).astype(object).fillna("其他/未分類")
+    return df
 
 # ==========================================
 # 4. 輔助函數 (Word)
@@ -248,29 +262,36 @@ def get_drive_id(url):
     if match: return match.group(1)
     return None
 
-def download_and_convert_drive_files(drive_service_obj, file_id):
-    try:
-        request = drive_service_obj.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while done is False: status, done = downloader.next_chunk()
-        fh.seek(0)
-        header = fh.read(4)
-        fh.seek(0)
-        if header == b'%PDF':
-            images = []
-            try:
-                doc = fitz.open(stream=fh.read(), filetype="pdf")
+def evidence_file_ids(link_strs):
+    """依文件順序收集佐證連結中的 Drive 檔案 ID (供 DrivePrefetch 預先下載)"""
+    fids = []
+    for link_str in link_strs:
+        for link in str(link_str).split('\n'):
+            link = link.strip()
+            if not link or link in ["無", ""] or "佐證如" in link: continue
+            fid = get_drive_id(link)
+            if fid: fids.append(fid)
+    return fids
+
+def convert_drive_file(data):
+    # DrivePrefetch 只在背景下載位元組，PDF 轉圖在排版的主執行緒進行 (PyMuPDF 不保證執行緒安全)
+    # 下載失敗 (None) 或 PDF 轉圖失敗則略過該檔
+    if data is None: return []
+    fh = io.BytesIO(data)
+    header = fh.read(4)
+    fh.seek(0)
+    if header == b'%PDF':
+        images = []
+        try:
+            with fitz.open(stream=fh.read(), filetype="pdf") as doc:
                 for page_num in range(len(doc)):
                     page = doc.load_page(page_num)
                     pix = page.get_pixmap(dpi=150)
                     img_bytes = pix.tobytes("png")
                     images.append(io.BytesIO(img_bytes))
-                return images
-            except: return []
-        return [fh]
-    except: return []
+            return images
+        except: return []
+    return [fh]
 
 def export_general_docx(df_year, df_eq, drive_srv):
     doc = Document()
@@ -291,21 +312,75 @@ def export_general_docx(df_year, df_eq, drive_srv):
     global_seen_fids = set()
     global_image_hashes = set()
 
-    if not df_indiv.empty:
-        doc.add_heading("【獨立設備申報明細】", level=1)
-        groups = df_indiv.groupby(['設備編號', '設備名稱備註', '填報單位', '原燃物料名稱'], dropna=False)
-        sorted_groups = sorted(groups, key=lambda x: str(x[0][0]))
-        
-        for name, group in sorted_groups:
-            eq_id, eq_name, dept, fuel = name
-            yearly_vol = df_year[(df_year['設備名稱備註'] == eq_name) & (df_year['填報單位'] == dept)]['加油量'].sum()
-            p = doc.add_paragraph()
-            p.add_run(f"填報單位：{dept} | 設備名稱：{eq_name} ({eq_id})\n").bold = True
-            p.add_run(f"燃料：{fuel} | 年度總加油量：{yearly_vol:,.1f} 公升\n").bold = True
+    sorted_groups = sorted(df_indiv.groupby(['設備編號', '設備名稱備註', '填報單位', '原燃物料名稱'], dropna=False, observed=True), key=lambda x: str(x[0][0]))
+    shared_groups = list(df_shared.groupby('佐證資料_clean', dropna=False))
+    # [效能優化] 先收集全部佐證檔案並行下載，排版時依序取用
+    doc_links = [s for _, group in sorted_groups for s in group['佐證資料_clean']] + [link_str for link_str, _ in shared_groups]
+    with DrivePrefetch(evidence_file_ids(doc_links), lambda fid: get_drive_file(fid, drive_srv)[0]) as prefetch:
+
+        if not df_indiv.empty:
+            doc.add_heading("【獨立設備申報明細】", level=1)
+            for name, group in sorted_groups:
+                eq_id, eq_name, dept, fuel = name
+                yearly_vol = df_year[(df_year['設備名稱備註'] == eq_name) & (df_year['填報單位'] == dept)]['加油量'].sum()
+                p = doc.add_paragraph()
+                p.add_run(f"填報單位：{dept} | 設備名稱：{eq_name} ({eq_id})\n").bold = True
+                p.add_run(f"燃料：{fuel} | 年度總加油量：{yearly_vol:,.1f} 公升\n").bold = True
+            
+                images_to_print = []
+                skipped_dup = False
+                for link_str in group['佐證資料_clean']:
+                    for link in str(link_str).split('\n'):
+                        link = link.strip()
+                        if not link or link in ["無", ""] or "佐證如" in link: continue
+                        fid = get_drive_id(link)
+                        if fid:
+                            if fid not in global_seen_fids:
+                                global_seen_fids.add(fid)
+                                downloaded_imgs = convert_drive_file(prefetch.get(fid, None))
+                                for img_io in downloaded_imgs:
+                                    img_io.seek(0)
+                                    img_hash = hashlib.md5(img_io.read()).hexdigest()
+                                    img_io.seek(0)
+                                    if img_hash not in global_image_hashes:
+                                        global_image_hashes.add(img_hash)
+                                        images_to_print.append(img_io)
+                                    else: skipped_dup = True
+                            else: skipped_dup = True
+            
+                if len(images_to_print) == 1:
+                    p_img = doc.add_paragraph()
+                    p_img.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                    try: p_img.add_run().add_picture(images_to_print[0], height=Cm(11.0))
+                    except: pass
+                elif len(images_to_print) > 1:
+                    table = doc.add_table(rows=0, cols=2)
+                    table.autofit = False
+                    for i, img in enumerate(images_to_print):
+                        if i % 2 == 0: row_cells = table.add_row().cells
+                        try:
+                            p_img = row_cells[i % 2].paragraphs[0]
+                            p_img.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                            p_img.add_run().add_picture(img, height=Cm(7.5))
+                        except: pass
+            
+                if skipped_dup and not images_to_print:
+                    p_dup = doc.add_paragraph()
+                    p_dup.add_run("*(此設備之佐證資料與前方共用或已顯示過，為節省篇幅自動省略)*").italic = True
+                doc.add_page_break()
+
+        if not df_shared.empty:
+            doc.add_heading("【共用加油單申報明細】", level=1)
+            for link_str, group in shared_groups:
+                eqs = group[['設備編號', '設備名稱備註', '填報單位']].drop_duplicates().sort_values('設備編號')
+                p = doc.add_paragraph()
+                p.add_run("⚠️ 此為共用加油單，包含以下設備：\n").bold = True
+                for _, eq in eqs.iterrows():
+                    yearly_vol = df_year[(df_year['設備名稱備註'] == eq['設備名稱備註']) & (df_year['填報單位'] == eq['填報單位'])]['加油量'].sum()
+                    p.add_run(f"填報單位：{eq['填報單位']} | 設備名稱：{eq['設備名稱備註']} ({eq['設備編號']}) | 年度總加油量：{yearly_vol:,.1f} 公升\n")
             
-            images_to_print = []
-            skipped_dup = False
-            for link_str in group['佐證資料_clean']:
+                images_to_print = []
+                skipped_dup = False
                 for link in str(link_str).split('\n'):
                     link = link.strip()
                     if not link or link in ["無", ""] or "佐證如" in link: continue
@@ -313,7 +388,7 @@ def export_general_docx(df_year, df_eq, drive_srv):
                     if fid:
                         if fid not in global_seen_fids:
                             global_seen_fids.add(fid)
-                            downloaded_imgs = download_and_convert_drive_files(drive_srv, fid)
+                            downloaded_imgs = convert_drive_file(prefetch.get(fid, None))
                             for img_io in downloaded_imgs:
                                 img_io.seek(0)
                                 img_hash = hashlib.md5(img_io.read()).hexdigest()
@@ -324,78 +399,26 @@ def export_general_docx(df_year, df_eq, drive_srv):
                                 else: skipped_dup = True
                         else: skipped_dup = True
             
-            if len(images_to_print) == 1:
-                p_img = doc.add_paragraph()
-                p_img.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                try: p_img.add_run().add_picture(images_to_print[0], height=Cm(11.0))
-                except: pass
-            elif len(images_to_print) > 1:
-                table = doc.add_table(rows=0, cols=2)
-                table.autofit = False
-                for i, img in enumerate(images_to_print):
-                    if i % 2 == 0: row_cells = table.add_row().cells
-                    try:
-                        p_img = row_cells[i % 2].paragraphs[0]
-                        p_img.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                        p_img.add_run().add_picture(img, height=Cm(7.5))
-                    except: pass
-            
-            if skipped_dup and not images_to_print:
-                p_dup = doc.add_paragraph()
-                p_dup.add_run("*(此設備之佐證資料與前方共用或已顯示過，為節省篇幅自動省略)*").italic = True
-            doc.add_page_break()
-
-    if not df_shared.empty:
-        doc.add_heading("【共用加油單申報明細】", level=1)
-        groups = df_shared.groupby('佐證資料_clean', dropna=False)
-        for link_str, group in groups:
-            eqs = group[['設備編號', '設備名稱備註', '填報單位']].drop_duplicates().sort_values('設備編號')
-            p = doc.add_paragraph()
-            p.add_run("⚠️ 此為共用加油單，包含以下設備：\n").bold = True
-            for _, eq in eqs.iterrows():
-                yearly_vol = df_year[(df_year['設備名稱備註'] == eq['設備名稱備註']) & (df_year['填報單位'] == eq['填報單位'])]['加油量'].sum()
-                p.add_run(f"填報單位：{eq['填報單位']} | 設備名稱：{eq['設備名稱備註']} ({eq['設備編號']}) | 年度總加油量：{yearly_vol:,.1f} 公升\n")
-            
-            images_to_print = []
-            skipped_dup = False
-            for link in str(link_str).split('\n'):
-                link = link.strip()
-                if not link or link in ["無", ""] or "佐證如" in link: continue
-                fid = get_drive_id(link)
-                if fid:
-                    if fid not in global_seen_fids:
-                        global_seen_fids.add(fid)
-                        downloaded_imgs = download_and_convert_drive_files(drive_srv, fid)
-                        for img_io in downloaded_imgs:
-                            img_io.seek(0)
-                            img_hash = hashlib.md5(img_io.read()).hexdigest()
-                            img_io.seek(0)
-                            if img_hash not in global_image_hashes:
-                                global_image_hashes.add(img_hash)
-                                images_to_print.append(img_io)
-                            else: skipped_dup = True
-                    else: skipped_dup = True
-            
-            if len(images_to_print) == 1:
-                p_img = doc.add_paragraph()
-                p_img.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                try: p_img.add_run().add_picture(images_to_print[0], height=Cm(11.0))
-                except: pass
-            elif len(images_to_print) > 1:
-                table = doc.add_table(rows=0, cols=2)
-                table.autofit = False
-                for i, img in enumerate(images_to_print):
-                    if i % 2 == 0: row_cells = table.add_row().cells
-                    try:
-                        p_img = row_cells[i % 2].paragraphs[0]
-                        p_img.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                        p_img.add_run().add_picture(img, height=Cm(7.5))
+                if len(images_to_print) == 1:
+                    p_img = doc.add_paragraph()
+                    p_img.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                    try: p_img.add_run().add_picture(images_to_print[0], height=Cm(11.0))
                     except: pass
+                elif len(images_to_print) > 1:
+                    table = doc.add_table(rows=0, cols=2)
+                    table.autofit = False
+                    for i, img in enumerate(images_to_print):
+                        if i % 2 == 0: row_cells = table.add_row().cells
+                        try:
+                            p_img = row_cells[i % 2].paragraphs[0]
+                            p_img.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                            p_img.add_run().add_picture(img, height=Cm(7.5))
+                        except: pass
                     
-            if skipped_dup and not images_to_print:
-                p_dup = doc.add_paragraph()
-                p_dup.add_run("*(此佐證資料與前方共用或已顯示過，為節省篇幅自動省略)*").italic = True
-            doc.add_page_break()
+                if skipped_dup and not images_to_print:
+                    p_dup = doc.add_paragraph()
+                    p_dup.add_run("*(此佐證資料與前方共用或已顯示過，為節省篇幅自動省略)*").italic = True
+                doc.add_page_break()
             
     output = io.BytesIO()
     doc.save(output)
@@ -414,7 +437,7 @@ def export_batch_docx(df_year, drive_srv):
 
     doc.add_heading(f"年度油卡批次申報佐證資料總表", level=1)
     df_batch['批次類別'] = df_batch['備註'].apply(lambda x: str(x).split(' | ')[0] if ' | ' in str(x) else str(x))
-    groups = df_batch.groupby(['填報單位', '原燃物料名稱', '批次類別'])
+    groups = df_batch.groupby(['填報單位', '原燃物料名稱', '批次類別'], observed=True)
 
     for name, group in groups:
         dept, fuel, cat = name
@@ -427,25 +450,26 @@ def export_batch_docx(df_year, drive_srv):
         p.add_run(f"燃料：{fuel} | 年度總加油量：{yearly_vol:,.1f} 公升\n").bold = True
     
     unique_links = df_batch['佐證資料'].dropna().unique()
-    images_to_print = []
-    global_seen_fids = set()
-    global_image_hashes = set()
+    with DrivePrefetch(evidence_file_ids(unique_links), lambda fid: get_drive_file(fid, drive_srv)[0]) as prefetch:
+        images_to_print = []
+        global_seen_fids = set()
+        global_image_hashes = set()
     
-    for link_str in unique_links:
-        for l in str(link_str).split('\n'):
-            l = l.strip()
-            if not l or l in ["無", ""] or "佐證如" in l: continue
-            fid = get_drive_id(l)
-            if fid and fid not in global_seen_fids:
-                global_seen_fids.add(fid)
-                downloaded_imgs = download_and_convert_drive_files(drive_srv, fid)
-                for img_io in downloaded_imgs:
-                    img_io.seek(0)
-                    img_hash = hashlib.md5(img_io.read()).hexdigest()
-                    img_io.seek(0)
-                    if img_hash not in global_image_hashes:
-                        global_image_hashes.add(img_hash)
-                        images_to_print.append(img_io)
+        for link_str in unique_links:
+            for l in str(link_str).split('\n'):
+                l = l.strip()
+                if not l or l in ["無", ""] or "佐證如" in l: continue
+                fid = get_drive_id(l)
+                if fid and fid not in global_seen_fids:
+                    global_seen_fids.add(fid)
+                    downloaded_imgs = convert_drive_file(prefetch.get(fid, None))
+                    for img_io in downloaded_imgs:
+                        img_io.seek(0)
+                        img_hash = hashlib.md5(img_io.read()).hexdigest()
+                        img_io.seek(0)
+                        if img_hash not in global_image_hashes:
+                            global_image_hashes.add(img_hash)
+                            images_to_print.append(img_io)
     
     if images_to_print:
         doc.add_page_break()
@@ -477,7 +501,7 @@ def export_batch_docx(df_year, drive_srv):
 # ==========================================
 
 @st.fragment
-def render_tab1_overview(df_clean, df_equip_full, all_years):
+def render_tab1_overview(record_title, df_equip_full, all_years):
     st.markdown("<br>", unsafe_allow_html=True)
     selected_year = st.selectbox("📅 請選擇檢視年度", all_years, index=0, key="t1_year")
     st.markdown("---")
@@ -490,7 +514,7 @@ def render_tab1_overview(df_clean, df_equip_full, all_years):
         df_equip = df_equip_full.copy()
         st.info("💡 提示：Sheet1 尚未建立「設備檢視年度」欄位，目前顯示為系統全庫設備。")
 
-    df_year = df_clean[df_clean['年份'] == selected_year]
+    df_year = fuel_year_frame(record_title, selected_year, df_equip_full)
     
     if not df_year.empty and not df_equip.empty:
         total_eq = int(df_equip['設備數量_num'].sum())
@@ -504,9 +528,9 @@ def render_tab1_overview(df_clean, df_equip_full, all_years):
         st.markdown("---")
 
         st.subheader("📂 各類設備數量及用油統計")
-        eq_sums = df_equip.groupby('統計類別')['設備數量_num'].sum()
-        eq_gas_sums = df_equip[df_equip['原燃物料名稱'].str.contains('汽油', na=False)].groupby('統計類別')['設備數量_num'].sum()
-        eq_dsl_sums = df_equip[df_equip['原燃物料名稱'].str.contains('柴油', na=False)].groupby('統計類別')['設備數量_num'].sum()
+        eq_sums = df_equip.groupby('統計類別', observed=True)['設備數量_num'].sum()
+        eq_gas_sums = df_equip[df_equip['原燃物料名稱'].str.contains('汽油', na=False)].groupby('統計類別', observed=True)['設備數量_num'].sum()
+        eq_dsl_sums = df_equip[df_equip['原燃物料名稱'].str.contains('柴油', na=False)].groupby('統計類別', observed=True)['設備數量_num'].sum()
         fuel_sums = df_year.groupby(['統計類別', '油品大類'])['加油量'].sum().unstack(fill_value=0)
         
         for i in range(0, len(DEVICE_ORDER), 2):
@@ -638,12 +662,12 @@ def render_tab1_overview(df_clean, df_equip_full, all_years):
     else: st.warning("尚無資料可供統計。")
 
 @st.fragment
-def render_tab2_dashboard(df_clean, all_years):
+def render_tab2_dashboard(record_title, df_equip_full, all_years):
     st.markdown("<br>", unsafe_allow_html=True)
     selected_year = st.selectbox("📅 請選擇檢視年度", all_years, index=0, key="t2_year")
     st.markdown("---")
     
-    df_year = df_clean[df_clean['年份'] == selected_year]
+    df_year = fuel_year_frame(record_title, selected_year, df_equip_full)
     
     if not df_year.empty:
         st.markdown(f"<div class='dashboard-main-title'>{selected_year}年度 能源使用與碳排統計<br><span style='font-size: 1.5rem; color: #5D6D7E; font-weight: 600;'>Energy Use and Carbon Emission Statistics for {selected_year}</span></div>", unsafe_allow_html=True)
@@ -680,7 +704,7 @@ def render_tab2_dashboard(df_clean, all_years):
         top_fuel = "汽油" if "汽油" in top_fuel_label else "柴油"
         df_top = df_year[df_year['油品大類'] == top_fuel]
         if not df_top.empty:
-            top10_data = df_top.groupby('填報單位')['加油量'].sum().nlargest(10).reset_index()
+            top10_data = df_top.groupby('填報單位', observed=True)['加油量'].sum().nlargest(10).reset_index()
             chart_title = "汽油用量前十大單位 (Top 10 Gasoline Consuming Units)" if top_fuel == "汽油" else "柴油用量前十大單位 (Top 10 Diesel Consuming Units)"
             
             fig_top = px.bar(top10_data, x='填報單位', y='加油量', title=chart_title, color_discrete_sequence=['#85C1E9'])
@@ -699,7 +723,7 @@ def render_tab2_dashboard(df_clean, all_years):
             st.markdown('<div class="bar-chart-box">', unsafe_allow_html=True)
             df_gas = df_year[(df_year['油品大類'] == '汽油') & (df_year['加油量'] > 0)]
             if not df_gas.empty:
-                gas_u_data = df_gas.groupby('填報單位')['加油量'].sum().reset_index().sort_values('加油量', ascending=True)
+                gas_u_data = df_gas.groupby('填報單位', observed=True)['加油量'].sum().reset_index().sort_values('加油量', ascending=True)
                 total_gu = gas_u_data['加油量'].sum()
                 gas_u_data['Label'] = gas_u_data['加油量'].apply(lambda x: f"{(x/total_gu)*100:.1f}% ({x:,.1f} 公升)")
                 
@@ -716,7 +740,7 @@ def render_tab2_dashboard(df_clean, all_years):
             st.markdown('<div class="bar-chart-box">', unsafe_allow_html=True)
             df_dsl = df_year[(df_year['油品大類'] == '柴油') & (df_year['加油量'] > 0)]
             if not df_dsl.empty:
-                dsl_u_data = df_dsl.groupby('填報單位')['加油量'].sum().reset_index().sort_values('加油量', ascending=True)
+                dsl_u_data = df_dsl.groupby('填報單位', observed=True)['加油量'].sum().reset_index().sort_values('加油量', ascending=True)
                 total_du = dsl_u_data['加油量'].sum()
                 dsl_u_data['Label'] = dsl_u_data['加油量'].apply(lambda x: f"{(x/total_du)*100:.1f}% ({x:,.1f} 公升)")
                 
@@ -749,7 +773,7 @@ def render_tab2_dashboard(df_clean, all_years):
 
 
 @st.fragment
-def render_tab3_export(df_clean, df_equip_full, all_years):
+def render_tab3_export(record_title, df_equip_full, all_years):
     st.markdown("<br>", unsafe_allow_html=True)
     selected_admin_year = st.selectbox("📅 請選擇檢視年度", all_years, index=0, key="t5_year")
     st.markdown("---")
@@ -761,7 +785,7 @@ def render_tab3_export(df_clean, df_equip_full, all_years):
     else:
         df_equip = df_equip_full.copy()
 
-    df_year = df_clean[df_clean['年份'] == selected_admin_year]
+    df_year = fuel_year_frame(record_title, selected_admin_year, df_equip_full)
     
     if not df_year.empty:
         st.markdown("##### 📊 選擇您要下載的資料類型")
@@ -770,14 +794,14 @@ def render_tab3_export(df_clean, df_equip_full, all_years):
         else:
             c1, c2, c3 = st.columns(3)
             with c1:
-                df_stats = df_year.groupby(['填報單位', '設備名稱備註'], as_index=False).agg({
+                df_stats = df_year.groupby(['填報單位', '設備名稱備註'], as_index=False, observed=True).agg({
                     '加油量': 'sum',
                     '原燃物料名稱': 'first'
                 })
                 df_export = pd.merge(df_equip, df_stats, on=['填報單位', '設備名稱備註'], how='outer', suffixes=('', '_rec'))
                 
                 if '原燃物料名稱_rec' in df_export.columns:
-                    df_export['原燃物料名稱'] = df_export['原燃物料名稱'].fillna(df_export['原燃物料名稱_rec'])
+                    df_export['原燃物料名稱'] = df_export['原燃物料名稱'].astype(object).fillna(df_export['原燃物料名稱_rec'].astype(object))
                     
                 df_export['加油量'] = df_export['加油量'].fillna(0)
                 df_export.rename(columns={'加油量': f'{selected_admin_year}年度總加油量'}, inplace=True)
@@ -810,23 +834,14 @@ def main():
     st.markdown('<div style="font-size: 2.4rem; font-weight: 900; color: #2C3E50; margin-bottom: 16px;">⛽ 燃油設備動態管理專區 (Fuel Equipment Dynamic Management Area)</div>', unsafe_allow_html=True)
     
     try:
-        df_equip, df_records = load_fuel_data()
+        df_equip = load_fuel_data()
+        record_title = get_record_title()
     except Exception as e:
         st.error(f"資料庫讀取失敗，請重新整理頁面。錯誤: {e}")
         return
+    freshness_caption(load_fuel_data, get_mirror_table(SHEET_ID, record_title))
 
-    df_clean = df_records.copy()
-    if not df_clean.empty:
-        df_clean['加油量'] = pd.to_numeric(df_clean['加油量'], errors='coerce').fillna(0)
-        df_clean['日期格式'] = pd.to_datetime(df_clean['加油日期'], errors='coerce')
-        df_clean['年份'] = df_clean['日期格式'].dt.year.fillna(0).astype(int)
-        df_clean['月份'] = df_clean['日期格式'].dt.month.fillna(0).astype(int)
-        df_clean['油品大類'] = df_clean['原燃物料名稱'].apply(lambda x: '汽油' if '汽油' in str(x) else ('柴油' if '柴油' in str(x) else '其他'))
-        if not df_equip.empty:
-            device_map = pd.Series(df_equip['統計類別'].values, index=df_equip['設備名稱備註']).to_dict()
-            df_clean['統計類別'] = df_clean['設備名稱備註'].map(device_map).fillna("其他/未分類")
-
-    all_years = sorted(df_clean['年份'][df_clean['年份']>0].unique(), reverse=True) if not df_clean.empty else [datetime.now().year]
+    all_years = mirror_years(SHEET_ID, record_title) or [datetime.now().year]
 
     # [精準導入] 更新 Tab 結構：拔除微觀作業 Tab
     admin_tabs = st.tabs([
@@ -835,9 +850,9 @@ def main():
         "📁 年度加油統計及佐證下載"
     ])
     
-    with admin_tabs[0]: render_tab1_overview(df_clean, df_equip, all_years)
-    with admin_tabs[1]: render_tab2_dashboard(df_clean, all_years)
-    with admin_tabs[2]: render_tab3_export(df_clean, df_equip, all_years)
+    with admin_tabs[0]: render_tab1_overview(record_title, df_equip, all_years)
+    with admin_tabs[1]: render_tab2_dashboard(record_title, df_equip, all_years)
+    with admin_tabs[2]: render_tab3_export(record_title, df_equip, all_years)
     
     st.markdown('<div style="text-align: center; color: #BDC3C7; font-size: 0.9rem; margin-top: 50px;">管理員系統版本 V200 (Macro View Version)</div>', unsafe_allow_html=True)
 
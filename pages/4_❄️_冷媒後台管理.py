@@ -1,10 +1,6 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, date, timedelta
-import gspread
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
 import streamlit_authenticator as stauth
 import plotly.express as px
 import plotly.graph_objects as go
@@ -12,6 +8,13 @@ import time
 import re
 import io
 import hashlib
+from core.gsheets import get_drive_service, open_spreadsheet, get_worksheet_or_none
+from core.swr import swr_cache, freshness_caption
+from core.cache_scope import depends_on, invalidate
+from core.refrigerant_ref import load_reference_data
+from core.sheet_writer import diff_positional_frames, build_diff_requests, apply_requests, stale_rows
+from core.drive_prefetch import DrivePrefetch
+from core.drive_cache import get_drive_file
 
 try:
     from docx import Document
@@ -168,66 +171,45 @@ except: pass
 # 3. 資料庫連線
 REF_SHEET_ID = "1p7GsW-nrjerXhnn3pNgZzu_CdIh1Yxsm-fLJDqQ6MqA"
 
-# [精準導入 2] 快取資源：確保 API 連線不重複建立
-@st.cache_resource
-def init_google_ref():
-    oauth = st.secrets["gcp_oauth"]
-    creds = Credentials(token=None, refresh_token=oauth["refresh_token"], token_uri="https://oauth2.googleapis.com/token", client_id=oauth["client_id"], client_secret=oauth["client_secret"], scopes=["https://www.googleapis.com/auth/drive", "https://www.googleapis.com/auth/spreadsheets"])
-    gc = gspread.authorize(creds); drive = build('drive', 'v3', credentials=creds)
-    return gc, drive
-
+# [精準導入 2] 共用連線池：API 連線由 core.gsheets 全站共用，不重複建立
 try:
-    gc, drive_service = init_google_ref()
-    sh_ref = gc.open_by_key(REF_SHEET_ID)
-    try: ws_records = sh_ref.worksheet("冷媒填報紀錄")
-    except: 
+    drive_service = get_drive_service()
+    sh_ref = open_spreadsheet(REF_SHEET_ID)
+    ws_records = get_worksheet_or_none(REF_SHEET_ID, "冷媒填報紀錄")
+    if ws_records is None:
         ws_records = sh_ref.add_worksheet(title="冷媒填報紀錄", rows="1000", cols="15")
 except Exception as e:
     st.error(f"❌ 資料庫連線失敗: {e}")
     st.stop()
 
-# [精準導入 2] 快取資料：為雲端靜態係數表加上快取
-@st.cache_data(ttl=86400)
+# [精準導入 2] 雲端係數表取自 core.refrigerant_ref 共用快取 (與填報頁同一次 batchGet)
 def load_static_data_cloud():
     try:
-        ws_coef = sh_ref.worksheet("冷媒係數表")
-        df_coef = pd.DataFrame(ws_coef.get_all_records())
-        gwp_map = {}
-        if not df_coef.empty:
-            for _, row in df_coef.iterrows():
-                r_name_full = str(row.iloc[1]).strip().replace('\u3000', ' ').replace('\xa0', ' ')
-                try: gwp = float(str(row.iloc[2]).replace(',', ''))
-                except: gwp = 0.0
-                if r_name_full:
-                    gwp_map[r_name_full] = gwp
-        if '其他' not in gwp_map:
-            gwp_map['其他'] = 0.0
-        return gwp_map
+        return load_reference_data().gwp_map
     except:
         return DATA_GWP
 
 # [精準導入 2] 快取資料：調高 ttl 以減少不必要的重新拉取
-@st.cache_data(ttl=600)
+@depends_on(REF_SHEET_ID, "冷媒填報紀錄")
+@swr_cache(ttl=300, watch=REF_SHEET_ID)
 def load_records_data():
-    try:
-        data = ws_records.get_all_values()
-        if len(data) > 1:
-            raw_headers = data[0]
-            col_mapping = {}
-            for h in raw_headers:
-                clean_h = str(h).strip()
-                if "填充量" in clean_h or "重量" in clean_h: col_mapping[h] = "冷媒填充量"
-                elif "種類" in clean_h or "品項" in clean_h: col_mapping[h] = "冷媒種類"
-                elif "日期" in clean_h or "維修" in clean_h: col_mapping[h] = "維修日期"
-                else: col_mapping[h] = clean_h
-            
-            df = pd.DataFrame(data[1:], columns=raw_headers)
-            df.rename(columns=col_mapping, inplace=True)
-            return df
-        else:
-            return pd.DataFrame(columns=["填報時間","填報人","填報人分機","校區","所屬單位","填報單位名稱","建築物名稱","辦公室編號","維修日期","設備類型","設備品牌型號","冷媒種類","冷媒填充量","備註","佐證資料"])
-    except Exception as e:
-        return pd.DataFrame()
+    # 讀取失敗直接拋出 (不快取空表)，錯誤訊息由呼叫端於頁面顯示
+    data = ws_records.get_all_values()
+    if len(data) > 1:
+        raw_headers = data[0]
+        col_mapping = {}
+        for h in raw_headers:
+            clean_h = str(h).strip()
+            if "填充量" in clean_h or "重量" in clean_h: col_mapping[h] = "冷媒填充量"
+            elif "種類" in clean_h or "品項" in clean_h: col_mapping[h] = "冷媒種類"
+            elif "日期" in clean_h or "維修" in clean_h: col_mapping[h] = "維修日期"
+            else: col_mapping[h] = clean_h
+        
+        df = pd.DataFrame(data[1:], columns=raw_headers)
+        df.rename(columns=col_mapping, inplace=True)
+        return df
+    else:
+        return pd.DataFrame(columns=["填報時間","填報人","填報人分機","校區","所屬單位","填報單位名稱","建築物名稱","辦公室編號","維修日期","設備類型","設備品牌型號","冷媒種類","冷媒填充量","備註","佐證資料"])
 
 # ==========================================
 # 4. 輔助函數：Google Drive 與 Word 匯出
@@ -239,30 +221,36 @@ def get_drive_id(url):
     if match: return match.group(1)
     return None
 
-def download_and_convert_drive_files(drive_service_obj, file_id):
-    try:
-        request = drive_service_obj.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-        fh.seek(0)
-        header = fh.read(4)
-        fh.seek(0)
-        if header == b'%PDF':
-            images = []
-            try:
-                doc = fitz.open(stream=fh.read(), filetype="pdf")
+def evidence_file_ids(link_strs):
+    """依文件順序收集佐證連結中的 Drive 檔案 ID (供 DrivePrefetch 預先下載)"""
+    fids = []
+    for link_str in link_strs:
+        for link in str(link_str).split('\n'):
+            link = link.strip()
+            if not link or link in ["無", ""]: continue
+            fid = get_drive_id(link)
+            if fid: fids.append(fid)
+    return fids
+
+def convert_drive_file(data):
+    # DrivePrefetch 只在背景下載位元組，PDF 轉圖在排版的主執行緒進行 (PyMuPDF 不保證執行緒安全)
+    # 下載失敗 (None) 或 PDF 轉圖失敗則略過該檔
+    if data is None: return []
+    fh = io.BytesIO(data)
+    header = fh.read(4)
+    fh.seek(0)
+    if header == b'%PDF':
+        images = []
+        try:
+            with fitz.open(stream=fh.read(), filetype="pdf") as doc:
                 for page_num in range(len(doc)):
                     page = doc.load_page(page_num)
                     pix = page.get_pixmap(dpi=150)
                     img_bytes = pix.tobytes("png")
                     images.append(io.BytesIO(img_bytes))
-                return images
-            except: return []
-        return [fh]
-    except: return []
+            return images
+        except: return []
+    return [fh]
 
 def export_ref_docx(df_year, drive_srv):
     doc = Document()
@@ -276,59 +264,61 @@ def export_ref_docx(df_year, drive_srv):
 
     global_seen_fids = set()
     global_image_hashes = set()
-
-    for _, row in df_export.iterrows():
-        p = doc.add_paragraph()
-        p.add_run(f"所在校區：{row.get('校區', '-')} | 填報單位：{row.get('填報單位名稱', '-')}\n").bold = True
-        p.add_run(f"冷媒種類：{row.get('冷媒種類', '-')} | 冷媒填充量：{row.get('冷媒填充量', 0)} 公斤\n").bold = True
-        p.add_run(f"設備類型：{row.get('設備類型', '-')} | 建築物名稱：{row.get('建築物名稱', '-')} | 辦公室編號：{row.get('辦公室編號', '-')}\n").bold = True
-        p.add_run(f"發票日期：{row.get('維修日期', '-')}\n").bold = True
-
-        link_str = str(row.get('佐證資料', ''))
-        images_to_print = []
-        skipped_dup = False
+    # [效能優化] 先收集全部佐證檔案並行下載，排版時依序取用
+    with DrivePrefetch(evidence_file_ids(df_export.get('佐證資料', [])), lambda fid: get_drive_file(fid, drive_srv)[0]) as prefetch:
+
+        for _, row in df_export.iterrows():
+            p = doc.add_paragraph()
+            p.add_run(f"所在校區：{row.get('校區', '-')} | 填報單位：{row.get('填報單位名稱', '-')}\n").bold = True
+            p.add_run(f"冷媒種類：{row.get('冷媒種類', '-')} | 冷媒填充量：{row.get('冷媒填充量', 0)} 公斤\n").bold = True
+            p.add_run(f"設備類型：{row.get('設備類型', '-')} | 建築物名稱：{row.get('建築物名稱', '-')} | 辦公室編號：{row.get('辦公室編號', '-')}\n").bold = True
+            p.add_run(f"發票日期：{row.get('維修日期', '-')}\n").bold = True
+
+            link_str = str(row.get('佐證資料', ''))
+            images_to_print = []
+            skipped_dup = False
         
-        for link in link_str.split('\n'):
-            link = link.strip()
-            if not link or link in ["無", ""]: continue
-            fid = get_drive_id(link)
-            if fid:
-                if fid not in global_seen_fids:
-                    global_seen_fids.add(fid)
-                    downloaded_imgs = download_and_convert_drive_files(drive_srv, fid)
-                    for img_io in downloaded_imgs:
-                        img_io.seek(0)
-                        img_hash = hashlib.md5(img_io.read()).hexdigest()
-                        img_io.seek(0)
-                        if img_hash not in global_image_hashes:
-                            global_image_hashes.add(img_hash)
-                            images_to_print.append(img_io)
-                        else:
-                            skipped_dup = True
-                else:
-                    skipped_dup = True
-
-        if len(images_to_print) == 1:
-            p_img = doc.add_paragraph()
-            p_img.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            try: p_img.add_run().add_picture(images_to_print[0], width=Cm(16.0))
-            except: pass
-        elif len(images_to_print) > 1:
-            table = doc.add_table(rows=0, cols=2)
-            table.autofit = False
-            for i, img in enumerate(images_to_print):
-                if i % 2 == 0: row_cells = table.add_row().cells
-                try:
-                    p_img = row_cells[i % 2].paragraphs[0]
-                    p_img.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                    p_img.add_run().add_picture(img, width=Cm(8.0))
+            for link in link_str.split('\n'):
+                link = link.strip()
+                if not link or link in ["無", ""]: continue
+                fid = get_drive_id(link)
+                if fid:
+                    if fid not in global_seen_fids:
+                        global_seen_fids.add(fid)
+                        downloaded_imgs = convert_drive_file(prefetch.get(fid, None))
+                        for img_io in downloaded_imgs:
+                            img_io.seek(0)
+                            img_hash = hashlib.md5(img_io.read()).hexdigest()
+                            img_io.seek(0)
+                            if img_hash not in global_image_hashes:
+                                global_image_hashes.add(img_hash)
+                                images_to_print.append(img_io)
+                            else:
+                                skipped_dup = True
+                    else:
+                        skipped_dup = True
+
+            if len(images_to_print) == 1:
+                p_img = doc.add_paragraph()
+                p_img.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                try: p_img.add_run().add_picture(images_to_print[0], width=Cm(16.0))
                 except: pass
+            elif len(images_to_print) > 1:
+                table = doc.add_table(rows=0, cols=2)
+                table.autofit = False
+                for i, img in enumerate(images_to_print):
+                    if i % 2 == 0: row_cells = table.add_row().cells
+                    try:
+                        p_img = row_cells[i % 2].paragraphs[0]
+                        p_img.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                        p_img.add_run().add_picture(img, width=Cm(8.0))
+                    except: pass
         
-        if skipped_dup and not images_to_print:
-            p_dup = doc.add_paragraph()
-            p_dup.add_run("*(此佐證資料與前方共用或已顯示過，為節省篇幅自動省略)*").italic = True
+            if skipped_dup and not images_to_print:
+                p_dup = doc.add_paragraph()
+                p_dup.add_run("*(此佐證資料與前方共用或已顯示過，為節省篇幅自動省略)*").italic = True
         
-        doc.add_page_break()
+            doc.add_page_break()
         
     output = io.BytesIO()
     doc.save(output)
@@ -510,7 +500,7 @@ def render_tab2_edit(df_clean, df_records):
     
     if st.button("🔄 更新背景資料庫 (從 Google Sheet 同步)", key="btn_update_db"):
         with st.spinner("正在從雲端下載最新資料..."):
-            load_static_data_cloud.clear() # [精準導入 2] 強制清除快取以取得最新資料
+            load_reference_data.clear() # [精準導入 2] 強制清除快取以取得最新資料
             st.session_state['gwp_map'] = load_static_data_cloud()
         st.success("✅ 資料庫已更新！")
 
@@ -529,20 +519,37 @@ def render_tab2_edit(df_clean, df_records):
         
         if st.button("💾 儲存變更", type="primary"):
             try:
-                df_final = edited.copy()
-                cols_to_remove = ['年份', '月份', '排放量(kgCO2e)', '排放量(公噸)', '冷媒顯示名稱']
-                for c in cols_to_remove:
-                    if c in df_final.columns: del df_final[c]
-                
-                df_final['維修日期'] = df_final['維修日期'].astype(str)
-                cols_to_write = df_records.columns.tolist()
-                cols_to_write = [c for c in cols_to_write if c in df_final.columns]
-                df_final = df_final[cols_to_write]
-                
-                ws_records.clear()
-                ws_records.update([df_final.columns.tolist()] + df_final.astype(str).values.tolist())
-                st.success("✅ 資料更新成功！")
-                st.cache_data.clear()
+                def to_sheet_frame(df):
+                    df_final = df.copy()
+                    cols_to_remove = ['年份', '月份', '排放量(kgCO2e)', '排放量(公噸)', '冷媒顯示名稱']
+                    for c in cols_to_remove:
+                        if c in df_final.columns: del df_final[c]
+                    df_final['維修日期'] = df_final['維修日期'].astype(str)
+                    return df_final.astype(str)
+
+                cols_to_write = [c for c in df_records.columns.tolist() if c in edited.columns]
+
+                # 只寫回有變動的儲存格 / 新增列 / 刪除列，不再清空整張表重寫
+                updates, deletes, appends = diff_positional_frames(to_sheet_frame(df_clean), to_sheet_frame(edited), cols_to_write)
+                if not (updates or deletes or appends):
+                    st.info("沒有偵測到任何變更。")
+                else:
+                    # [防護機制] 列號來自快照：送出前重新讀取要修改 / 刪除的列，核對填報時間與填報人，避免他人增刪列後刪改到錯誤的紀錄
+                    key_cols = [c for c in ("填報時間", "填報人") if c in df_records.columns] or [df_records.columns[0]]
+                    touched = sorted({r for r, _, _ in updates} | set(deletes))
+                    bad = stale_rows(ws_records, {r: df_records.loc[r - 2, key_cols].tolist() for r in touched}, [df_records.columns.get_loc(c) + 1 for c in key_cols])
+                    if bad:
+                        st.error(f"⚠️ 試算表已被其他人異動 (第 {', '.join(map(str, bad[:5]))} 列內容不符)，已取消本次儲存，請重新載入後再編輯。")
+                        st.session_state.pop("ref_editor", None)
+                        invalidate(REF_SHEET_ID, "冷媒填報紀錄")
+                        return
+                    apply_requests(ws_records, build_diff_requests(ws_records.id, updates, deletes, appends))
+                    st.success(f"✅ 資料更新成功！(修改 {len(updates)} 格、新增 {len(appends)} 列、刪除 {len(deletes)} 列)")
+                    # 位置對應的差異寫入不可重複送出：清除編輯狀態並整頁重跑，下次比對以剛寫入的資料為基準
+                    st.session_state.pop("ref_editor", None)
+                    invalidate(REF_SHEET_ID, "冷媒填報紀錄")
+                    time.sleep(1)
+                    st.rerun()
             except Exception as e:
                 st.error(f"更新失敗: {e}")
     else:
@@ -602,7 +609,9 @@ def render_admin_dashboard():
     st.markdown('<div style="font-size: 2.4rem; font-weight: 900; color: #2C3E50; margin-bottom: 16px;">👑 冷媒管理後台 (Refrigerant Management Backend)</div>', unsafe_allow_html=True)
     
     gwp_map = st.session_state.get('gwp_map', DATA_GWP)
-    df_records = load_records_data()
+    try: df_records = load_records_data()
+    except Exception as e: st.error(f"❌ 讀取冷媒填報紀錄失敗，請稍後重新整理: {e}"); return
+    freshness_caption(load_records_data)
 
     admin_tabs = st.tabs(["📊 全校冷媒填充儀表板", "📝 申報資料異動", "📁 年度冷媒填充統計及佐證下載"])
 
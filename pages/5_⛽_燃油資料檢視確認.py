@@ -1,28 +1,26 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, date, timedelta
-import gspread
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
 import streamlit_authenticator as stauth
 import time
 import re
 import io
 import uuid
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from PIL import Image
 from functools import wraps
 import random
-
-# [PDF 截圖套件防護]
-try:
-    import fitz  # PyMuPDF
-    HAS_FITZ = True
-except ImportError:
-    HAS_FITZ = False
+from core.gsheets import get_drive_service, get_sheets_service, open_spreadsheet, get_worksheet, get_worksheet_or_none
+from core.tail_sync import sync_worksheet_tail, invalidate_tail
+from core.swr import swr_cache, freshness_caption
+from core.cache_scope import depends_on, invalidate
+from core.sheet_writer import apply_requests, delete_rows_requests, stale_rows
+from core.mailer import open_smtp
+from core.evidence_cache import evidence_file, evidence_cache_caption
+from core.rate_limit import limiter_caption
+# [PDF 截圖套件防護] HAS_FITZ 由 core.pdf_preview 判斷 (未安裝 PyMuPDF 時 PDF 僅提供下載)
+from core.pdf_preview import pdf_pages, show_preview, visible_pages, unique_drive_links, ImageFile, HAS_FITZ
 
 # ==========================================
 # 0. 系統設定 (查核專屬後台)
@@ -64,9 +62,7 @@ def with_retry(max_retries=5, base_delay=2.0, backoff_factor=2.0):
 
 @with_retry(max_retries=3, base_delay=2.0)
 def update_sheet_row_safe(worksheet_title, range_name, values):
-    oauth = st.secrets["gcp_oauth"]
-    creds = Credentials(token=None, refresh_token=oauth["refresh_token"], token_uri="https://oauth2.googleapis.com/token", client_id=oauth["client_id"], client_secret=oauth["client_secret"], scopes=["https://www.googleapis.com/auth/spreadsheets"])
-    service = build('sheets', 'v4', credentials=creds)
+    service = get_sheets_service()
     body = {'values': [values]}
     full_range = f"'{worksheet_title}'!{range_name}"
     service.spreadsheets().values().update(
@@ -75,13 +71,13 @@ def update_sheet_row_safe(worksheet_title, range_name, values):
         valueInputOption="USER_ENTERED",
         body=body
     ).execute()
+    # 管理端修改：通知增量同步下次改為全量重載
+    invalidate_tail("1gqDU21YJeBoBOd8rMYzwwZ45offXWPGEODKTF6B8k-Y", worksheet_title)
 
 # --- 新增：資料新增 (Append) 函數 ---
 @with_retry(max_retries=3, base_delay=2.0)
 def append_sheet_row_safe(worksheet_title, values):
-    oauth = st.secrets["gcp_oauth"]
-    creds = Credentials(token=None, refresh_token=oauth["refresh_token"], token_uri="https://oauth2.googleapis.com/token", client_id=oauth["client_id"], client_secret=oauth["client_secret"], scopes=["https://www.googleapis.com/auth/spreadsheets"])
-    service = build('sheets', 'v4', credentials=creds)
+    service = get_sheets_service()
     body = {'values': [values]}
     full_range = f"'{worksheet_title}'!A:A"
     service.spreadsheets().values().append(
@@ -94,36 +90,27 @@ def append_sheet_row_safe(worksheet_title, values):
 
 # --- 新增：資料刪除 (Delete) 函數 ---
 @with_retry(max_retries=3, base_delay=2.0)
+def delete_sheet_rows_safe(worksheet_title, row_indices, expected=None, key_cols=()):
+    """批次刪除多列 (1-based 列號)：sheetId 取自全站共用的工作表快取，一次 batchUpdate 完成
+
+    expected 為 {列號: 快照中該列在 key_cols (1-based 欄號) 的值}：刪除前重新讀取核對，任一列不符即整批取消
+    """
+    if not row_indices: return 0
+    # sheetId 隨工作表物件快取，不必每次刪除前再抓一次整份試算表的 metadata
+    ws = get_worksheet("1gqDU21YJeBoBOd8rMYzwwZ45offXWPGEODKTF6B8k-Y", worksheet_title)
+    if expected and key_cols:
+        # [防護機制] 列號取自快照 (可能已過時)，一次刪除多個區段，位移會刪到多筆錯誤的紀錄
+        bad = stale_rows(ws, expected, key_cols)
+        if bad:
+            invalidate("1gqDU21YJeBoBOd8rMYzwwZ45offXWPGEODKTF6B8k-Y", worksheet_title)  # 下次重跑改讀最新資料
+            raise RuntimeError(f"試算表已被其他人異動 (第 {', '.join(map(str, bad[:5]))} 列內容不符)，已取消刪除，請重新整理後再操作")
+    # 連續列合併為同一區段，並由下往上刪除，避免列位置位移
+    apply_requests(ws, delete_rows_requests(ws.id, row_indices))
+    invalidate_tail("1gqDU21YJeBoBOd8rMYzwwZ45offXWPGEODKTF6B8k-Y", worksheet_title)
+    return len(set(row_indices))
+
 def delete_sheet_row_safe(worksheet_title, row_index):
-    oauth = st.secrets["gcp_oauth"]
-    creds = Credentials(token=None, refresh_token=oauth["refresh_token"], token_uri="https://oauth2.googleapis.com/token", client_id=oauth["client_id"], client_secret=oauth["client_secret"], scopes=["https://www.googleapis.com/auth/spreadsheets"])
-    service = build('sheets', 'v4', credentials=creds)
-    
-    # 1. 取得目標工作表的 sheetId (Delete API 需要 ID 而非標題)
-    sheet_metadata = service.spreadsheets().get(spreadsheetId="1gqDU21YJeBoBOd8rMYzwwZ45offXWPGEODKTF6B8k-Y").execute()
-    sheets = sheet_metadata.get('sheets', '')
-    sheet_id = None
-    for sheet in sheets:
-        if sheet.get("properties", {}).get("title") == worksheet_title:
-            sheet_id = sheet.get("properties", {}).get("sheetId")
-            break
-            
-    # 2. 執行刪除動作 (startIndex 為 0-based)
-    if sheet_id is not None:
-        requests = [{
-            "deleteDimension": {
-                "range": {
-                    "sheetId": sheet_id,
-                    "dimension": "ROWS",
-                    "startIndex": row_index - 1,
-                    "endIndex": row_index
-                }
-            }
-        }]
-        service.spreadsheets().batchUpdate(
-            spreadsheetId="1gqDU21YJeBoBOd8rMYzwwZ45offXWPGEODKTF6B8k-Y", 
-            body={'requests': requests}
-        ).execute()
+    return delete_sheet_rows_safe(worksheet_title, [row_index])
 
 # ==========================================
 # 1. CSS 樣式表 (莫蘭迪深色調)
@@ -233,48 +220,28 @@ SHEET_ID = "1gqDU21YJeBoBOd8rMYzwwZ45offXWPGEODKTF6B8k-Y"
 DEVICE_CODE_MAP = {"GV-1": "公務車輛(GV-1-)", "GV-2": "乘坐式割草機(GV-2-)", "GV-3": "乘坐式農用機具(GV-3-)", "GS-1": "鍋爐(GS-1-)", "GS-2": "發電機(GS-2-)", "GS-3": "肩背或手持式割草機、吹葉機(GS-3-)", "GS-4": "肩背或手持式農用機具(GS-4-)"}
 DEVICE_ORDER = ["公務車輛(GV-1-)", "乘坐式割草機(GV-2-)", "乘坐式農用機具(GV-3-)", "鍋爐(GS-1-)", "發電機(GS-2-)", "肩背或手持式割草機、吹葉機(GS-3-)", "肩背或手持式農用機具(GS-4-)"]
 
-# 僅獲取 Drive Service 用於下載圖片
-@st.cache_resource
-def init_google_drive():
-    oauth = st.secrets["gcp_oauth"]
-    creds = Credentials(token=None, refresh_token=oauth["refresh_token"], token_uri="https://oauth2.googleapis.com/token", client_id=oauth["client_id"], client_secret=oauth["client_secret"], scopes=["https://www.googleapis.com/auth/drive"])
-    drive = build('drive', 'v3', credentials=creds)
-    return drive
-
+# 僅獲取 Drive Service 用於下載圖片 (全站共用連線池)
 try:
-    drive_service = init_google_drive()
+    drive_service = get_drive_service()
 except Exception as e: 
     st.error(f"雲端硬碟連線失敗: {e}")
     st.stop()
 
 # [效能提升] 延長 TTL 到 1 小時，且將資料清洗運算全數前置於 Cache 中！
-@st.cache_data(ttl=3600, show_spinner="🔄 正在從資料庫同步並處理資料...") 
+@depends_on(SHEET_ID)  # 同時讀取設備清單與填報紀錄
+@swr_cache(ttl=600, watch=SHEET_ID, spinner="🔄 正在從資料庫同步並處理資料...")
 def load_fuel_data():
-    oauth = st.secrets["gcp_oauth"]
-    creds = Credentials(token=None, refresh_token=oauth["refresh_token"], token_uri="https://oauth2.googleapis.com/token", client_id=oauth["client_id"], client_secret=oauth["client_secret"], scopes=["https://www.googleapis.com/auth/spreadsheets"])
-    gc = gspread.authorize(creds)
-    sh = gc.open_by_key(SHEET_ID)
-    
-    try: 
-        ws_equip = sh.worksheet("設備清單")
-        ws_equip_title = "設備清單"
-    except: 
-        ws_equip = sh.sheet1 
-        ws_equip_title = ws_equip.title
-        
-    try: 
-        ws_record = sh.worksheet("油料填報紀錄")
-        ws_record_title = "油料填報紀錄"
-    except: 
-        ws_record = sh.worksheet("填報紀錄")
-        ws_record_title = "填報紀錄"
+    ws_equip = get_worksheet_or_none(SHEET_ID, "設備清單") or open_spreadsheet(SHEET_ID).sheet1
+    ws_equip_title = ws_equip.title
+    ws_record = get_worksheet_or_none(SHEET_ID, "油料填報紀錄", "填報紀錄")
+    ws_record_title = ws_record.title
     
     eq_data = ws_equip.get_all_values()
     df_e = pd.DataFrame(eq_data[1:], columns=eq_data[0]) if len(eq_data) > 1 else pd.DataFrame(columns=eq_data[0])
     df_e['_row_index'] = range(2, len(df_e) + 2)
     if '設備編號' in df_e.columns: df_e['統計類別'] = df_e['設備編號'].apply(lambda c: next((v for k, v in DEVICE_CODE_MAP.items() if str(c).startswith(k)), "其他/未分類"))
     
-    rec_data = ws_record.get_all_values()
+    rec_data = sync_worksheet_tail(ws_record)
     df_r = pd.DataFrame(rec_data[1:], columns=rec_data[0]) if len(rec_data) > 1 else pd.DataFrame(columns=rec_data[0])
     df_r['_row_index'] = range(2, len(df_r) + 2)
     
@@ -313,7 +280,7 @@ def send_system_email(to_email, subject, body):
         msg['Subject'] = subject
         msg.attach(MIMEText(body, 'html'))
         
-        server = smtplib.SMTP(smtp_cfg["server"], smtp_cfg["port"])
+        server = open_smtp(smtp_cfg["server"], smtp_cfg["port"])
         server.starttls()
         server.login(smtp_cfg["email"], smtp_cfg["password"])
         server.send_message(msg)
@@ -321,42 +288,26 @@ def send_system_email(to_email, subject, body):
         return True, "發送成功"
     except Exception as e: return False, f"發信失敗: {str(e)}"
 
-@st.cache_data(ttl=86400, show_spinner=False, max_entries=100)
 def get_cached_file_from_drive(url):
     try:
-        d_svc = init_google_drive()
         match = re.search(r'/d/([a-zA-Z0-9_-]+)', url)
         if not match: match = re.search(r'id=([a-zA-Z0-9_-]+)', url)
         if not match: return None, False, None, None, False
 
         file_id = match.group(1)
-        try:
-            meta = d_svc.files().get(fileId=file_id, fields="name").execute()
-            filename = meta.get('name', f'佐證資料_{file_id}')
-        except: filename = f"佐證資料_{file_id}.pdf"
-            
+        # 原始檔案與 PDF 預覽分層存放於依位元組上限淘汰的 core.evidence_cache，不再快取解碼後的 PIL 圖片
+        file_bytes, meta = evidence_file(file_id)
+        filename = meta.get('name') or f'佐證資料_{file_id}'
         is_pdf = filename.lower().endswith('.pdf')
-        request = d_svc.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while done is False: status, done = downloader.next_chunk()
-        
-        fh.seek(0); file_bytes = fh.read()
         
         try:
             if is_pdf and HAS_FITZ:
-                doc = fitz.open("pdf", file_bytes)
-                images = []
-                for page_num in range(len(doc)):
-                    page = doc.load_page(page_num)
-                    pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-                    images.append(Image.open(io.BytesIO(pix.tobytes("png"))))
-                is_landscape = images[0].width > images[0].height if images else False
+                # [效能優化] PDF 只解析頁數與方向，各頁於畫面顯示時才轉圖 (core.pdf_preview)
+                images, is_landscape = pdf_pages(file_id, file_bytes)
                 return images, is_landscape, file_bytes, filename, True
             else:
-                img = Image.open(io.BytesIO(file_bytes))
-                return [img], img.width > img.height, file_bytes, filename, False
+                img = Image.open(io.BytesIO(file_bytes))  # 只讀取檔頭取得尺寸，畫面顯示縮圖 (core.pdf_preview)
+                return [ImageFile(file_id)], img.width > img.height, file_bytes, filename, False
         except: return None, False, file_bytes, filename, is_pdf
     except Exception: return None, False, None, None, False
 
@@ -365,7 +316,7 @@ def render_image_gallery(links, base_key):
         st.info("無佐證圖片連結")
         return
     
-    unique_links = list(dict.fromkeys([l.strip() for l_str in links for l in str(l_str).split('\n') if str(l).strip() not in ["", "無", "佐證如總務處事務組中油明細", "-"]]))
+    unique_links = unique_drive_links([l.strip() for l_str in links for l in str(l_str).split('\n') if str(l).strip() not in ["", "無", "佐證如總務處事務組中油明細", "-"]])
     if not unique_links:
         st.info("無佐證圖片或採用共用/統一明細。")
         return
@@ -375,7 +326,7 @@ def render_image_gallery(links, base_key):
         for url in unique_links:
             images_list, is_landscape, file_bytes, filename, is_pdf = get_cached_file_from_drive(url)
             if images_list:
-                for i, img in enumerate(images_list):
+                for i, img in enumerate(visible_pages(images_list, f"pdf_all_{base_key}_{url}", filename)):
                     ps = f" (第 {i+1} 頁)" if is_pdf and len(images_list) > 1 else ""
                     images_data.append({ "url": url, "img": img, "is_landscape": is_landscape, "bytes": file_bytes, "filename": filename, "is_pdf": is_pdf, "ps": ps })
             else: images_data.append({ "url": url, "img": None, "is_landscape": False, "bytes": file_bytes, "filename": filename, "is_pdf": is_pdf, "ps": "" })
@@ -391,12 +342,12 @@ def render_image_gallery(links, base_key):
             else:
                 cap = f"📄 {item['filename']}{item['ps']}"
                 if item['is_landscape']:
-                    st.image(item['img'], use_container_width=True, caption=cap); idx += 1
+                    show_preview(st, item['img'], cap, base_key); idx += 1
                 else:
                     c1, c2 = st.columns(2)
-                    c1.image(item['img'], use_container_width=True, caption=cap); idx += 1
+                    show_preview(c1, item['img'], cap, base_key); idx += 1
                     if idx < len(images_data) and images_data[idx]['img'] is not None and not images_data[idx]['is_landscape']:
-                        c2.image(images_data[idx]['img'], use_container_width=True, caption=f"📄 {images_data[idx]['filename']}{images_data[idx]['ps']}"); idx += 1
+                        show_preview(c2, images_data[idx]['img'], f"📄 {images_data[idx]['filename']}{images_data[idx]['ps']}", base_key); idx += 1
             if idx < len(images_data): st.markdown("<hr style='margin:10px 0; border:1px dashed #E5E7E9;'>", unsafe_allow_html=True)
 
 # ==========================================
@@ -459,7 +410,7 @@ def render_tab1_db_manage(df_equip_full, eq_cols, ws_title):
                         with st.spinner("🔄 寫入資料庫中..."):
                             append_sheet_row_safe(ws_title, new_vals)
                         st.success(f"✅ 【{add_name}】 新增成功！")
-                        st.cache_data.clear()
+                        invalidate(SHEET_ID, ws_title)
                         time.sleep(1)
                         st.rerun()
                     except Exception as e:
@@ -528,7 +479,7 @@ def render_tab1_db_manage(df_equip_full, eq_cols, ws_title):
                             with st.spinner("🔄 寫入資料庫中..."):
                                 update_sheet_row_safe(ws_title, range_str, updated_vals)
                             st.success(f"✅ {new_name} 資料更新成功！")
-                            st.cache_data.clear()
+                            invalidate(SHEET_ID, ws_title)
                             time.sleep(1)
                             st.rerun()
                         except Exception as e:
@@ -539,7 +490,7 @@ def render_tab1_db_manage(df_equip_full, eq_cols, ws_title):
                             with st.spinner("🗑️ 正在刪除設備資料..."):
                                 delete_sheet_row_safe(ws_title, r_idx)
                             st.success(f"✅ 【{new_name}】 已成功從資料庫刪除！")
-                            st.cache_data.clear()
+                            invalidate(SHEET_ID, ws_title)
                             time.sleep(1)
                             st.rerun()
                         except Exception as e:
@@ -782,6 +733,45 @@ def render_tab2_notify(df_records, df_equip_full):
                         st.success(f"寄送完畢！成功: {success_count} 封，失敗: {fail_count} 封。")
 
 
+# 批次刪除：勾選多筆誤繕紀錄，一次送出
+@st.fragment
+def render_bulk_delete_records(df_target, ws_title, rec_cols):
+    show_cols = [c for c in ['加油日期', '設備名稱備註', '加油量', '填報單位', '填報人', '備註'] if c in df_target.columns]
+    df_del = df_target[['_row_index'] + show_cols].copy()
+    df_del.insert(0, '刪除', False)
+    # 標示填報人註記「前筆資料誤繕，請刪除」的紀錄，方便管理者比對前一筆
+    df_del.insert(1, '誤繕註記', df_target['備註'].astype(str).str.contains('誤繕') if '備註' in df_target.columns else False)
+    flagged = int(df_del['誤繕註記'].sum())
+    
+    with st.expander(f"🗑️ 批次刪除誤繕紀錄 (本月共 {len(df_del)} 筆，{flagged} 筆含誤繕註記)", expanded=flagged > 0):
+        edited = st.data_editor(
+            df_del,
+            column_config={
+                "刪除": st.column_config.CheckboxColumn("刪除", default=False),
+                "誤繕註記": st.column_config.CheckboxColumn("誤繕註記", disabled=True),
+                "_row_index": st.column_config.NumberColumn("試算表列號", disabled=True),
+            },
+            disabled=show_cols,
+            hide_index=True,
+            use_container_width=True,
+            key=f"bulk_del_{ws_title}_{df_target['_row_index'].min()}",
+        )
+        rows_to_delete = edited.loc[edited['刪除'], '_row_index'].astype(int).tolist()
+        
+        if st.button(f"🗑️ 刪除勾選的 {len(rows_to_delete)} 筆紀錄", type="primary", disabled=not rows_to_delete, key=f"bulk_del_btn_{ws_title}"):
+            try:
+                key_names = [c for c in ['填報時間', '填報人', '設備名稱備註', '加油日期'] if c in rec_cols and c in df_target.columns]
+                snapshot = df_target.drop_duplicates('_row_index').set_index('_row_index')
+                expected = {r: snapshot.loc[r, key_names].tolist() for r in rows_to_delete}
+                with st.spinner("🗑️ 正在刪除勾選的紀錄..."):
+                    deleted = delete_sheet_rows_safe(ws_title, rows_to_delete, expected, [rec_cols.index(c) + 1 for c in key_names])
+                st.success(f"✅ 已刪除 {deleted} 筆紀錄！")
+                invalidate(SHEET_ID, ws_title)
+                time.sleep(1)
+                st.rerun()
+            except Exception as e:
+                st.error(f"刪除失敗：{e}")
+
 @st.fragment
 def render_tab3_edit_records(df_records, rec_cols, ws_title):
     st.markdown("<br>", unsafe_allow_html=True)
@@ -810,6 +800,8 @@ def render_tab3_edit_records(df_records, rec_cols, ws_title):
         df_target = df_mo
         
     if not df_target.empty:
+        render_bulk_delete_records(df_target, ws_title, rec_cols)
+        
         grouped = df_target.groupby('設備名稱備註')
         
         for eq_name, group in grouped:
@@ -867,7 +859,7 @@ def render_tab3_edit_records(df_records, rec_cols, ws_title):
                                     with st.spinner("🔄 寫入資料庫中..."):
                                         update_sheet_row_safe(ws_title, range_str, updated_vals)
                                     st.success("✅ 更新成功！")
-                                    st.cache_data.clear()
+                                    invalidate(SHEET_ID, ws_title)
                                     time.sleep(1)
                                     st.rerun()
                                 except Exception as e:
@@ -892,6 +884,9 @@ def render_tab3_edit_records(df_records, rec_cols, ws_title):
 # ==========================================
 def main():
     st.markdown('<div style="font-size: 2.4rem; font-weight: 900; color: #2C3E50; margin-bottom: 20px;">⛽ 燃油資料檢視與確認專區 (Data Verification & Audit Area)</div>', unsafe_allow_html=True)
+    freshness_caption(load_fuel_data)
+    evidence_cache_caption()
+    limiter_caption()
     
     admin_tabs = st.tabs([
         "🗄️ 燃油設備單位資料庫管理",
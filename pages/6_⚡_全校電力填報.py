@@ -1,7 +1,11 @@
 import streamlit as st
 import pandas as pd
-import gspread
-from google.oauth2.credentials import Credentials
+from core.gsheets import get_gspread_client, open_spreadsheet, get_worksheet
+from core.rate_limit import with_priority, PRIORITY_SUBMIT
+from core.swr import swr_cache, freshness_caption
+from core.cache_scope import depends_on, invalidate
+from core.record_cache import read_records, append_records, get_record_cache
+from core.sheet_writer import sync_rows_by_key
 from datetime import datetime, date, timedelta
 from dateutil.relativedelta import relativedelta
 import time
@@ -199,40 +203,47 @@ MORANDI_BG = {
     "其他": "#EAEDED"
 }
 
-@st.cache_resource
 def init_google_sheet():
     try:
-        creds_dict = dict(st.secrets["gcp_oauth"])
-        creds = Credentials.from_authorized_user_info(creds_dict, scopes=["https://www.googleapis.com/auth/spreadsheets"])
-        gc = gspread.authorize(creds)
-        return gc
+        return get_gspread_client()
     except Exception as e:
         st.error(f"連線失敗: {e}")
         return None
 
-@st.cache_data(ttl=600)
+# 帳單唯一鍵：同一電號同一帳期同一計費模式僅一筆
+POWER_RECORD_KEYS = ["電號", "帳單年度", "帳單月份", "計費模式"]
+
+@depends_on(SHEET_ID, "電號對照表")
+@swr_cache(ttl=600, watch=SHEET_ID)
+def load_meters(_gc):
+    ws_meters = get_worksheet(SHEET_ID, "電號對照表")
+    meters_data = ws_meters.get_all_records()
+    meters_df = pd.DataFrame(meters_data)
+    if not meters_df.empty:
+        meters_df.columns = meters_df.columns.str.strip()
+        col_map = {c: c for c in meters_df.columns}
+        for c in meters_df.columns:
+            # 🔥 修正為 計費模式
+            if "方式" in c or "模式" in c or "週期" in c or "計費" in c:
+                col_map[c] = "計費模式"
+        meters_df.rename(columns=col_map, inplace=True)
+    return meters_df
+
+def fetch_power_records(worksheet):
+    return pd.DataFrame(worksheet.get_all_records())
+
+def strip_record_columns(df):
+    if not df.empty: df.columns = df.columns.str.strip()
+    return df
+
 def load_data(_gc):
     try:
-        sh = _gc.open_by_key(SHEET_ID)
-        
-        ws_meters = sh.worksheet("電號對照表")
-        meters_data = ws_meters.get_all_records()
-        meters_df = pd.DataFrame(meters_data)
-        if not meters_df.empty:
-            meters_df.columns = meters_df.columns.str.strip()
-            col_map = {c: c for c in meters_df.columns}
-            for c in meters_df.columns:
-                # 🔥 修正為 計費模式
-                if "方式" in c or "模式" in c or "週期" in c or "計費" in c:
-                    col_map[c] = "計費模式"
-            meters_df.rename(columns=col_map, inplace=True)
+        meters_df = load_meters(_gc)
 
+        # 用電紀錄走寫穿快取：填報成功後直接併入，不必重新讀取整張紀錄表
         try:
-            ws_records = sh.worksheet("用電填報紀錄")
-            records_data = ws_records.get_all_records()
-            records_df = pd.DataFrame(records_data)
-            if not records_df.empty:
-                records_df.columns = records_df.columns.str.strip()
+            ws_records = get_worksheet(SHEET_ID, "用電填報紀錄")
+            records_df = read_records(ws_records, fetch_power_records, prepare=strip_record_columns, ttl=600, as_text=False)
         except:
             records_df = pd.DataFrame()
 
@@ -241,12 +252,12 @@ def load_data(_gc):
         st.error(f"資料讀取失敗: {e}")
         return pd.DataFrame(), pd.DataFrame()
 
+@with_priority(PRIORITY_SUBMIT)
 def save_new_data(new_records):
     try:
-        gc = init_google_sheet()
-        sh = gc.open_by_key(SHEET_ID)
+        sh = open_spreadsheet(SHEET_ID)
         try:
-            ws = sh.worksheet("用電填報紀錄")
+            ws = get_worksheet(SHEET_ID, "用電填報紀錄")
         except:
             ws = sh.add_worksheet(title="用電填報紀錄", rows=1000, cols=12)
             ws.append_row(["填報時間", "使用期間(起)", "使用期間(訖)", "計費模式", "校區", "電號", "用電地址", "用電量(度數)", "電費金額(元)", "帳單年度", "帳單月份", "備註"])
@@ -269,7 +280,7 @@ def save_new_data(new_records):
                 r.get('備註', '')
             ])
         ws.append_rows(rows)
-        load_data.clear()
+        append_records(ws, rows)
         return True
     except Exception as e:
         st.error(f"寫入失敗: {e}")
@@ -560,29 +571,17 @@ def render_tab2_edit():
 
         if submitted:
             try:
-                sh = gc.open_by_key(SHEET_ID)
-                ws = sh.worksheet("用電填報紀錄")
-                
-                df_keep = records_df[~mask_target].copy()
+                ws = get_worksheet(SHEET_ID, "用電填報紀錄")
                 
-                if updated_records:
-                    df_new = pd.DataFrame(updated_records)
-                    df_final = pd.concat([df_keep, df_new], ignore_index=True)
-                else:
-                    df_final = df_keep 
-                    
                 # 🔥 確保標題列也是 計費模式
                 cols = ["填報時間", "使用期間(起)", "使用期間(訖)", "計費模式", "校區", "電號", "用電地址", "用電量(度數)", "電費金額(元)", "帳單年度", "帳單月份", "備註"]
-                for c in cols:
-                    if c not in df_final.columns:
-                        df_final[c] = ""
-                df_final = df_final[cols]
+                df_new = pd.DataFrame(updated_records, columns=cols)
                 
-                ws.clear()
-                ws.update([cols] + df_final.values.tolist())
+                # 以「電號 + 帳單年度 + 帳單月份 + 計費模式」比對，只寫回有異動的列 (填報時間隨異動列更新)
+                sync_rows_by_key(ws, records_df, df_new, POWER_RECORD_KEYS, scope_mask=mask_target, ignore_cols=["填報時間"])
                 
                 st.toast(f"✅ {selected_year} 年 {selected_month} 月 ({selected_mode}) 資料已精準更新完成！", icon="🎉")
-                load_data.clear()
+                invalidate(SHEET_ID, "用電填報紀錄")
                 time.sleep(1.5)
                 st.rerun()
                 
@@ -594,6 +593,7 @@ def render_tab2_edit():
 # =========================================================
 def main():
     st.markdown('<div style="font-size: 2.4rem; font-weight: 900; color: #2C3E50; margin-bottom: 20px;">⚡ 全校電力填報系統</div>', unsafe_allow_html=True)
+    freshness_caption(load_meters, get_record_cache(SHEET_ID, "用電填報紀錄"))
 
     tab1, tab2 = st.tabs(["📤 資料填報", "✏️ 資料異動"])
 
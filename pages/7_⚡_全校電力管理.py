@@ -1,7 +1,11 @@
 import streamlit as st
 import pandas as pd
-import gspread
-from google.oauth2.credentials import Credentials
+from core.gsheets import get_gspread_client, get_worksheet, get_worksheet_or_none
+from core.rate_limit import with_priority, PRIORITY_BACKGROUND
+from core.swr import swr_cache, freshness_caption
+from core.cache_scope import depends_on, invalidate
+from core.schemas import apply_schema, POWER_DAILY
+from core.sheet_writer import sync_rows_by_key
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import datetime
@@ -247,26 +251,22 @@ st.markdown(f"""
 # =========================================================
 SHEET_ID = "17BTvriIxK1ibFaPlmDUaTYwGrbmq556XNbzythA3rVo"
 
-@st.cache_resource
 def init_google_sheet():
     try:
-        creds_dict = dict(st.secrets["gcp_oauth"])
-        creds = Credentials.from_authorized_user_info(creds_dict, scopes=["https://www.googleapis.com/auth/spreadsheets"])
-        gc = gspread.authorize(creds)
-        return gc
+        return get_gspread_client()
     except Exception as e:
         st.error(f"連線失敗: {e}")
         return None
 
-def update_google_sheet_data(updated_df):
+# 帳單唯一鍵：同一電號同一帳期同一計費模式僅一筆
+POWER_RECORD_KEYS = ["電號", "帳單年度", "帳單月份", "計費模式"]
+
+def update_google_sheet_data(df_raw, scope_mask, edited_df):
     try:
-        gc = init_google_sheet()
-        sh = gc.open_by_key(SHEET_ID)
-        ws = sh.worksheet("用電填報紀錄")
-        data_to_upload = [updated_df.columns.values.tolist()] + updated_df.astype(str).values.tolist()
-        ws.clear()
-        ws.update(data_to_upload)
-        st.cache_data.clear() 
+        ws = get_worksheet(SHEET_ID, "用電填報紀錄")
+        # 只比對並寫回該年度有異動的列，不再清空整張表重寫所有年度
+        sync_rows_by_key(ws, df_raw, edited_df, POWER_RECORD_KEYS, scope_mask=scope_mask)
+        invalidate(SHEET_ID, "用電填報紀錄")
         return True
     except Exception as e:
         st.error(f"儲存失敗: {e}")
@@ -333,20 +333,20 @@ def calculate_daily_proration(df, df_coef):
     
     return df_grouped
 
-@st.cache_data(ttl=60)
+@depends_on(SHEET_ID, "用電填報紀錄", "碳排係數管理")
+@swr_cache(ttl=60, watch=SHEET_ID, spinner="資料讀取與精密計算中 (按日攤算)...")
+@with_priority(PRIORITY_BACKGROUND)  # 儀表板讀取讓位給填報送出
 def load_and_process_data(_gc):
-    sh = _gc.open_by_key(SHEET_ID)
-    try:
-        ws_records = sh.worksheet("用電填報紀錄")
-        df_raw = pd.DataFrame(ws_records.get_all_records())
-    except:
-        return pd.DataFrame(), pd.DataFrame()
+    # 讀取失敗直接拋出 (不快取空表)，錯誤訊息由呼叫端於頁面顯示
+    ws_records = get_worksheet(SHEET_ID, "用電填報紀錄")
+    df_raw = pd.DataFrame(ws_records.get_all_records())
         
-    try:
-        ws_coef = sh.worksheet("碳排係數管理")
+    # 係數表尚未建立時沿用預設係數；其他讀取錯誤照常拋出
+    ws_coef = get_worksheet_or_none(SHEET_ID, "碳排係數管理")
+    if ws_coef:
         df_coef = pd.DataFrame(ws_coef.get_all_records())
         df_coef.columns = [str(c).strip() for c in df_coef.columns]
-    except:
+    else:
         df_coef = pd.DataFrame(columns=["年度", "排碳係數"])
 
     if df_raw.empty: return pd.DataFrame(), pd.DataFrame()
@@ -355,7 +355,8 @@ def load_and_process_data(_gc):
     df_raw['電費金額(元)'] = pd.to_numeric(df_raw['電費金額(元)'], errors='coerce').fillna(0)
     df_raw['帳單年度'] = pd.to_numeric(df_raw['帳單年度'], errors='coerce')
     
-    df_processed = calculate_daily_proration(df_raw, df_coef)
+    # 按日攤算結果為唯讀分析資料：校區 / 地址轉為 category，年月為整數，快取與每次複製的記憶體較小
+    df_processed = apply_schema(calculate_daily_proration(df_raw, df_coef), POWER_DAILY, text=False)
     return df_processed, df_raw
 
 def get_year_range_string(df, year):
@@ -368,7 +369,7 @@ def get_year_range_string(df, year):
 def sort_addresses(df_subset, campus_name):
     order = ADDRESS_ORDER.get(campus_name, [])
     if not order: return df_subset
-    df_subset['sort_idx'] = df_subset['用電地址'].apply(lambda x: order.index(x) if x in order else 999)
+    df_subset['sort_idx'] = df_subset['用電地址'].astype(str).apply(lambda x: order.index(x) if x in order else 999)
     return df_subset.sort_values('sort_idx').drop(columns=['sort_idx'])
 
 # =========================================================
@@ -399,7 +400,7 @@ def render_kpi_card_custom(title, col1, col2, col3, color_code, ratios=[1,1,1],
 
 def plot_single_bar_chart(df_chart, x_col, y_col, title, color, unit):
     all_months = pd.DataFrame({x_col: range(1, 13)})
-    grouped = df_chart.groupby(x_col)[y_col].sum().reset_index()
+    grouped = df_chart.groupby(x_col, observed=True)[y_col].sum().reset_index()
     merged = pd.merge(all_months, grouped, on=x_col, how='left').fillna(0)
     
     fig = go.Figure()
@@ -430,7 +431,7 @@ def plot_single_bar_chart(df_chart, x_col, y_col, title, color, unit):
     return fig
 
 def plot_horizontal_ranking(df, category_col, value_col, total_value, title, height=400):
-    grouped = df.groupby(category_col)[value_col].sum().reset_index()
+    grouped = df.groupby(category_col, observed=True)[value_col].sum().reset_index()
     grouped = grouped.sort_values(value_col, ascending=True) 
     
     grouped['label'] = grouped[value_col].apply(
@@ -439,7 +440,7 @@ def plot_horizontal_ranking(df, category_col, value_col, total_value, title, hei
     
     fig = go.Figure()
     fig.add_trace(go.Bar(
-        y=grouped[category_col], x=grouped[value_col],
+        y=grouped[category_col].astype(str), x=grouped[value_col],
         orientation='h',
         marker_color=COLORS['chart_usage_blue'],
         text=grouped['label'],
@@ -928,7 +929,7 @@ def render_data_management_fragment(df_raw, df_processed, years, default_idx):
     df_download_src = df_processed[df_processed['統計年度'] == selected_year]
     
     if not df_download_src.empty:
-        df_download = df_download_src.groupby(['統計年度', '校區', '用電地址', '電號'], as_index=False).agg({
+        df_download = df_download_src.groupby(['統計年度', '校區', '用電地址', '電號'], as_index=False, observed=True).agg({
             '用電量(度數)': 'sum',
             '電費金額(元)': 'sum'
         })
@@ -971,11 +972,7 @@ def render_data_management_fragment(df_raw, df_processed, years, default_idx):
         
         if st.button("💾 儲存異動", type="primary"):
             with st.spinner("正在寫入資料庫，請稍候..."):
-                df_other_years = df_raw[df_raw['帳單年度'] != selected_year]
-                df_final_to_save = pd.concat([df_other_years, edited_df], ignore_index=True)
-                df_final_to_save.sort_values(by=['帳單年度', '帳單月份', '校區'], inplace=True, ascending=[False, False, True])
-                
-                if update_google_sheet_data(df_final_to_save):
+                if update_google_sheet_data(df_raw, df_raw['帳單年度'] == selected_year, edited_df):
                     st.success("✅ 資料異動已成功儲存！")
                     st.rerun()
                 else:
@@ -992,8 +989,10 @@ def main():
     gc = init_google_sheet()
     if not gc: return
     
-    with st.spinner("資料讀取與精密計算中 (按日攤算)..."):
-        df_processed, df_raw = load_and_process_data(gc)
+    # 快照存在時直接使用並於背景更新，僅首次載入顯示轉圈圈
+    try: df_processed, df_raw = load_and_process_data(gc)
+    except Exception as e: st.error(f"❌ 讀取用電資料失敗，請稍後重新整理: {e}"); return
+    freshness_caption(load_and_process_data)
     
     if df_processed.empty:
         st.warning("目前尚無資料，請先至「填報系統」輸入數據。")
@@ -1,9 +1,7 @@
 import streamlit as st
 import pandas as pd
-import gspread
 import uuid
 import datetime
-import smtplib
 import time
 import io
 import re
@@ -11,8 +9,14 @@ import fitz  # PyMuPDF 用於將 PDF 轉為圖片
 from PIL import Image, ImageOps  # 新增：ImageOps 用於校正手機相機旋轉
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from core.gsheets import get_drive_service, get_worksheet
+from core.swr import freshness_caption
+from core.cache_scope import invalidate
+from core.gas_data import load_gas_sheets
+from core.token_index import register_tokens
+from core.mailer import open_smtp
+from core.drive_prefetch import DrivePrefetch
+from core.drive_cache import get_drive_meta, get_drive_file
 from gspread.utils import rowcol_to_a1
 import streamlit_authenticator as stauth
 
@@ -107,26 +111,31 @@ def with_retry(max_retries=3, base_delay=1.5):
         return wrapper
     return decorator
 
-@st.cache_resource
-def get_credentials():
-    oauth_secrets = st.secrets["gcp_oauth"]
-    return Credentials(token=None, refresh_token=oauth_secrets["refresh_token"], client_id=oauth_secrets["client_id"], client_secret=oauth_secrets["client_secret"], token_uri="https://oauth2.googleapis.com/token")
+INV_KEY_COLS = ['系所', '實驗室老師', '氣體鋼瓶所在位置實驗室門牌', '鋼瓶氣體種類']
 
-def get_gc(): return gspread.authorize(get_credentials())
+def inv_row_key(dept, mgr, room, gas):
+    return (str(dept), str(mgr), str(room), str(gas))
 
-@st.cache_data(ttl=60, show_spinner=False)
-def load_data():
-    gc = get_gc(); sh = gc.open_by_key(SHEET_ID)
-    try: df_inv = pd.DataFrame(sh.worksheet('氣體鋼瓶資料庫').get_all_records())
-    except: df_inv = pd.DataFrame()
-    try: df_pur = pd.DataFrame(sh.worksheet('氣體鋼瓶年度使用紀錄').get_all_records())
-    except: df_pur = pd.DataFrame()
-    try: df_trk = pd.DataFrame(sh.worksheet('發送紀錄與金鑰').get_all_records())
-    except: df_trk = pd.DataFrame()
-    return df_inv, df_pur, df_trk
+def build_inv_row_map(df_inv):
+    """(系所, 實驗室老師, 門牌, 鋼瓶氣體種類) → 試算表列號 (df_inv 第一筆為第 2 列)"""
+    if df_inv.empty or not set(INV_KEY_COLS).issubset(df_inv.columns): return {}
+    keys = zip(*(df_inv[c].astype(str) for c in INV_KEY_COLS))
+    row_map = {}
+    # 重複鍵值以第一筆為準 (與原本逐列搜尋的結果一致)
+    for i, key in enumerate(keys): row_map.setdefault(key, i + 2)
+    return row_map
 
 @with_retry()
-def safe_append_rows(worksheet, rows): worksheet.append_rows(rows)
+def read_inv_row_map(worksheet):
+    """儲存前重新讀取庫存表鍵值欄 (A:D、G)，取得當下的列號；快取快照的列號可能因他人增刪列而偏移，不可用於寫入"""
+    abcd, gas = worksheet.batch_get(["A2:D", "G2:G"])
+    n = max(len(abcd), len(gas))
+    pad = lambda rows, w: [list(r) + [""] * (w - len(r)) for r in rows] + [[""] * w] * (n - len(rows))
+    keys = [a[:2] + a[3:4] + g[:1] for a, g in zip(pad(abcd, 4), pad(gas, 1))]
+    return build_inv_row_map(pd.DataFrame(keys, columns=INV_KEY_COLS))
+
+@with_retry()
+def safe_append_rows(worksheet, rows): return worksheet.append_rows(rows)
 
 @with_retry()
 def safe_delete_row(worksheet, idx): worksheet.delete_rows(idx)
@@ -139,7 +148,7 @@ def send_email_action(to_email, subject, html_body):
         sender_email = st.secrets["smtp"]["email"]; app_password = st.secrets["smtp"]["password"]; smtp_server = st.secrets["smtp"]["server"]; smtp_port = st.secrets["smtp"]["port"]
         msg = MIMEMultipart('alternative'); msg['Subject'] = subject; msg['From'] = sender_email; msg['To'] = to_email
         msg.attach(MIMEText(html_body, 'html'))
-        server = smtplib.SMTP(smtp_server, smtp_port); server.starttls(); server.login(sender_email, app_password)
+        server = open_smtp(smtp_server, smtp_port); server.starttls(); server.login(sender_email, app_password)
         server.send_message(msg); server.quit(); return True
     except Exception as e: return False
 
@@ -147,6 +156,13 @@ def generate_styled_email_html(email_body_text, title="溫室氣體盤查 氣體
     html_content = email_body_text.replace("\n", "<br>")
     return f"<html><body style='font-family: Arial, sans-serif; line-height: 1.6; color: #333; font-size: 15px;'><div style='max-width: 600px; margin: 0 auto; border: 1px solid #ddd; border-radius: 10px; overflow: hidden;'><div style='background-color: #5C6B73; color: white; padding: 15px 20px; text-align: center;'><h2 style='margin: 0;'>{title}</h2></div><div style='padding: 20px;'>{html_content}</div></div></body></html>"
 
+def fetch_proof_file(drive_service, file_id):
+    """讀取單據檔案資訊，圖片 / PDF 一併下載內容 (供 DrivePrefetch 並行預先下載)"""
+    meta = get_drive_meta(file_id, drive_service)
+    mime = meta.get('mimeType', '')
+    file_bytes = get_drive_file(file_id, drive_service)[0] if mime.startswith('image/') or mime == 'application/pdf' else None
+    return meta, file_bytes
+
 @st.cache_data(ttl=600, show_spinner="產製佐證資料 Word 檔中 (包含單據圖片/PDF下載)...")
 def cached_create_proof_word(df_pur_dict, current_year):
     df_pur = pd.DataFrame(df_pur_dict)
@@ -191,96 +207,101 @@ def cached_create_proof_word(df_pur_dict, current_year):
             p.add_run(f"    - {r['鋼瓶氣體種類']}：{r['購買量_數值']} kg\n")
     doc.add_page_break()
 
-    try: creds = get_credentials(); drive_service = build('drive', 'v3', credentials=creds); can_dl = True
+    try: drive_service = get_drive_service(); can_dl = True
     except: can_dl = False
+
+    # [效能優化] 先收集全部單據檔案並行下載，排版時依序取用
+    proof_ids = []
+    for link in df_pur.get('購買單據連結', pd.Series(dtype=str)).astype(str):
+        match = re.search(r'/d/([a-zA-Z0-9_-]+)', link)
+        if match and 'drive.google.com' in link: proof_ids.append(match.group(1))
+    with DrivePrefetch(proof_ids if can_dl else [], lambda fid: fetch_proof_file(drive_service, fid)) as prefetch:
         
-    for idx, row in df_pur.iterrows():
-        doc.add_heading(f"紀錄：{row.get('校區', '')} - {row.get('系所', '')} - {row.get('實驗室老師', '')}", level=2)
-        p = doc.add_paragraph()
-        p.add_run(f"氣體種類：{row.get('鋼瓶氣體種類', '')}\n").bold = True
+        for idx, row in df_pur.iterrows():
+            doc.add_heading(f"紀錄：{row.get('校區', '')} - {row.get('系所', '')} - {row.get('實驗室老師', '')}", level=2)
+            p = doc.add_paragraph()
+            p.add_run(f"氣體種類：{row.get('鋼瓶氣體種類', '')}\n").bold = True
         
-        date_str = row.get('購買日期', '')
-        if date_str: date_str = pd.to_datetime(date_str).strftime('%Y-%m-%d')
-        p.add_run(f"購買日期：{date_str}\n")
-        p.add_run(f"購買量：{row.get('購買量_數值', 0)} kg\n")
+            date_str = row.get('購買日期', '')
+            if date_str: date_str = pd.to_datetime(date_str).strftime('%Y-%m-%d')
+            p.add_run(f"購買日期：{date_str}\n")
+            p.add_run(f"購買量：{row.get('購買量_數值', 0)} kg\n")
         
-        link = str(row.get('購買單據連結', ''))
-        if link and 'drive.google.com' in link and can_dl:
-            match = re.search(r'/d/([a-zA-Z0-9_-]+)', link)
-            if match:
-                file_id = match.group(1)
-                try:
-                    meta = drive_service.files().get(fileId=file_id, fields='mimeType, name').execute()
-                    mime = meta.get('mimeType', '')
+            link = str(row.get('購買單據連結', ''))
+            if link and 'drive.google.com' in link and can_dl:
+                match = re.search(r'/d/([a-zA-Z0-9_-]+)', link)
+                if match:
+                    file_id = match.group(1)
+                    try:
+                        meta, file_bytes = prefetch.get(file_id)
+                        mime = meta.get('mimeType', '')
                     
-                    if mime.startswith('image/') or mime == 'application/pdf':
-                        p_img = doc.add_paragraph()
-                        p_img.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                        run_img = p_img.add_run()
+                        if mime.startswith('image/') or mime == 'application/pdf':
+                            p_img = doc.add_paragraph()
+                            p_img.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                            run_img = p_img.add_run()
                         
-                        if mime.startswith('image/'):
-                            request = drive_service.files().get_media(fileId=file_id)
-                            img_bytes = request.execute()
-                            try:
-                                # 1. 讀取並校正手機 EXIF 旋轉
-                                img = Image.open(io.BytesIO(img_bytes))
-                                img = ImageOps.exif_transpose(img)
-                                w, h = img.size
+                            if mime.startswith('image/'):
+                                img_bytes = file_bytes
+                                try:
+                                    # 1. 讀取並校正手機 EXIF 旋轉
+                                    img = Image.open(io.BytesIO(img_bytes))
+                                    img = ImageOps.exif_transpose(img)
+                                    w, h = img.size
                                 
-                                # 2. 轉為乾淨的 Bytes 給 Word
-                                corrected_bytes = io.BytesIO()
-                                img_format = img.format if img.format else 'JPEG'
-                                if img_format == 'JPEG' and img.mode in ('RGBA', 'P'):
-                                    img = img.convert('RGB')
-                                img.save(corrected_bytes, format=img_format)
-                                corrected_bytes.seek(0)
+                                    # 2. 轉為乾淨的 Bytes 給 Word
+                                    corrected_bytes = io.BytesIO()
+                                    img_format = img.format if img.format else 'JPEG'
+                                    if img_format == 'JPEG' and img.mode in ('RGBA', 'P'):
+                                        img = img.convert('RGB')
+                                    img.save(corrected_bytes, format=img_format)
+                                    corrected_bytes.seek(0)
                                 
-                                # 3. 暴力判定法：不看 DPI，直接看像素長寬比來決定高度
-                                if w >= h: 
-                                    # 橫式或正方形 -> 目標高度 10 公分
-                                    target_w = 10.0 * (w / h)
-                                    if target_w > 17.0: # 防止全景圖太寬超過 Word 邊界
-                                        run_img.add_picture(corrected_bytes, width=Cm(17.0))
-                                    else:
-                                        run_img.add_picture(corrected_bytes, height=Cm(10.0))
-                                else: 
-                                    # 直式 -> 目標高度 18 公分
-                                    target_w = 18.0 * (w / h)
-                                    if target_w > 17.0:
-                                        run_img.add_picture(corrected_bytes, width=Cm(17.0))
-                                    else:
-                                        run_img.add_picture(corrected_bytes, height=Cm(18.0))
-                            except Exception as e:
-                                # 若處理失敗的備案：統一塞入預設寬度
-                                run_img.add_picture(io.BytesIO(img_bytes), width=Cm(15.0))
-                        elif mime == 'application/pdf':
-                            try:
-                                request = drive_service.files().get_media(fileId=file_id)
-                                pdf_stream = io.BytesIO(request.execute())
-                                doc_pdf = fitz.open(stream=pdf_stream, filetype="pdf")
-                                if len(doc_pdf) > 0:
-                                    page = doc_pdf.load_page(0)
+                                    # 3. 暴力判定法：不看 DPI，直接看像素長寬比來決定高度
+                                    if w >= h: 
+                                        # 橫式或正方形 -> 目標高度 10 公分
+                                        target_w = 10.0 * (w / h)
+                                        if target_w > 17.0: # 防止全景圖太寬超過 Word 邊界
+                                            run_img.add_picture(corrected_bytes, width=Cm(17.0))
+                                        else:
+                                            run_img.add_picture(corrected_bytes, height=Cm(10.0))
+                                    else: 
+                                        # 直式 -> 目標高度 18 公分
+                                        target_w = 18.0 * (w / h)
+                                        if target_w > 17.0:
+                                            run_img.add_picture(corrected_bytes, width=Cm(17.0))
+                                        else:
+                                            run_img.add_picture(corrected_bytes, height=Cm(18.0))
+                                except Exception as e:
+                                    # 若處理失敗的備案：統一塞入預設寬度
+                                    run_img.add_picture(io.BytesIO(img_bytes), width=Cm(15.0))
+                            elif mime == 'application/pdf':
+                                try:
+                                    pdf_stream = io.BytesIO(file_bytes)
+                                    doc_pdf = fitz.open(stream=pdf_stream, filetype="pdf")
+                                    if len(doc_pdf) > 0:
+                                        page = doc_pdf.load_page(0)
                                     
-                                    # 1. 讀取 PDF 頁面的實際像素寬高，智慧判斷直橫式
-                                    rect = page.rect
-                                    if rect.width > rect.height:
-                                        pdf_height = Cm(10.0)  # 橫式 PDF 調整為 10 公分
-                                    else:
-                                        pdf_height = Cm(18.0)  # 直式 PDF 維持 18 公分
+                                        # 1. 讀取 PDF 頁面的實際像素寬高，智慧判斷直橫式
+                                        rect = page.rect
+                                        if rect.width > rect.height:
+                                            pdf_height = Cm(10.0)  # 橫式 PDF 調整為 10 公分
+                                        else:
+                                            pdf_height = Cm(18.0)  # 直式 PDF 維持 18 公分
                                         
-                                    # 2. 將 PDF 轉為圖片並帶入對應的高度設定
-                                    pix = page.get_pixmap(dpi=150)
-                                    img_stream = io.BytesIO(pix.tobytes("png"))
-                                    run_img.add_picture(img_stream, height=pdf_height)
-                                else:
-                                    doc.add_paragraph("⚠️ PDF檔為空或無法讀取")
-                            except Exception as e:
-                                doc.add_paragraph(f"⚠️ PDF轉檔圖片失敗，請點擊連結檢視：\n{link}")
-                    else: doc.add_paragraph(f"📎 附檔非圖片/PDF格式 ({meta.get('name', '未命名')})，請點擊下方連結檢視：\n{link}")
-                except Exception: doc.add_paragraph(f"📎 檔案讀取限制，請點擊連結檢視：\n{link}")
-        elif link: doc.add_paragraph(f"📎 單據連結：\n{link}")
-        else: doc.add_paragraph("⚠️ 無購買單據連結")
-        doc.add_page_break()
+                                        # 2. 將 PDF 轉為圖片並帶入對應的高度設定
+                                        pix = page.get_pixmap(dpi=150)
+                                        img_stream = io.BytesIO(pix.tobytes("png"))
+                                        run_img.add_picture(img_stream, height=pdf_height)
+                                    else:
+                                        doc.add_paragraph("⚠️ PDF檔為空或無法讀取")
+                                except Exception as e:
+                                    doc.add_paragraph(f"⚠️ PDF轉檔圖片失敗，請點擊連結檢視：\n{link}")
+                        else: doc.add_paragraph(f"📎 附檔非圖片/PDF格式 ({meta.get('name', '未命名')})，請點擊下方連結檢視：\n{link}")
+                    except Exception: doc.add_paragraph(f"📎 檔案讀取限制，請點擊連結檢視：\n{link}")
+            elif link: doc.add_paragraph(f"📎 單據連結：\n{link}")
+            else: doc.add_paragraph("⚠️ 無購買單據連結")
+            doc.add_page_break()
         
     buf = io.BytesIO(); doc.save(buf); return buf.getvalue()
 
@@ -347,13 +368,16 @@ def main():
     
     if 'reset_key' not in st.session_state: st.session_state.reset_key = 0
     rk = st.session_state.reset_key
-    df_inv, df_pur, df_trk = load_data()
+    # 三張工作表一次 batchGet (core.gas_data，與回報頁共用快取)
+    try: df_inv, df_pur, df_trk = load_gas_sheets()
+    except Exception as e: st.error(f"❌ 讀取氣體鋼瓶資料失敗，請稍後重新整理: {e}"); return
+    freshness_caption(load_gas_sheets)
     now_year_roc = datetime.datetime.now().year - 1911
     
     col_refresh = st.columns([8, 2])
     with col_refresh[1]:
         if st.button("🔄 強制刷新最新資料", use_container_width=True):
-            load_data.clear()
+            invalidate(SHEET_ID)
             cached_create_proof_word.clear() # 加上這行：強制清除舊 Word 檔暫存
             st.rerun()
 
@@ -421,9 +445,11 @@ def main():
                             for record in all_appends[-len(group):]: record[8] = "發送失敗"
                         my_bar.progress((idx+1)/total_groups, text=f"發送中 ({idx+1}/{total_groups})")
                     
-                    safe_append_rows(get_gc().open_by_key(SHEET_ID).worksheet('發送紀錄與金鑰'), all_appends)
+                    ws_trk = get_worksheet(SHEET_ID, '發送紀錄與金鑰')
+                    append_res = safe_append_rows(ws_trk, all_appends)
                     st.success(f"✅ 完成！成功寄出 {success_count} 位老師。")
-                    time.sleep(2); load_data.clear(); st.rerun()
+                    # 新金鑰直接併入回報頁的金鑰索引，老師點開連結時不必重新下載整張金鑰表
+                    time.sleep(2); register_tokens(ws_trk, all_appends, append_res); st.rerun()
 
     with tab2:
         if df_trk.empty: st.info("尚無發送追蹤紀錄。")
@@ -550,7 +576,7 @@ def main():
     with tab4:
         st.markdown("### 🛠️ 氣體鋼瓶資料庫管理")
         manage_mode = st.radio("選擇管理模式", ["➕ 新增實驗室與庫存", "🔄 現有庫存查詢與異動"], horizontal=True)
-        gc = get_gc(); ws_inv = gc.open_by_key(SHEET_ID).worksheet('氣體鋼瓶資料庫')
+        ws_inv = get_worksheet(SHEET_ID, '氣體鋼瓶資料庫')
         
         if manage_mode == "➕ 新增實驗室與庫存":
             with st.container():
@@ -585,7 +611,7 @@ def main():
                         if entry["gas"] != "請選擇": rows_to_append.append([a_dept, a_mgr, a_campus, a_room, a_mail, a_ext, entry["gas"], entry["qty"], entry["year"]])
                     if rows_to_append:
                         safe_append_rows(ws_inv, rows_to_append)
-                        st.success(f"✅ {a_mgr} 老師的庫存已建檔！"); st.session_state.reset_key += 1; time.sleep(1); load_data.clear(); st.rerun()
+                        st.success(f"✅ {a_mgr} 老師的庫存已建檔！"); st.session_state.reset_key += 1; time.sleep(1); invalidate(SHEET_ID, '氣體鋼瓶資料庫'); st.rerun()
                     else: st.error("請至少選擇一種氣體！")
 
         elif manage_mode == "🔄 現有庫存查詢與異動":
@@ -615,16 +641,15 @@ def main():
                     with ce6: e_ext = st.text_input("分機", value=str(base_row['分機']), key=f"e_e_{mgr_sel}_{room_sel}")
                     
                     st.markdown('<div style="background-color: #A393B3; padding: 12px 20px; border-radius: 8px; margin-bottom: 20px; margin-top: 20px;"><h3 style="color: #FFFFFF; margin: 0; font-weight: 600;">💨 氣體鋼瓶現有庫存與異動</h3></div>', unsafe_allow_html=True)
-                    collected_updates = []; all_rows = ws_inv.get_all_records()
+                    collected_updates = []
                     
                     for idx, row in target_df.iterrows():
                         gas_name = row['鋼瓶氣體種類']
-                        orig_idx = next((i + 2 for i, r in enumerate(all_rows) if str(r['系所'])==sel_dept and str(r['實驗室老師'])==mgr_sel and str(r['氣體鋼瓶所在位置實驗室門牌'])==room_sel and str(r['鋼瓶氣體種類'])==gas_name), -1)
                         uc1, uc2, uc3 = st.columns([2, 2, 1])
                         with uc1: st.text_input(f"氣體種類 (現有)", value=gas_name, disabled=True, key=f"ugn_{idx}")
                         with uc2: u_qty = st.number_input("鋼瓶數量", value=int(row['鋼瓶數量']), min_value=0, key=f"uq_{idx}_{mgr_sel}_{room_sel}")
                         with uc3: st.markdown("<br>", unsafe_allow_html=True); del_flag = st.checkbox("🗑️ 刪除", key=f"del_{idx}_{mgr_sel}_{room_sel}")
-                        collected_updates.append({"orig_idx": orig_idx, "gas": gas_name, "qty": u_qty, "delete": del_flag})
+                        collected_updates.append({"key": inv_row_key(sel_dept, mgr_sel, room_sel, gas_name), "gas": gas_name, "qty": u_qty, "delete": del_flag})
                         
                     st.markdown("<hr style='border-top: 1px dashed #B8A9C9; margin: 15px 0;'>", unsafe_allow_html=True)
                     st.markdown("#### ➕ 新增其他氣體種類至此實驗室")
@@ -640,7 +665,9 @@ def main():
                     if st.button("💾 儲存所有異動", type="primary", use_container_width=True):
                         with st.spinner("同步至雲端資料庫中..."):
                             batch_data = []; rows_to_delete = []; rows_to_append = []
+                            live_rows = read_inv_row_map(ws_inv)  # 寫入前以當下列號為準
                             for u in collected_updates:
+                                u["orig_idx"] = live_rows.get(u["key"], -1)
                                 if u["orig_idx"] != -1:
                                     if u["delete"]: rows_to_delete.append(u["orig_idx"])
                                     else:
@@ -660,7 +687,7 @@ def main():
                             if rows_to_append: safe_append_rows(ws_inv, rows_to_append)
                                 
                             st.success("✅ 實驗室資料與庫存已成功更新！")
-                            st.session_state.reset_key += 1; time.sleep(1); load_data.clear(); st.rerun()
+                            st.session_state.reset_key += 1; time.sleep(1); invalidate(SHEET_ID, '氣體鋼瓶資料庫'); st.rerun()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
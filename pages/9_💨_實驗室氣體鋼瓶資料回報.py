@@ -1,14 +1,18 @@
 import streamlit as st
 import streamlit.components.v1 as components
 import pandas as pd
-import gspread
 import datetime
 import time
 import io
 import os
 import re
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from core.gsheets import get_drive_service, get_worksheet
+from core.rate_limit import api_priority, PRIORITY_SUBMIT
+from core.cache_scope import invalidate
+from core.gas_data import load_gas_sheets
+from core.drive_cache import get_drive_file
+from core.token_index import lookup_token, patch_token, verify_token_row
+from core.sheet_writer import apply_requests, append_rows_request, delete_rows_requests, update_row_request
 from googleapiclient.http import MediaIoBaseUpload
 from docx import Document
 from docx.shared import Pt, Inches
@@ -81,26 +85,17 @@ def with_retry(max_retries=3, base_delay=1.5):
         return wrapper
     return decorator
 
-@st.cache_resource
-def get_credentials():
-    oauth_secrets = st.secrets["gcp_oauth"]
-    return Credentials(token=None, refresh_token=oauth_secrets["refresh_token"], client_id=oauth_secrets["client_id"], client_secret=oauth_secrets["client_secret"], token_uri="https://oauth2.googleapis.com/token")
-
-def get_gc(): return gspread.authorize(get_credentials())
-
-@st.cache_data(ttl=120, show_spinner=False)
+# 三張工作表由 core.gas_data 一次 batchGet 讀取，與管理後台共用同一份快取
 def fetch_tracker_records(): 
-    try: return get_gc().open_by_key(SHEET_ID).worksheet('發送紀錄與金鑰').get_all_records()
+    try: return load_gas_sheets().trk.to_dict('records')
     except: return []
 
-@st.cache_data(ttl=120, show_spinner=False)
 def fetch_main_inventory(): 
-    try: return get_gc().open_by_key(SHEET_ID).worksheet('氣體鋼瓶資料庫').get_all_records()
+    try: return load_gas_sheets().inv.to_dict('records')
     except: return []
 
-@st.cache_data(ttl=120, show_spinner=False)
 def fetch_pur_records():
-    try: return get_gc().open_by_key(SHEET_ID).worksheet('氣體鋼瓶年度使用紀錄').get_all_records()
+    try: return load_gas_sheets().pur.to_dict('records')
     except: return []
 
 @st.cache_data(ttl=600, show_spinner=False)
@@ -109,28 +104,42 @@ def get_drive_file_bytes_cached(file_url):
         match = re.search(r'/d/([a-zA-Z0-9_-]+)', file_url)
         if not match: return None, None, None
         file_id = match.group(1)
-        creds = get_credentials()
-        drive_service = build('drive', 'v3', credentials=creds)
-        meta = drive_service.files().get(fileId=file_id, fields='mimeType, name').execute()
-        mime = meta.get('mimeType', '')
-        request = drive_service.files().get_media(fileId=file_id)
-        file_stream = io.BytesIO(request.execute())
-        return file_stream.getvalue(), mime, meta.get('name', 'downloaded_file')
+        file_bytes, meta = get_drive_file(file_id)
+        return file_bytes, meta.get('mimeType', ''), meta.get('name', 'downloaded_file')
     except Exception as e:
         return None, None, None
 
-@with_retry(max_retries=3)
-def append_dicts(worksheet, list_of_dicts):
-    headers = worksheet.row_values(1)
-    if headers and list_of_dicts: 
-        worksheet.append_rows([[str(d.get(str(h).strip(), "")) for h in headers] for d in list_of_dicts])
+def dicts_to_rows(headers, list_of_dicts):
+    return [[str(d.get(str(h).strip(), "")) for h in headers] for d in list_of_dicts] if headers else []
 
 @with_retry(max_retries=3)
-def safe_delete_row(worksheet, idx): worksheet.delete_rows(idx)
+def read_submission_context(spreadsheet, trk_row_idx):
+    """一次 values.batchGet 取得庫存全表 (用於比對待刪列)、購買紀錄標題列與本次回報的金鑰列"""
+    res = spreadsheet.values_batch_get(["'氣體鋼瓶資料庫'", "'氣體鋼瓶年度使用紀錄'!1:1", f"'發送紀錄與金鑰'!{trk_row_idx}:{trk_row_idx}"])
+    inv_values, pur_head, trk_row = [vr.get('values', []) for vr in res.get('valueRanges', [])]
+    return inv_values, (pur_head[0] if pur_head else []), (trk_row[0] if trk_row else [])
+
+def is_rate_limited(e):
+    return getattr(getattr(e, "response", None), "status_code", None) == 429
+
+def commit_submission(worksheet, build_requests, max_retries=3, base_delay=1.5):
+    """送出原子寫入 (刪列 + 新增 + 狀態更新)。此批次不可重複送出，因此不能一律重試：
+    - 429：伺服器未處理，原請求重送
+    - 其他錯誤 (逾時、5xx、連線中斷)：無法確定是否已寫入，重新讀取後以最新列號重建請求；
+      build_requests() 回傳 None 代表前一次其實已寫入，直接結束"""
+    requests = build_requests()
+    attempt = 0
+    while requests is not None:
+        try: return apply_requests(worksheet, requests)
+        except Exception as e:
+            if attempt >= max_retries: raise
+            time.sleep(base_delay * (2 ** attempt)); attempt += 1
+            if not is_rate_limited(e): requests = build_requests()
+    return 0
 
 @with_retry(max_retries=3)
 def upload_to_drive(uploaded_file, file_name):
-    creds = get_credentials(); drive_service = build('drive', 'v3', credentials=creds)
+    drive_service = get_drive_service()
     file_metadata = {'name': file_name, 'parents': [FOLDER_ID]}
     uploaded_file.seek(0)
     media = MediaIoBaseUpload(io.BytesIO(uploaded_file.getvalue()), mimetype=uploaded_file.type, resumable=True)
@@ -305,8 +314,9 @@ def main():
 
     if st.session_state.get("token") != url_token:
         st.session_state.clear(); st.session_state.token = url_token
-        records = fetch_tracker_records()
-        record, row_idx = next(((r, i+2) for i, r in enumerate(records) if str(r.get("專屬金鑰(Token)")).strip() == url_token), (None, None))
+        # 金鑰索引：快取命中時 O(1) 查詢，不必下載整張金鑰表
+        try: record, row_idx = lookup_token(get_worksheet(SHEET_ID, '發送紀錄與金鑰'), url_token)
+        except Exception: record, row_idx = None, None
         
         if not record: st.error("🚫 無效的專屬連結，或連結已失效。"); st.stop()
             
@@ -580,16 +590,10 @@ def main():
             word_buf = create_report_docx(d, d['pur'], d['status'])
             
             def process_submission():
-                with st.spinner("資料同步中，請稍候..."):
-                    gc = get_gc(); sh_main = gc.open_by_key(SHEET_ID)
-                    ws_inv = sh_main.worksheet('氣體鋼瓶資料庫'); ws_pur = sh_main.worksheet('氣體鋼瓶年度使用紀錄'); ws_trk = sh_main.worksheet('發送紀錄與金鑰')
-                    
-                    all_inv_records = ws_inv.get_all_records()
-                    rows_to_del = [i + 2 for i, r in enumerate(all_inv_records) if str(r.get('系所', '')) == d['dept'] and str(r.get('實驗室老師', '')) == d['mgr'] and str(r.get('氣體鋼瓶所在位置實驗室門牌', '')) == st.session_state.room]
-                    for r_idx in sorted(rows_to_del, reverse=True): safe_delete_row(ws_inv, r_idx); time.sleep(0.3)
+                with st.spinner("資料同步中，請稍候..."), api_priority(PRIORITY_SUBMIT):
+                    ws_inv = get_worksheet(SHEET_ID, '氣體鋼瓶資料庫'); ws_pur = get_worksheet(SHEET_ID, '氣體鋼瓶年度使用紀錄'); ws_trk = get_worksheet(SHEET_ID, '發送紀錄與金鑰')
                     
                     inv_to_append = [{"系所": d['dept'], "實驗室老師": d['mgr'], "校區": d['campus'], "氣體鋼瓶所在位置實驗室門牌": d['room'], "電子郵件": d['mail'], "分機": d['ext'], "鋼瓶氣體種類": item["鋼瓶氣體種類"], "鋼瓶數量": item["鋼瓶數量"], "建檔年度": f"{datetime.datetime.now().year-1911}年"} for item in d['inv']]
-                    if inv_to_append: append_dicts(ws_inv, inv_to_append)
                     
                     pur_to_append = []
                     now_str = datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")
@@ -614,10 +618,28 @@ def main():
                             "年度氣體鋼瓶購買量(公斤)": 0, "購買單據連結": "-"
                         })
                         
-                    if pur_to_append: append_dicts(ws_pur, pur_to_append)
-                    
-                    ws_trk.update_cell(st.session_state.row_idx, 11, "已回報")
-                    ws_trk.update_cell(st.session_state.row_idx, 12, now_str)
+                    # 寫入：刪除舊庫存 → 新增庫存 → 新增購買紀錄 → 更新回報狀態，一次 batchUpdate 原子完成
+                    def build_requests():
+                        # 讀取：庫存全表 + 購買紀錄標題列 + 金鑰列 (一次 batchGet)；重試時重新讀取，列號以當下為準
+                        inv_values, pur_headers, trk_row = read_submission_context(ws_inv.spreadsheet, st.session_state.row_idx)
+                        # 金鑰索引可能已過時 (金鑰表列被刪除 / 重排)：核對該列金鑰，不符則重建索引取得正確列號，避免標記到其他老師的列
+                        row_idx, trk_row = verify_token_row(ws_trk, st.session_state.token, st.session_state.row_idx, trk_row)
+                        if row_idx is None: raise RuntimeError("找不到此專屬連結的發送紀錄，請重新開啟連結或聯繫環安中心")
+                        st.session_state.row_idx = row_idx
+                        if trk_row[10:12] == ["已回報", now_str]: return None  # 本次回報已寫入 (前一次送出逾時但伺服器已處理)
+                        inv_headers = inv_values[0] if inv_values else []
+                        all_inv_records = [dict(zip(inv_headers, r)) for r in inv_values[1:]]
+                        rows_to_del = [i + 2 for i, r in enumerate(all_inv_records) if str(r.get('系所', '')) == d['dept'] and str(r.get('實驗室老師', '')) == d['mgr'] and str(r.get('氣體鋼瓶所在位置實驗室門牌', '')) == st.session_state.room]
+                        inv_rows = dicts_to_rows(inv_headers, inv_to_append)
+                        pur_rows = dicts_to_rows(pur_headers, pur_to_append)
+                        requests = delete_rows_requests(ws_inv.id, rows_to_del)
+                        if inv_rows: requests.append(append_rows_request(ws_inv.id, inv_rows))
+                        if pur_rows: requests.append(append_rows_request(ws_pur.id, pur_rows))
+                        requests.append(update_row_request(ws_trk.id, st.session_state.row_idx, ["已回報", now_str], start_col=11))
+                        return requests
+                    commit_submission(ws_inv, build_requests)
+                    patch_token(ws_trk, st.session_state.token, {11: "已回報", 12: now_str})  # 同步更新金鑰索引並清除金鑰表快取
+                    invalidate(SHEET_ID, '氣體鋼瓶資料庫', '氣體鋼瓶年度使用紀錄')
                     st.session_state.status = "已回報"
 
             with col_btn2: